@@ -5,6 +5,8 @@ import logging
 from datetime import datetime, timedelta
 from collections import defaultdict, Counter
 from models import EmailRecord, WhitelistDomain
+from domain_classifier import refresh_domain_classifier, get_domain_classifier
+from attachment_keywords import get_attachment_keyword_index
 from app import db
 import re
 
@@ -93,8 +95,9 @@ class AdvancedMLEngine:
             # Data exfiltration patterns
             exfiltration_patterns = self._detect_exfiltration_patterns(records_with_attachments)
 
-            # Risk scoring distribution
-            risk_distribution = self._analyze_attachment_risk_distribution(records_with_attachments)
+            # Risk scoring distribution, with the configured attachment keywords loaded once
+            keyword_index = get_attachment_keyword_index()
+            risk_distribution = self._analyze_attachment_risk_distribution(records_with_attachments, keyword_index)
 
             analysis = {
                 'total_attachments': len(records_with_attachments),
@@ -102,8 +105,8 @@ class AdvancedMLEngine:
                 'malware_indicators': malware_indicators,
                 'exfiltration_patterns': exfiltration_patterns,
                 'risk_distribution': risk_distribution,
-                'top_risk_attachments': self._get_top_risk_attachments(records_with_attachments),
-                'recommendations': self._generate_attachment_recommendations(records_with_attachments)
+                'top_risk_attachments': self._get_top_risk_attachments(records_with_attachments, keyword_index),
+                'recommendations': self._generate_attachment_recommendations(records_with_attachments, keyword_index)
             }
 
             # Cache the result
@@ -129,6 +132,7 @@ class AdvancedMLEngine:
 
             # Sender analysis
             sender_profiles = {}
+            domain_classifier = refresh_domain_classifier()
 
             for record in records:
                 sender = record.sender or 'Unknown'
@@ -158,8 +162,7 @@ class AdvancedMLEngine:
                 # Communication patterns
                 if record.recipients_email_domain:
                     # Check if external (non-corporate) domain
-                    if any(ext in record.recipients_email_domain.lower() for ext in 
-                          ['gmail.com', 'yahoo.com', 'hotmail.com', 'outlook.com']):
+                    if domain_classifier.is_public(record.recipients_email_domain, 'advanced_analysis'):
                         profile['external_communications'] += 1
                     else:
                         profile['internal_communications'] += 1
@@ -806,7 +809,7 @@ class AdvancedMLEngine:
         }
 
         sensitive_types = ['database', 'backup', 'export', 'dump', 'customer', 'employee']
-        personal_domains = ['gmail.com', 'yahoo.com', 'hotmail.com', 'outlook.com']
+        domain_classifier = get_domain_classifier()
 
         for record in records:
             attachments_lower = record.attachments.lower()
@@ -820,8 +823,7 @@ class AdvancedMLEngine:
                 patterns['sensitive_file_types'] += 1
 
             # External personal domains
-            if record.recipients_email_domain and any(domain in record.recipients_email_domain.lower() 
-                                                     for domain in personal_domains):
+            if record.recipients_email_domain and domain_classifier.is_public(record.recipients_email_domain, 'advanced_analysis'):
                 patterns['external_personal_domains'] += 1
 
             # Off-hours (basic detection)
@@ -831,13 +833,13 @@ class AdvancedMLEngine:
 
         return patterns
 
-    def _analyze_attachment_risk_distribution(self, records):
+    def _analyze_attachment_risk_distribution(self, records, keyword_index=None):
         """Analyze the distribution of attachment risk scores"""
         risk_scores = []
 
         for record in records:
             # Calculate attachment-specific risk score
-            risk_score = self._calculate_detailed_attachment_risk(record.attachments)
+            risk_score = self._calculate_detailed_attachment_risk(record.attachments, keyword_index)
             risk_scores.append(risk_score)
 
         if not risk_scores:
@@ -852,7 +854,7 @@ class AdvancedMLEngine:
             'low_risk_count': sum(1 for score in risk_scores if score < 0.4)
         }
 
-    def _calculate_detailed_attachment_risk(self, attachments):
+    def _calculate_detailed_attachment_risk(self, attachments, keyword_index=None):
         """Calculate detailed attachment risk score"""
         if not attachments:
             return 0.0
@@ -876,14 +878,20 @@ class AdvancedMLEngine:
         if any(size in attachments_lower for size in ['large', 'big', 'huge']):
             risk_score += 0.2
 
+        # Attachment keywords from database
+        if keyword_index is None:
+            keyword_index = get_attachment_keyword_index()
+        for _, _, weight in keyword_index.matches(attachments_lower):
+            risk_score += weight
+
         return min(risk_score, 1.0)
 
-    def _get_top_risk_attachments(self, records):
+    def _get_top_risk_attachments(self, records, keyword_index=None):
         """Get top risky attachments with details"""
         attachment_risks = []
 
         for record in records:
-            risk_score = self._calculate_detailed_attachment_risk(record.attachments)
+            risk_score = self._calculate_detailed_attachment_risk(record.attachments, keyword_index)
             if risk_score > 0.5:
                 attachment_risks.append({
                     'record_id': record.record_id,
@@ -896,13 +904,13 @@ class AdvancedMLEngine:
 
         return sorted(attachment_risks, key=lambda x: x['risk_score'], reverse=True)[:20]
 
-    def _generate_attachment_recommendations(self, records):
+    def _generate_attachment_recommendations(self, records, keyword_index=None):
         """Generate recommendations based on attachment analysis"""
         recommendations = []
 
         # Count high-risk attachments
         high_risk_count = sum(1 for r in records 
-                            if self._calculate_detailed_attachment_risk(r.attachments) > 0.7)
+                            if self._calculate_detailed_attachment_risk(r.attachments, keyword_index) > 0.7)
 
         if high_risk_count > 0:
             recommendations.append(f"Immediately review {high_risk_count} high-risk attachments")
@@ -923,13 +931,7 @@ class AdvancedMLEngine:
 
     def _is_external_domain(self, domain):
         """Check if domain is external (not corporate)"""
-        if not domain:
-            return False
-
-        domain_lower = domain.lower()
-        # This would typically check against known corporate domains
-        corporate_indicators = ['company.com', 'corp.com', 'internal']
-        return not any(indicator in domain_lower for indicator in corporate_indicators)
+        return get_domain_classifier().is_external(domain)
 
     def _generate_behavior_flags(self, sender_data):
         """Generate behavior flags for sender analysis"""
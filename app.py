@@ -4,6 +4,7 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
+from performance_config import PROJECT_DIR, config
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -22,7 +23,7 @@ app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 database_url = os.environ.get("DATABASE_URL")
 if not database_url:
     # Use SQLite for local development
-    database_url = "sqlite:///instance/email_guardian.db"
+    database_url = f"sqlite:///{os.path.join(PROJECT_DIR, 'instance', 'email_guardian.db')}"
     
 app.config["SQLALCHEMY_DATABASE_URI"] = database_url
 app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
@@ -30,15 +31,15 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
     "pool_pre_ping": True,
 }
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB max file size
-app.config['UPLOAD_FOLDER'] = 'uploads'
+app.config['UPLOAD_FOLDER'] = os.path.join(PROJECT_DIR, 'uploads')
 
 # Initialize the app with the extension
 db.init_app(app)
 
 # Ensure upload directories exist
-os.makedirs('uploads', exist_ok=True)
-os.makedirs('data', exist_ok=True)
-os.makedirs('instance', exist_ok=True)
+os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+os.makedirs(config.data_dir, exist_ok=True)
+os.makedirs(os.path.join(PROJECT_DIR, 'instance'), exist_ok=True)
 
 with app.app_context():
     # Import models and routes
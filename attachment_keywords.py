@@ -0,0 +1,81 @@
+"""
+Attachment keyword index for Email Guardian
+Loads the active AttachmentKeyword rows once and compiles them into a single multi-pattern
+matcher returning the category and risk weight of every keyword found in an attachment list.
+The index is versioned by the keyword table's last modification, so scoring a session costs
+one version query and the keywords are only reloaded after they change.
+"""
+import logging
+import threading
+from models import AttachmentKeyword
+from pattern_matcher import PatternMatcher
+from app import db
+
+logger = logging.getLogger(__name__)
+
+# Risk weight per point of keyword risk score, by keyword category
+CATEGORY_WEIGHTS = {
+    'Suspicious': 0.1,
+    'Personal': 0.05
+}
+
+
+class AttachmentKeywordIndex:
+    """Compiled active attachment keywords"""
+
+    def __init__(self, keywords, version=None):
+        # (lower-cased keyword, category, weight) in table order
+        self.keywords = [(keyword, category, weight) for keyword, category, weight in keywords]
+        self.version = version
+        self._positions = {}
+        for position, (keyword, _, _) in enumerate(self.keywords):
+            self._positions.setdefault(keyword, []).append(position)
+        self._matcher = PatternMatcher(self._positions.keys())
+
+    @classmethod
+    def from_rows(cls, rows, version=None):
+        """Index of (keyword, category, risk_score) rows"""
+        keywords = []
+        for keyword, category, risk_score in rows:
+            factor = CATEGORY_WEIGHTS.get(category)
+            weight = (risk_score or 0) * factor if factor is not None else 0.0
+            keywords.append((keyword.lower(), category, weight))
+        return cls(keywords, version)
+
+    def matches(self, attachments_lower):
+        """(keyword, category, weight) of each keyword in a lower-cased attachment list, in table order"""
+        if not self.keywords:
+            return []
+        positions = sorted(position for keyword in self._matcher.find(attachments_lower)
+                           for position in self._positions[keyword])
+        return [self.keywords[position] for position in positions]
+
+    def __len__(self):
+        return len(self.keywords)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def _keyword_table_version():
+    """Row count, highest id and last modification of the keyword table"""
+    return tuple(db.session.query(
+        db.func.count(AttachmentKeyword.id),
+        db.func.max(AttachmentKeyword.id),
+        db.func.max(AttachmentKeyword.updated_at)
+    ).one())
+
+
+def get_attachment_keyword_index():
+    """Shared keyword index, reloaded when the keyword table changed"""
+    global _index
+    version = _keyword_table_version()
+    with _index_lock:
+        if _index is None or _index.version != version:
+            rows = db.session.query(
+                AttachmentKeyword.keyword, AttachmentKeyword.category, AttachmentKeyword.risk_score
+            ).filter(AttachmentKeyword.is_active == True).order_by(AttachmentKeyword.id).all()
+            _index = AttachmentKeywordIndex.from_rows(rows, version)
+            logger.info(f"Loaded {len(_index)} active attachment keywords")
+        return _index
@@ -0,0 +1,778 @@
+#!/usr/bin/env python3
+"""
+Performance benchmarks for Email Guardian
+Run individual benchmarks from the command line, e.g.
+
+    python benchmarks.py parsers --rows 1000000
+    python benchmarks.py rules --rows 200000
+    python benchmarks.py vectorized-rules --rows 100000 --random-rules 30
+    python benchmarks.py contains-rules --rows 50000 --rules 300
+    python benchmarks.py whitelist --rows 200000 --domains 2000
+    python benchmarks.py domain-classifier --rows 200000 --domains 5000
+    python benchmarks.py ml-scoring --rows 100000
+    python benchmarks.py attachment-keywords --rows 2000 --keywords 200
+    python benchmarks.py parallel-scoring --rows 2000000 --workers 1,2,4,8,16
+    python benchmarks.py bulk-update --rows 50000 --batch-sizes 100,1000,5000
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+# Add current directory to Python path
+sys.path.insert(0, str(Path(__file__).parent))
+
+# Benchmarks never touch the real database
+os.environ.setdefault('DATABASE_URL', 'sqlite:///:memory:')
+
+CSV_COLUMNS = [
+    '_time', 'sender', 'subject', 'attachments', 'recipients', 'recipients_email_domain',
+    'leaver', 'termination_date', 'wordlist_attachment', 'wordlist_subject', 'bunit',
+    'department', 'status', 'user_response', 'final_outcome', 'policy_name', 'justification'
+]
+
+
+def generate_synthetic_records(rows, seed=42):
+    """Generate a synthetic email export shaped like a real upload"""
+    rng = np.random.default_rng(seed)
+    domains = np.array(['vendor.org', 'external.com', 'gmail.com', 'partner.co.uk', 'tempmail.net', 'yahoo.com'])
+    users = np.array(['alice', 'bob', 'carol', 'dave', 'erin', 'frank'])
+    subjects = np.array(['Project Update', 'Quarterly Report', 'Invoice attached', 'Salary review', 'URGENT: payment'])
+    attachments = np.array(['', 'report.pdf', 'data.xlsx', 'setup.exe', 'archive.zip', 'contract.docx'])
+    words = np.array(['', 'confidential', 'salary', 'secret', 'payroll'])
+
+    domain = rng.choice(domains, rows)
+    times = pd.Timestamp('2025-07-01') + pd.to_timedelta(rng.integers(0, 30 * 24 * 3600, rows), unit='s')
+    return pd.DataFrame({
+        '_time': times.strftime('%Y-%m-%dT%H:%M:%S'),
+        'sender': np.char.add(rng.choice(users, rows), '@company.com'),
+        'subject': rng.choice(subjects, rows),
+        'attachments': rng.choice(attachments, rows),
+        'recipients': np.char.add(np.char.add(rng.choice(users, rows), '@'), domain),
+        'recipients_email_domain': domain,
+        'leaver': rng.choice(np.array(['YES', 'NO']), rows, p=[0.1, 0.9]),
+        'termination_date': rng.choice(np.array(['', '2025-11', '2025-08']), rows),
+        'wordlist_attachment': rng.choice(words, rows),
+        'wordlist_subject': rng.choice(words, rows),
+        'bunit': rng.choice(np.array(['Finance', 'Engineering', 'Sales']), rows),
+        'department': rng.choice(np.array(['Accounting', 'Platform', 'EMEA']), rows),
+        'status': rng.choice(np.array(['Low', 'Medium', 'High']), rows),
+        'user_response': rng.choice(np.array(['a', 'b', '']), rows),
+        'final_outcome': rng.choice(np.array(['f', 'g', '']), rows),
+        'policy_name': rng.choice(np.array(['policy_A', 'policy_B']), rows),
+        'justification': rng.choice(np.array(['', 'business need', 'personal backup', 'urgent client request']), rows)
+    }, columns=CSV_COLUMNS)
+
+
+# Representative rules covering every operator and AND/OR nesting
+SAMPLE_RULES = [
+    ('exclusion', 'Internal leaver PDFs', {'logic': 'AND', 'conditions': [
+        {'field': 'leaver', 'operator': 'equals', 'value': 'NO'},
+        {'field': 'attachments', 'operator': 'contains', 'value': '.pdf'}]}),
+    ('exclusion', 'Trusted partner', [{'field': 'recipients_email_domain', 'operator': 'ends_with', 'value': '.co.uk'},
+                                      {'field': 'justification', 'operator': 'is_not_empty', 'value': ''}]),
+    ('security', 'Leaver sending data', {'logic': 'AND', 'conditions': [
+        {'field': 'leaver', 'operator': 'equals', 'value': 'YES'},
+        {'logic': 'OR', 'conditions': [
+            {'field': 'attachments', 'operator': 'regex', 'value': r'\.(xlsx|zip|exe)$'},
+            {'field': 'wordlist_attachment', 'operator': 'is_not_empty', 'value': ''}]}]}),
+    ('security', 'Personal webmail', {'field': 'recipients_email_domain', 'operator': 'in_list',
+                                      'value': 'gmail.com, yahoo.com, tempmail.net'}),
+    ('security', 'Sensitive subject', {'logic': 'OR', 'conditions': [
+        {'field': 'subject', 'operator': 'contains', 'value': 'salary'},
+        {'field': 'subject', 'operator': 'starts_with', 'value': 'urgent'},
+        {'field': 'wordlist_subject', 'operator': 'in_list', 'value': ['secret', 'payroll']}]}),
+    ('security', 'Personal justification', [{'field': 'justification', 'operator': 'contains', 'value': 'personal'},
+                                             {'field': 'status', 'operator': 'not_equals', 'value': 'low'}])
+]
+
+
+def build_sample_rules():
+    """Create unsaved Rule objects for SAMPLE_RULES"""
+    from models import Rule
+    return [
+        Rule(id=index + 1, name=name, rule_type=rule_type, conditions=conditions, priority=len(SAMPLE_RULES) - index)
+        for index, (rule_type, name, conditions) in enumerate(SAMPLE_RULES)
+    ]
+
+
+# Awkward cell values mixed into the differential check's records
+EDGE_VALUES = [None, '', '   ', ' NULL ', 'N/A', 'none', ' Yes ', 'yes', '5', '12.5', '-3', 'nan', '1e3',
+               'GMAIL.COM', 'Salary\nreview', 'report.PDF ', 'personal, backup']
+
+RANDOM_RULE_FIELDS = ['sender', 'subject', 'attachments', 'recipients', 'recipients_email_domain', 'leaver',
+                      'termination_date', 'wordlist_attachment', 'wordlist_subject', 'bunit', 'department',
+                      'status', 'user_response', 'final_outcome', 'justification', 'policy_name',
+                      'ml_anomaly_score', 'whitelisted', 'missing_field']
+
+RANDOM_RULE_VALUES = ['', 'yes', 'NO', '.pdf', 'gmail.com, yahoo.com', ['secret', 'payroll'], '5', '10.5', '-1',
+                      r'\.(zip|exe)$', r'^sal', '[', 'none', 'urgent', 'a', 'e', 'company.com', 'n/a']
+
+RANDOM_RULE_ACTIONS = [None, {}, {'escalate': True}, {'flag': True}, {'flag': True, 'flag_message': 'Check'},
+                       {'score_modifier': 0.2}, {'score_modifier': -0.5}, {'tag': 'exfil'}, {'assign_to': 'analyst'},
+                       {'escalate': True, 'tag': 'leaver', 'score_modifier': '0.1'}]
+
+
+def random_rule_conditions(rng, depth=0):
+    """Random condition JSON, including nested groups and malformed operands"""
+    if depth < 2 and rng.random() < 0.4:
+        return {'logic': rng.choice(['AND', 'OR', 'or']),
+                'conditions': [random_rule_conditions(rng, depth + 1) for _ in range(rng.randint(1, 3))]}
+    return {'field': rng.choice(RANDOM_RULE_FIELDS),
+            'operator': rng.choice(['equals', 'contains', 'not_equals', 'not_contains', 'starts_with', 'ends_with',
+                                    'in_list', 'greater_than', 'less_than', 'regex', 'is_empty', 'is_not_empty']),
+            'value': rng.choice(RANDOM_RULE_VALUES)}
+
+
+def synthetic_record_objects(rows):
+    """Synthetic records as attribute objects shaped like EmailRecord"""
+    df = generate_synthetic_records(rows).rename(columns={'_time': 'time'})
+    fields = list(df.columns)
+    return [
+        SimpleNamespace(record_id=f"bench_{index}", **dict(zip(fields, values)))
+        for index, values in enumerate(zip(*[df[field].fillna('').tolist() for field in fields]))
+    ]
+
+
+def write_synthetic_csv(rows, path):
+    """Write a synthetic CSV upload to path"""
+    generate_synthetic_records(rows).to_csv(path, index=False)
+    return path
+
+
+def benchmark_parsers(args):
+    """Compare the pandas and pyarrow CSV parser engines on a synthetic upload"""
+    from data_processor import DataProcessor, pa
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_path = os.path.join(tmp_dir, 'synthetic.csv')
+        print(f"Generating synthetic CSV with {args.rows:,} rows...")
+        write_synthetic_csv(args.rows, csv_path)
+        print(f"File size: {os.path.getsize(csv_path) / (1024 * 1024):.1f} MB")
+
+        engines = ['pandas'] + (['pyarrow'] if pa is not None else [])
+        if pa is None:
+            print("pyarrow is not installed - only the pandas engine will be measured")
+
+        processor = DataProcessor()
+        results = {}
+        for engine in engines:
+            processor.parser_engine = engine
+
+            # Parsing only
+            started = time.perf_counter()
+            rows = sum(len(chunk_df) for chunk_df, _ in processor._read_csv_chunks(csv_path, args.chunk_size))
+            parse_elapsed = time.perf_counter() - started
+
+            # Parsing plus column mapping, i.e. everything before the database insert
+            started = time.perf_counter()
+            rows = 0
+            column_mapping = None
+            for chunk_df, _ in processor._read_csv_chunks(csv_path, args.chunk_size):
+                if column_mapping is None:
+                    column_mapping = processor._build_column_mapping(chunk_df.columns)
+                rows += len(processor._map_chunk_columns('bench', chunk_df, column_mapping, rows))
+            elapsed = time.perf_counter() - started
+            results[engine] = (parse_elapsed, elapsed)
+            print(f"{engine:>8}: parse {parse_elapsed:.2f}s ({rows / parse_elapsed:,.0f} rows/sec), "
+                  f"parse + map {elapsed:.2f}s ({rows / elapsed:,.0f} rows/sec)")
+
+        if 'pyarrow' in results:
+            print(f"Speedup (pandas / pyarrow): parse {results['pandas'][0] / results['pyarrow'][0]:.2f}x, "
+                  f"parse + map {results['pandas'][1] / results['pyarrow'][1]:.2f}x")
+
+
+def benchmark_rules(args):
+    """Compare the condition interpreter with compiled rule predicates"""
+    from rule_engine import RuleEngine
+    from rule_compiler import RecordContext
+
+    records = synthetic_record_objects(args.rows)
+    rules = build_sample_rules()
+    engine = RuleEngine()
+    print(f"Evaluating {len(rules)} rules against {len(records):,} records")
+
+    started = time.perf_counter()
+    interpreted = [[engine._evaluate_rule_conditions(record, rule) for rule in rules] for record in records]
+    interpreted_elapsed = time.perf_counter() - started
+
+    started = time.perf_counter()
+    compiled_rules = [engine.rule_compiler.compile(rule) for rule in rules]
+    compiled = []
+    for record in records:
+        context = RecordContext(record)
+        compiled.append([compiled_rule.predicate(context) for compiled_rule in compiled_rules])
+    compiled_elapsed = time.perf_counter() - started
+
+    mismatches = sum(1 for a, b in zip(interpreted, compiled) if a != b)
+    evaluations = len(records) * len(rules)
+    print(f"Interpreted: {interpreted_elapsed:.2f}s ({evaluations / interpreted_elapsed:,.0f} rule evaluations/sec)")
+    print(f"   Compiled: {compiled_elapsed:.2f}s ({evaluations / compiled_elapsed:,.0f} rule evaluations/sec)")
+    print(f"Speedup: {interpreted_elapsed / compiled_elapsed:.1f}x, mismatching records: {mismatches}")
+
+
+def benchmark_vectorized_rules(args):
+    """Differential check and timing of the row, vectorized, SQL pushdown and condition-ordered rule evaluation"""
+    from sqlalchemy import insert
+    from app import db
+    from models import ProcessingSession, EmailRecord, Rule
+    from rule_engine import RuleEngine
+
+    rng = random.Random(args.seed)
+    df = generate_synthetic_records(args.rows, seed=args.seed).rename(columns={'_time': 'time'})
+    records = df.to_dict('records')
+    for record in records:
+        for field in df.columns:
+            if rng.random() < 0.05:
+                record[field] = rng.choice(EDGE_VALUES)
+        record['whitelisted'] = rng.random() < 0.1
+        record['ml_anomaly_score'] = rng.choice([None, 0.1, 0.7, 12.0])
+        record['ml_risk_score'] = rng.choice([None, 0.2, 0.95])
+        record['notes'] = rng.choice([None, 'Reviewed'])
+
+    # Sample rules with actions plus random rules, saved so every evaluator loads them the same way
+    Rule.query.delete()
+    for index, (rule_type, name, conditions) in enumerate(SAMPLE_RULES):
+        db.session.add(Rule(name=name, rule_type=rule_type, conditions=conditions, priority=index,
+                            actions=RANDOM_RULE_ACTIONS[index % len(RANDOM_RULE_ACTIONS)]))
+    for index in range(args.random_rules):
+        rule_type = rng.choice(['exclusion', 'security', 'security', 'security'])
+        conditions = random_rule_conditions(rng)
+        if rule_type == 'exclusion':
+            # Keep most records in scope for the security rules
+            conditions = {'logic': 'AND', 'conditions': [{'field': 'status', 'operator': 'equals', 'value': 'High'},
+                                                         conditions]}
+        db.session.add(Rule(name=f"Random rule {index}", rule_type=rule_type, conditions=conditions,
+                            priority=rng.randint(0, 10), actions=rng.choice(RANDOM_RULE_ACTIONS)))
+    db.session.commit()
+
+    engine = RuleEngine()
+    columns = [column.name for column in EmailRecord.__table__.columns if column.name not in ('id', 'session_id')]
+    results = {}
+    # (label, Python evaluator, exclusion rules pushed down to SQL); runs after the first compile
+    # their conditions in the order suggested by the statistics the earlier runs recorded
+    for label, evaluator, sql_pushdown in (('row', 'row', False), ('vectorized', 'vectorized', False),
+                                           ('sql', 'row', True), ('ordered', 'row', False)):
+        session_id = f"verify-{label}"
+        EmailRecord.query.filter_by(session_id=session_id).delete()
+        db.session.merge(ProcessingSession(id=session_id, filename='synthetic.csv'))
+        db.session.execute(insert(EmailRecord), [
+            dict(record, session_id=session_id, record_id=f"record_{index}") for index, record in enumerate(records)
+        ])
+        db.session.commit()
+
+        engine.rule_evaluator = evaluator
+        engine.sql_pushdown = sql_pushdown
+        started = time.perf_counter()
+        excluded = engine.apply_exclusion_rules(session_id)
+        exclusion_elapsed = time.perf_counter() - started
+        started = time.perf_counter()
+        matches = engine.apply_security_rules(session_id)
+        security_elapsed = time.perf_counter() - started
+        db.session.expunge_all()
+
+        results[label] = db.session.query(*[getattr(EmailRecord, column) for column in columns]).filter_by(
+            session_id=session_id).order_by(EmailRecord.id).all()
+        print(f"{label:>10}: exclusion {exclusion_elapsed:.2f}s ({excluded:,} excluded), "
+              f"security {security_elapsed:.2f}s ({len(matches):,} matches)")
+
+    mismatches = 0
+    for label in ('vectorized', 'sql', 'ordered'):
+        for row_record, other_record in zip(results['row'], results[label]):
+            for column, expected, actual in zip(columns, row_record, other_record):
+                if column == 'escalated_at':
+                    # Timestamps differ between runs, only whether the record was escalated must match
+                    expected, actual = expected is None, actual is None
+                if expected != actual:
+                    mismatches += 1
+                    if mismatches <= 10:
+                        print(f"Mismatch in {row_record[0]}.{column}: row={expected!r} {label}={actual!r}")
+    print(f"Compared {len(results['row']):,} records across {len(columns)} columns: {mismatches} mismatches")
+    if mismatches:
+        sys.exit(1)
+
+
+def benchmark_contains_rules(args):
+    """Compare per-condition substring scans with multi-pattern matching on many contains rules"""
+    from models import Rule
+    from rule_engine import RuleEngine
+    from rule_compiler import RecordContext, contains_literals
+    from pattern_matcher import PatternMatcher, ahocorasick
+    from performance_config import config
+
+    rng = random.Random(args.seed)
+    records = synthetic_record_objects(args.rows)
+    fields = ['subject', 'attachments', 'wordlist_subject', 'justification']
+    vocabulary = sorted({str(getattr(record, field)).lower() for record in records[:1000] for field in fields})
+    vocabulary = [value for value in vocabulary if value]
+
+    def random_literal():
+        # Substrings of real values, so a realistic share of the conditions match
+        value = rng.choice(vocabulary)
+        start = rng.randrange(len(value))
+        return value[start:start + rng.randint(2, 8)] + ('' if rng.random() < 0.7 else rng.choice('xyz0'))
+
+    rules = []
+    for index in range(args.rules):
+        conditions = [{'field': rng.choice(fields), 'operator': rng.choice(['contains', 'contains', 'not_contains']),
+                       'value': random_literal()} for _ in range(rng.randint(1, 3))]
+        rules.append(Rule(id=index + 1, name=f"Contains rule {index}", conditions={'logic': rng.choice(['AND', 'OR']),
+                                                                                   'conditions': conditions}))
+
+    engine = RuleEngine()
+    compiled_rules = engine.compile_rules(rules)
+    # Built directly, rule evaluation only uses matchers with pyahocorasick installed
+    literals_by_field = {}
+    for compiled_rule in compiled_rules:
+        if compiled_rule.tree is not None:
+            contains_literals(compiled_rule.tree, literals_by_field)
+    matchers = {field: PatternMatcher(literals) for field, literals in literals_by_field.items()
+                if len(literals) >= config.pattern_matcher_min_literals}
+    print(f"Evaluating {len(rules)} contains rules against {len(records):,} records "
+          f"({'pyahocorasick' if ahocorasick is not None else 'pure-Python automaton'}, "
+          f"{sum(len(matcher.literals) for matcher in matchers.values())} literals in {len(matchers)} matchers)")
+
+    results = {}
+    for label, field_matchers in (('per-condition', None), ('multi-pattern', matchers)):
+        started = time.perf_counter()
+        results[label] = [
+            [compiled_rule.predicate(context) for compiled_rule in compiled_rules]
+            for context in (RecordContext(record, field_matchers) for record in records)
+        ]
+        elapsed = time.perf_counter() - started
+        results[label + ' elapsed'] = elapsed
+        print(f"{label:>14}: {elapsed:.2f}s ({len(records) * len(rules) / elapsed:,.0f} rule evaluations/sec)")
+
+    mismatches = sum(1 for a, b in zip(results['per-condition'], results['multi-pattern']) if a != b)
+    print(f"Speedup: {results['per-condition elapsed'] / results['multi-pattern elapsed']:.1f}x, "
+          f"mismatching records: {mismatches}")
+    if mismatches:
+        sys.exit(1)
+
+
+def benchmark_whitelist(args):
+    """Compare per-record whitelist scans with the reversed-label suffix index"""
+    from whitelist_index import WhitelistIndex
+
+    rng = random.Random(args.seed)
+    labels = ['mail', 'corp', 'vendor', 'partner', 'a', 'co', 'secure', 'eu', 'gmail', 'data', 'cloud', 'net']
+    tlds = ['com', 'org', 'co.uk', 'net', 'io']
+
+    def random_domain():
+        return '.'.join(rng.choice(labels) + str(rng.randrange(50)) if rng.random() < 0.5 else rng.choice(labels)
+                        for _ in range(rng.randint(1, 3))) + '.' + rng.choice(tlds)
+
+    whitelist = {random_domain() for _ in range(args.domains)}
+    distinct = [random_domain() for _ in range(args.rows // 20)] + \
+               [rng.choice(labels) + '.' + domain for domain in rng.sample(sorted(whitelist), min(len(whitelist), 500))]
+    record_domains = [rng.choice(distinct) for _ in range(args.rows)]
+    print(f"Matching {len(record_domains):,} records ({len(set(record_domains)):,} distinct domains) "
+          f"against {len(whitelist):,} whitelisted domains")
+
+    def legacy_scan(domain):
+        # Per-record loop of earlier versions
+        if domain in whitelist:
+            return True
+        return any(domain.endswith('.' + w) or w.endswith('.' + domain) or domain in w or w in domain for w in whitelist)
+
+    scanned = record_domains[:args.scan_rows]
+    started = time.perf_counter()
+    legacy = [legacy_scan(domain) for domain in scanned]
+    elapsed = time.perf_counter() - started
+    print(f"  per-record scan: {elapsed / len(scanned) * len(record_domains):.2f}s "
+          f"(extrapolated from {len(scanned):,} records)")
+
+    results = {}
+    for mode in ('legacy', 'suffix'):
+        started = time.perf_counter()
+        index = WhitelistIndex(whitelist, mode)
+        results[mode] = [index.match(domain) is not None for domain in record_domains]
+        print(f"  {mode + ' index':>15}: {time.perf_counter() - started:.2f}s")
+
+    # Suffix matching is exactly "the domain or one of its parent domains is whitelisted"
+    suffix_index = WhitelistIndex(whitelist)
+    suffix_mismatches = sum(1 for domain in set(distinct)
+                            if (suffix_index.match(domain) is not None) !=
+                            (domain in whitelist or any(domain.endswith('.' + w) for w in whitelist)))
+    legacy_mismatches = sum(1 for a, b in zip(legacy, results['legacy']) if a != b)
+    print(f"Records whitelisted: legacy {sum(results['legacy']):,}, suffix {sum(results['suffix']):,}; "
+          f"mismatches: legacy index {legacy_mismatches}, suffix index {suffix_mismatches}")
+    if legacy_mismatches or suffix_mismatches:
+        sys.exit(1)
+
+
+def benchmark_domain_classifier(args):
+    """Compare per-record domain list scans with the shared domain classifier"""
+    import re
+    from domain_classifier import DomainClassifier
+    from ml_config import MLRiskConfig
+
+    rng = random.Random(args.seed)
+    labels = ['mail', 'corp', 'vendor', 'partner', 'secure', 'eu', 'data', 'cloud', 'temp', 'online']
+    tlds = ['com', 'org', 'co.uk', 'net', 'io', 'de', 'tk']
+    known = MLRiskConfig.PUBLIC_DOMAIN_LISTS['free_email'] + [keyword + '.net' for keyword in MLRiskConfig.DISPOSABLE_DOMAIN_KEYWORDS]
+
+    def random_domain():
+        if rng.random() < 0.3:
+            return (rng.choice(labels) + '.' if rng.random() < 0.2 else '') + rng.choice(known)
+        return '.'.join(rng.choice(labels) + str(rng.randrange(100)) for _ in range(rng.randint(1, 2))) + \
+            '.' + rng.choice(tlds)
+
+    distinct = [random_domain() for _ in range(args.domains)]
+    record_domains = [rng.choice(distinct) for _ in range(args.rows)]
+    print(f"Classifying {len(record_domains):,} records ({len(set(record_domains)):,} distinct domains)")
+
+    disposable = ['tempmail', 'guerrillamail', '10minutemail', 'mailinator', 'throwaway', 'temp-mail', 'discard.email']
+    public = ['gmail.com', 'yahoo.com', 'hotmail.com', 'outlook.com', 'aol.com', 'icloud.com']
+    patterns = [r'\.com$', r'\.corp$', r'\.org$', r'\.gov$', r'\.edu$', r'gmail\.com$', r'yahoo\.com$',
+                r'hotmail\.com$', r'outlook\.com$', r'\.tk$', r'\.ml$', r'\.ga$', r'\.cf$', r'temp.*\.com$']
+
+    started = time.perf_counter()
+    for domain in record_domains:
+        # Feature engineering, risk scoring and explanation scans of earlier versions
+        for _ in range(3):
+            any(sus in domain for sus in disposable)
+            any(pub in domain for pub in public)
+        any(re.search(pattern, domain) for pattern in patterns)
+    print(f"  per-record scans: {time.perf_counter() - started:.2f}s")
+
+    started = time.perf_counter()
+    classifier = DomainClassifier(DomainClassifier.config_lists())
+    categories = classifier.classify_values(record_domains)
+    print(f"  classifier: {time.perf_counter() - started:.2f}s")
+
+    # Disposable keywords keep substring matching; public domains match themselves and their subdomains
+    public_domains = set(MLRiskConfig.PUBLIC_DOMAIN_LISTS['ml_scoring'])
+    mismatches = 0
+    for domain, category in zip(record_domains, categories):
+        parts = domain.split('.')
+        expected_disposable = any(keyword in domain for keyword in MLRiskConfig.DISPOSABLE_DOMAIN_KEYWORDS)
+        expected_public = not expected_disposable and parts[-1] not in MLRiskConfig.SUSPICIOUS_TLDS and \
+            any('.'.join(parts[index:]) in public_domains for index in range(len(parts)))
+        if (category == 'disposable') != expected_disposable or (category == 'public') != expected_public:
+            mismatches += 1
+    print(f"Disposable {categories.count('disposable'):,}, public {categories.count('public'):,}; "
+          f"mismatches: {mismatches}")
+    if mismatches:
+        sys.exit(1)
+
+
+def benchmark_ml_scoring(args):
+    """Compare per-row ML feature engineering and risk scoring with the column operations"""
+    from attachment_keywords import get_attachment_keyword_index
+    from ml_engine import MLEngine, LEAVER_VALUES
+
+    rng = random.Random(args.seed)
+    attachments = ['', '', 'report.pdf', 'setup.exe', 'archive.zip; notes.docx', 'hidden invoice.xlsx', 'run.js.pdf']
+    df = pd.DataFrame({
+        'subject': [rng.choice(['', 'Quarterly report', 'Re: invoice', 'x' * rng.randrange(80)]) for _ in range(args.rows)],
+        'attachments': [rng.choice(attachments) for _ in range(args.rows)],
+        'wordlist_attachment': [rng.choice(['', '', 'secret']) for _ in range(args.rows)],
+        'wordlist_subject': [rng.choice(['', '', '', 'salary']) for _ in range(args.rows)],
+        'domain_category': [rng.choice(['corporate', 'public', 'disposable', 'suspicious']) for _ in range(args.rows)],
+        'time': [rng.choice(['', '09:30', '23:10', 'weekend 11:00', 'Weekend 02:15']) for _ in range(args.rows)],
+        'leaver': [rng.choice(['', 'No', 'YES', 'true', '1']) for _ in range(args.rows)],
+        'justification': [rng.choice(['', 'business need', 'Urgent', 'sent by mistake']) for _ in range(args.rows)]
+    })
+    anomaly_scores = np.array([rng.random() for _ in range(args.rows)])
+    engine = MLEngine()
+    print(f"Scoring {args.rows:,} records")
+
+    started = time.perf_counter()
+    keyword_index = get_attachment_keyword_index()
+    features, risk_scores = [], []
+    for i, row in enumerate(df.itertuples(index=False)):
+        # Row loop of earlier versions
+        attachment_risk = engine._calculate_attachment_risk(row.attachments, keyword_index)
+        is_leaver = row.leaver.lower() in LEAVER_VALUES
+        has_wordlist_match = bool(row.wordlist_attachment or row.wordlist_subject)
+        is_weekend = 'weekend' in row.time.lower()
+        features.append([
+            len(row.subject), 1 if row.attachments else 0, 1 if has_wordlist_match else 0,
+            1 if row.domain_category == 'disposable' else 0, 1 if row.domain_category == 'public' else 0,
+            1 if is_weekend else 0,
+            1 if any(hour in row.time for hour in ['22:', '23:', '00:', '01:', '02:', '03:', '04:', '05:']) else 0,
+            1 if is_leaver else 0, attachment_risk, len(row.justification), 1 if row.justification else 0
+        ])
+        rule_risk = 0.0
+        if is_leaver:
+            rule_risk += 0.3
+        if row.domain_category == 'disposable':
+            rule_risk += 0.5
+        elif row.domain_category == 'public':
+            rule_risk += 0.1
+        rule_risk += attachment_risk * 0.3
+        if has_wordlist_match:
+            rule_risk += 0.2
+        if is_weekend:
+            rule_risk += 0.1
+        if any(term in row.justification.lower() for term in ['urgent', 'confidential', 'personal', 'mistake', 'wrong']):
+            rule_risk += 0.1
+        risk_scores.append(min(anomaly_scores[i] * 0.4 + rule_risk * 0.6, 1.0))
+    features, risk_scores = np.array(features), np.array(risk_scores)
+    print(f"  row loop: {time.perf_counter() - started:.2f}s")
+
+    started = time.perf_counter()
+    df['attachment_risk'] = engine._calculate_attachment_risks(df['attachments'])
+    vectorized_features = engine._engineer_features(df)
+    vectorized_scores = engine._calculate_risk_scores(df, anomaly_scores)
+    print(f"  column operations: {time.perf_counter() - started:.2f}s")
+
+    feature_mismatches = int(np.count_nonzero((features != vectorized_features).any(axis=1)))
+    score_mismatches = int(np.count_nonzero(risk_scores.view(np.int64) != vectorized_scores.view(np.int64)))
+    print(f"Mismatches: features {feature_mismatches}, risk scores {score_mismatches}")
+    if feature_mismatches or score_mismatches:
+        sys.exit(1)
+
+
+def benchmark_attachment_keywords(args):
+    """Compare a keyword table query per attachment scan with the cached keyword index"""
+    from sqlalchemy import event
+    from app import db
+    from models import AttachmentKeyword
+    from attachment_keywords import get_attachment_keyword_index
+
+    rng = random.Random(args.seed)
+    words = ['salary', 'payroll', 'invoice', 'photo', 'contract', 'passport', 'budget', 'resume', 'backup', 'client']
+    AttachmentKeyword.query.delete()
+    for index in range(args.keywords):
+        db.session.add(AttachmentKeyword(keyword=f"{rng.choice(words)}{index if index >= len(words) else ''}",
+                                         category=rng.choice(['Business', 'Personal', 'Suspicious']),
+                                         risk_score=rng.randint(1, 10), is_active=rng.random() < 0.9))
+    db.session.commit()
+    attachments = ['; '.join(f"{rng.choice(words)}{rng.randrange(args.keywords)}.{rng.choice(['pdf', 'xlsx', 'jpg'])}"
+                             for _ in range(rng.randint(1, 3))) for _ in range(args.rows)]
+    print(f"Scanning {args.rows:,} attachment lists against {args.keywords:,} keywords")
+
+    statements = []
+    listener = lambda *_: statements.append(1)
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        started = time.perf_counter()
+        legacy = []
+        for value in attachments:
+            # Feature engineering, risk scoring and explanations each loaded the keywords again
+            for _ in range(3):
+                risk = 0.0
+                for keyword in AttachmentKeyword.query.filter_by(is_active=True).all():
+                    if keyword.keyword.lower() in value.lower():
+                        if keyword.category == 'Suspicious':
+                            risk += keyword.risk_score * 0.1
+                        elif keyword.category == 'Personal':
+                            risk += keyword.risk_score * 0.05
+            legacy.append(risk)
+        print(f"  query per scan: {time.perf_counter() - started:.2f}s, {len(statements):,} queries")
+
+        # The first session loads the keywords, later ones only check the table version
+        for label in ('keyword index, first session', 'keyword index, cached'):
+            statements.clear()
+            started = time.perf_counter()
+            keyword_index = get_attachment_keyword_index()
+            codes, uniques = pd.factorize(pd.Series(attachments))
+            risks = []
+            for value in uniques:
+                risk = 0.0
+                for _, _, weight in keyword_index.matches(value.lower()):
+                    if weight:
+                        risk += weight
+                risks.append(risk)
+            indexed = [risks[code] for code in codes]
+            print(f"  {label}: {time.perf_counter() - started:.2f}s, {len(statements):,} queries")
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+
+    mismatches = sum(1 for expected, actual in zip(legacy, indexed) if expected != actual)
+    print(f"Mismatches: {mismatches}")
+    if mismatches:
+        sys.exit(1)
+
+
+def benchmark_parallel_scoring(args):
+    """Compare in-process anomaly scoring with sharded scoring across worker processes"""
+    from model_registry import fit_anomaly_model
+    from parallel_scoring import ScoringExecutor
+
+    rng = np.random.default_rng(args.seed)
+    # Feature rows shaped like MLEngine's: lengths, flags and the attachment risk
+    features = np.column_stack([
+        rng.integers(0, 120, args.rows), rng.integers(0, 2, (args.rows, 7)), rng.random(args.rows),
+        rng.integers(0, 200, args.rows), rng.integers(0, 2, args.rows)
+    ]).astype(float)
+    model = fit_anomaly_model(features[:args.training_rows])
+    print(f"Scoring {args.rows:,} records with a forest of {len(model.forest.estimators_)} trees")
+
+    started = time.perf_counter()
+    expected = model.score(features)
+    baseline = time.perf_counter() - started
+    print(f"  in process: {baseline:.2f}s")
+
+    mismatches = 0
+    for workers in [int(value) for value in args.workers.split(',')]:
+        executor = ScoringExecutor(workers=workers, shard_size=max(1, args.rows // workers))
+        # Start the pool and load the model in every worker before timing
+        executor.score(model, features[:executor.shard_size * workers])
+        started = time.perf_counter()
+        scores = executor.score(model, features)
+        elapsed = time.perf_counter() - started
+        executor.release(model)
+        executor.shutdown()
+        mismatches += int(np.count_nonzero(scores != expected))
+        print(f"  {workers:>2} workers: {elapsed:.2f}s ({baseline / elapsed:.1f}x)")
+
+    print(f"Mismatches: {mismatches}")
+    if mismatches:
+        sys.exit(1)
+
+
+def benchmark_bulk_update(args):
+    """Compare writing ML results through ORM objects with executemany updates by primary key"""
+    import uuid
+    from sqlalchemy import event
+    from app import db
+    from models import EmailRecord, ProcessingSession
+    from bulk_updates import bulk_update_by_id
+
+    session_id = str(uuid.uuid4())
+    db.session.add(ProcessingSession(id=session_id, filename='benchmark.csv'))
+    db.session.bulk_insert_mappings(EmailRecord, [
+        {'session_id': session_id, 'record_id': f"record_{index}", 'sender': f"user{index}@example.com"}
+        for index in range(args.rows)
+    ])
+    db.session.commit()
+    ids = [record_id for record_id, in db.session.query(EmailRecord.id).filter_by(session_id=session_id)]
+    rng = np.random.default_rng(args.seed)
+    print(f"Writing ML results of {len(ids):,} records")
+
+    def results():
+        # Fresh values every run, so no update is skipped as unchanged
+        anomaly_scores, risk_scores = rng.random(len(ids)), rng.random(len(ids))
+        levels = np.where(risk_scores > 0.8, 'Critical', np.where(risk_scores > 0.5, 'High', 'Low'))
+        return [{'id': record_id, 'ml_anomaly_score': float(anomaly), 'ml_risk_score': float(risk),
+                 'risk_level': str(level), 'ml_explanation': f"Benchmark result {risk:.3f}"}
+                for record_id, anomaly, risk, level in zip(ids, anomaly_scores, risk_scores, levels)]
+
+    statements = []
+    listener = lambda *_: statements.append(1)
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        rows = results()
+        db.session.expire_all()
+        statements.clear()
+        started = time.perf_counter()
+        records = {record.id: record for record in EmailRecord.query.filter_by(session_id=session_id)}
+        for row in rows:
+            record = records[row['id']]
+            for field, value in row.items():
+                if field != 'id':
+                    setattr(record, field, value)
+        db.session.commit()
+        print(f"  ORM objects: {time.perf_counter() - started:.2f}s, {len(statements):,} statements")
+        del records
+
+        for batch_size in [int(value) for value in args.batch_sizes.split(',')]:
+            rows = results()
+            db.session.expire_all()
+            statements.clear()
+            started = time.perf_counter()
+            bulk_update_by_id(EmailRecord, rows, batch_size=batch_size)
+            print(f"  bulk update, batches of {batch_size:,}: {time.perf_counter() - started:.2f}s, "
+                  f"{len(statements):,} statements")
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+
+    stored = {record_id: (anomaly, risk, level, explanation) for record_id, anomaly, risk, level, explanation in
+              db.session.query(EmailRecord.id, EmailRecord.ml_anomaly_score, EmailRecord.ml_risk_score,
+                               EmailRecord.risk_level, EmailRecord.ml_explanation).filter_by(session_id=session_id)}
+    mismatches = sum(1 for row in rows if stored[row['id']] != (
+        row['ml_anomaly_score'], row['ml_risk_score'], row['risk_level'], row['ml_explanation']))
+    print(f"Mismatches: {mismatches}")
+    if mismatches:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Email Guardian performance benchmarks')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    parsers_cmd = subparsers.add_parser('parsers', help='Compare CSV parser engines')
+    parsers_cmd.add_argument('--rows', type=int, default=1000000)
+    parsers_cmd.add_argument('--chunk-size', type=int, default=1000)
+    parsers_cmd.set_defaults(func=benchmark_parsers)
+
+    rules_cmd = subparsers.add_parser('rules', help='Compare interpreted and compiled rule evaluation')
+    rules_cmd.add_argument('--rows', type=int, default=200000)
+    rules_cmd.set_defaults(func=benchmark_rules)
+
+    vectorized_cmd = subparsers.add_parser('vectorized-rules',
+                                           help='Check and time vectorized, SQL and statistics-ordered rule '
+                                                'evaluation against row-at-a-time evaluation')
+    vectorized_cmd.add_argument('--rows', type=int, default=100000)
+    vectorized_cmd.add_argument('--random-rules', type=int, default=30)
+    vectorized_cmd.add_argument('--seed', type=int, default=42)
+    vectorized_cmd.set_defaults(func=benchmark_vectorized_rules)
+
+    contains_cmd = subparsers.add_parser('contains-rules', help='Compare substring scans with multi-pattern matching')
+    contains_cmd.add_argument('--rows', type=int, default=50000)
+    contains_cmd.add_argument('--rules', type=int, default=300)
+    contains_cmd.add_argument('--seed', type=int, default=42)
+    contains_cmd.set_defaults(func=benchmark_contains_rules)
+
+    whitelist_cmd = subparsers.add_parser('whitelist', help='Compare per-record whitelist scans with the suffix index')
+    whitelist_cmd.add_argument('--rows', type=int, default=200000)
+    whitelist_cmd.add_argument('--domains', type=int, default=2000)
+    whitelist_cmd.add_argument('--scan-rows', type=int, default=2000)
+    whitelist_cmd.add_argument('--seed', type=int, default=42)
+    whitelist_cmd.set_defaults(func=benchmark_whitelist)
+
+    classifier_cmd = subparsers.add_parser('domain-classifier',
+                                           help='Compare per-record domain list scans with the domain classifier')
+    classifier_cmd.add_argument('--rows', type=int, default=200000)
+    classifier_cmd.add_argument('--domains', type=int, default=5000)
+    classifier_cmd.add_argument('--seed', type=int, default=42)
+    classifier_cmd.set_defaults(func=benchmark_domain_classifier)
+
+    ml_scoring_cmd = subparsers.add_parser('ml-scoring', help='Compare per-row and column-wise ML risk scoring')
+    ml_scoring_cmd.add_argument('--rows', type=int, default=100000)
+    ml_scoring_cmd.add_argument('--seed', type=int, default=42)
+    ml_scoring_cmd.set_defaults(func=benchmark_ml_scoring)
+
+    keywords_cmd = subparsers.add_parser('attachment-keywords',
+                                         help='Compare per-scan keyword queries with the cached keyword index')
+    keywords_cmd.add_argument('--rows', type=int, default=2000)
+    keywords_cmd.add_argument('--keywords', type=int, default=200)
+    keywords_cmd.add_argument('--seed', type=int, default=42)
+    keywords_cmd.set_defaults(func=benchmark_attachment_keywords)
+
+    scoring_cmd = subparsers.add_parser('parallel-scoring', help='Compare in-process and sharded anomaly scoring')
+    scoring_cmd.add_argument('--rows', type=int, default=2000000)
+    scoring_cmd.add_argument('--training-rows', type=int, default=5000)
+    scoring_cmd.add_argument('--workers', default='1,2,4,8,16')
+    scoring_cmd.add_argument('--seed', type=int, default=42)
+    scoring_cmd.set_defaults(func=benchmark_parallel_scoring)
+
+    bulk_cmd = subparsers.add_parser('bulk-update', help='Compare ORM and bulk write-back of per-record results')
+    bulk_cmd.add_argument('--rows', type=int, default=50000)
+    bulk_cmd.add_argument('--batch-sizes', default='100,1000,5000')
+    bulk_cmd.add_argument('--seed', type=int, default=42)
+    bulk_cmd.set_defaults(func=benchmark_bulk_update)
+
+    args = parser.parse_args()
+
+    import logging
+    logging.disable(logging.INFO)
+
+    from app import app
+    with app.app_context():
+        args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""
+Bulk record updates for Email Guardian
+Writes per-record results with one executemany UPDATE per batch keyed by primary key,
+instead of flushing every changed ORM object through the unit of work.
+"""
+import logging
+from sqlalchemy import update, bindparam
+from performance_config import config
+from app import db
+
+logger = logging.getLogger(__name__)
+
+
+def bulk_update_by_id(model, rows, batch_size=None, commit=True):
+    """Set columns of a model's rows by id with one executemany UPDATE per batch of batch_commit_size rows"""
+    # Every row is a dict of the row's 'id' and the columns to set; rows setting different
+    # columns are grouped, since an executemany UPDATE sets the same columns on every row
+    if not rows:
+        return 0
+
+    groups = {}
+    for row in rows:
+        if 'id' not in row:
+            raise ValueError(f"Bulk update row without an id: {row}")
+        groups.setdefault(frozenset(row), []).append(row)
+
+    table = model.__table__
+    batch_size = batch_size or config.batch_commit_size
+    for columns, group in groups.items():
+        fields = sorted(columns - {'id'})
+        if not fields:
+            continue
+        # Bind parameters can't share the names of the columns they set
+        statement = update(table).where(table.c.id == bindparam('b_id')).values(**{
+            field: bindparam(f"b_{field}") for field in fields
+        })
+        for start in range(0, len(group), batch_size):
+            db.session.execute(statement, [
+                {f"b_{field}": value for field, value in row.items()} for row in group[start:start + batch_size]
+            ])
+    # One transaction for all batches, so readers never see part of the results
+    if commit:
+        db.session.commit()
+
+    logger.debug(f"Bulk updated {len(rows)} {table.name} rows")
+    return len(rows)
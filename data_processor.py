@@ -1,8 +1,11 @@
 import pandas as pd
-import csv
 import json
 import logging
+import os
+import time
 from datetime import datetime
+from types import SimpleNamespace
+from sqlalchemy import insert, func
 from models import ProcessingSession, EmailRecord, ProcessingError
 from session_manager import SessionManager
 from rule_engine import RuleEngine
@@ -11,8 +14,47 @@ from ml_engine import MLEngine
 from performance_config import config
 from app import db
 
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pa_compute
+    import pyarrow.csv as pa_csv
+except ImportError:  # Optional dependency for the multi-threaded parser engine
+    pa = None
+    pa_compute = None
+    pa_csv = None
+
 logger = logging.getLogger(__name__)
 
+# Bytes pyarrow's streaming CSV reader parses into each record batch
+PYARROW_BLOCK_SIZE = 1 << 20
+
+# Values pandas reads as missing by default; the pyarrow engine uses the same set
+CSV_NULL_VALUES = [
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND',
+    '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'
+]
+
+# Initial values of the fields the fused workflow may set before a record is inserted
+FUSED_WORKFLOW_DEFAULTS = {
+    'excluded_by_rule': None,
+    'whitelisted': False,
+    'rule_matches': None,
+    'ml_risk_score': None,
+    'risk_level': None,
+    'case_status': 'Active',
+    'notes': None,
+    'assigned_to': None,
+    'escalated_at': None
+}
+
+class ProcessingCancelled(Exception):
+    """Raised by a progress callback to stop processing a session"""
+    pass
+
+class JobOwnershipLost(ProcessingCancelled):
+    """Raised by a progress callback when the job was taken over; the session is left as it is"""
+    pass
+
 class DataProcessor:
     """Handles CSV processing and workflow engine"""
     
@@ -23,6 +65,13 @@ class DataProcessor:
         self.domain_manager = DomainManager()
         self.ml_engine = MLEngine()
         self.enable_fast_mode = config.fast_mode
+        self.parser_engine = config.parser_engine
+        if self.parser_engine == 'pyarrow' and pa is None:
+            logger.warning("pyarrow is not installed, falling back to the pandas CSV parser")
+            self.parser_engine = 'pandas'
+        elif self.parser_engine not in ('pandas', 'pyarrow'):
+            logger.warning(f"Unknown parser engine '{self.parser_engine}', using pandas")
+            self.parser_engine = 'pandas'
         logger.info(f"DataProcessor initialized with config: {config.get_config_summary()}")
         
         # Expected CSV columns (case-insensitive matching)
@@ -33,9 +82,18 @@ class DataProcessor:
             'department', 'status', 'user_response', 'final_outcome',
             'justification', 'policy_name'
         ]
+        
+        # CSV columns whose EmailRecord attribute has a different name
+        self.column_fields = {'_time': 'time'}
     
-    def process_csv(self, session_id, file_path):
-        """Main CSV processing workflow"""
+    def process_csv(self, session_id, file_path, progress_callback=None, resume=False):
+        """Main CSV processing workflow
+        
+        progress_callback, if given, is called with the current stage after every chunk and
+        before every workflow step; it may raise ProcessingCancelled to stop processing.
+        With resume=True processing continues from the session's last ingest and workflow
+        checkpoints instead of starting over.
+        """
         try:
             logger.info(f"Starting CSV processing for session {session_id}")
             
@@ -45,51 +103,136 @@ class DataProcessor:
                 session.status = 'processing'
                 db.session.commit()
             
-            # Step 1: Validate CSV structure (quick validation)
-            column_mapping = self._validate_csv_structure(file_path)
-            
-            # Step 2: Count total records (optimized)
-            total_records = self._count_csv_rows(file_path)
-            if session:
-                session.total_records = total_records
-                db.session.commit()
-            
-            processed_count = 0
+            # Pick up from the last durable chunk and stage of an interrupted run
+            ingest_checkpoint = self._recover_ingest_checkpoint(session_id) if resume else None
+            if not ingest_checkpoint:
+                self.session_manager.clear_session_checkpoints(session_id)
+                ingest_checkpoint = {}
+            completed_stages = []
+            if ingest_checkpoint:
+                workflow_checkpoint = self.session_manager.recover_from_checkpoint(session_id, 'workflow') or {}
+                completed_stages = workflow_checkpoint.get('completed_stages', [])
+            
+            processed_count = ingest_checkpoint.get('processed_records', 0)
+            rows_read = ingest_checkpoint.get('rows_read', 0)
+            resumed_from = processed_count
+            ingest_started = time.perf_counter()
             
             # Use optimized chunk size for performance
             chunk_size = self.chunk_size if self.enable_fast_mode else min(500, self.chunk_size)
             
-            # Calculate total chunks
-            total_chunks = (total_records + chunk_size - 1) // chunk_size  # Round up division
-            current_chunk = 0
-            
-            # Process file in chunks
-            for chunk_df in pd.read_csv(file_path, chunksize=chunk_size):
+            # Single pass over the file: column mapping comes from the first chunk and
+            # progress is derived from bytes consumed instead of a separate row count
+            file_size = os.path.getsize(file_path)
+            column_mapping = None
+            
+            # Rows ingested before a resume were only evaluated in-line if that run was fused too
+            fused_workflow = config.fused_workflow and (not ingest_checkpoint or ingest_checkpoint.get('fused_workflow', False))
+            workflow_context = self._prepare_fused_workflow(session_id) if fused_workflow else None
+            if workflow_context:
+                for counter in ('excluded_count', 'whitelisted_count', 'rule_match_count'):
+                    workflow_context[counter] = ingest_checkpoint.get(counter, 0)
+            
+            estimated_total = 0
+            total_chunks = 0
+            current_chunk = ingest_checkpoint.get('current_chunk', 0)
+            if ingest_checkpoint:
+                logger.info(f"Resuming session {session_id} after {rows_read} rows ({processed_count} records), "
+                            f"completed stages: {completed_stages}")
+            
+            csv_chunks = [] if ingest_checkpoint.get('ingest_complete') else \
+                self._read_csv_chunks(file_path, chunk_size, skip_rows=rows_read)
+            for chunk_df, bytes_read in csv_chunks:
                 try:
                     current_chunk += 1
-                    chunk_processed = self._process_chunk(session_id, chunk_df, column_mapping, processed_count)
+                    rows_read += len(chunk_df)
+                    if column_mapping is None:
+                        column_mapping = self._build_column_mapping(chunk_df.columns)
+                    
+                    chunk_started = time.perf_counter()
+                    if config.bulk_insert:
+                        chunk_processed = self._process_chunk_bulk(session_id, chunk_df, column_mapping, processed_count, workflow_context)
+                    else:
+                        chunk_processed = self._process_chunk(session_id, chunk_df, column_mapping, processed_count, workflow_context)
                     processed_count += chunk_processed
+                    chunk_elapsed = time.perf_counter() - chunk_started
+                    
+                    # Estimate totals from bytes per row so far
+                    estimated_total = self._estimate_total_records(processed_count, bytes_read, file_size)
+                    total_chunks = max(current_chunk, (estimated_total + chunk_size - 1) // chunk_size)
                     
                     # Update progress with chunk information
                     if session:
                         session.processed_records = processed_count
+                        session.total_records = estimated_total
                         session.current_chunk = current_chunk
                         session.total_chunks = total_chunks
                         db.session.commit()
                     
-                    logger.info(f"Completed chunk {current_chunk}/{total_chunks} - {chunk_processed} records processed")
+                    logger.info(f"Completed chunk {current_chunk}/~{total_chunks} - {chunk_processed} records processed "
+                                f"({chunk_processed / max(chunk_elapsed, 1e-6):.0f} rows/sec, "
+                                f"{bytes_read / max(file_size, 1):.0%} of file read)")
                     
                     # Update progress based on configuration
                     if processed_count % config.progress_update_interval == 0:
-                        logger.info(f"Progress update: {processed_count}/{total_records} records processed")
+                        logger.info(f"Progress update: {processed_count}/~{estimated_total} records processed")
                         
                 except Exception as chunk_error:
                     logger.warning(f"Error processing chunk {current_chunk}: {str(chunk_error)}")
                     continue  # Skip problematic chunks but continue processing
+                finally:
+                    self._save_ingest_checkpoint(session_id, {
+                        'rows_read': rows_read,
+                        'processed_records': processed_count,
+                        'current_chunk': current_chunk,
+                        'fused_workflow': workflow_context is not None
+                    }, workflow_context)
+                    if progress_callback:
+                        progress_callback('ingest')
+            
+            # Exact totals are only known once the whole file has been read
+            if session:
+                session.total_records = processed_count
+                session.total_chunks = current_chunk
+                db.session.commit()
+            
+            if not ingest_checkpoint.get('ingest_complete'):
+                # Record ingest throughput
+                ingest_seconds = time.perf_counter() - ingest_started
+                ingested = processed_count - resumed_from
+                ingest_stats = {
+                    'ingest_records': processed_count,
+                    'ingest_seconds': round(ingest_seconds, 3),
+                    'ingest_rows_per_sec': round(ingested / max(ingest_seconds, 1e-6), 1)
+                }
+                if resumed_from:
+                    ingest_stats['ingest_resumed_from'] = resumed_from
+                logger.info(f"Ingest finished for session {session_id}: {ingested} records in "
+                            f"{ingest_seconds:.2f}s ({ingest_stats['ingest_rows_per_sec']:.0f} rows/sec)")
+                if session:
+                    session.processing_stats = ingest_stats
+                    db.session.commit()
+                
+                self._save_ingest_checkpoint(session_id, {
+                    'rows_read': rows_read,
+                    'processed_records': processed_count,
+                    'current_chunk': current_chunk,
+                    'fused_workflow': workflow_context is not None,
+                    'ingest_complete': True
+                }, workflow_context)
+            
+            # Fused mode already applied exclusion, whitelist and security rules per chunk
+            skip_stages = list(completed_stages)
+            if workflow_context:
+                self._finish_fused_workflow(session_id, workflow_context)
+                skip_stages = list(dict.fromkeys(skip_stages + ['exclusion', 'whitelist', 'rules']))
             
             # Step 3: Apply 4-step workflow with robust error handling
             try:
-                self._apply_workflow(session_id)
+                self._apply_workflow(session_id, skip_stages=skip_stages, progress_callback=progress_callback,
+                                     checkpoint=True)
+            except ProcessingCancelled:
+                raise
             except Exception as workflow_error:
                 logger.warning(f"Workflow error for session {session_id}: {str(workflow_error)}")
                 # Continue to completion even if workflow has issues
@@ -102,8 +245,22 @@ class DataProcessor:
                 session.processed_records = processed_count
                 db.session.commit()
             
+            self.session_manager.clear_session_checkpoints(session_id)
             logger.info(f"CSV processing completed for session {session_id}")
             
+        except JobOwnershipLost:
+            logger.info(f"CSV processing stopped for session {session_id}, its job was taken over")
+            db.session.rollback()
+            raise
+        except ProcessingCancelled:
+            logger.info(f"CSV processing cancelled for session {session_id}")
+            db.session.rollback()
+            session = ProcessingSession.query.get(session_id)
+            if session:
+                session.status = 'cancelled'
+                session.error_message = 'Processing cancelled'
+                db.session.commit()
+            raise
         except Exception as e:
             logger.error(f"Error processing CSV for session {session_id}: {str(e)}")
             session = ProcessingSession.query.get(session_id)
@@ -114,51 +271,175 @@ class DataProcessor:
             db.session.commit()
             raise
     
-    def _validate_csv_structure(self, file_path):
-        """Validate CSV structure and create column mapping"""
-        try:
-            # Read first few rows to check structure
-            sample_df = pd.read_csv(file_path, nrows=5)
-            actual_columns = [col.lower().strip() for col in sample_df.columns]
-            
-            # Create case-insensitive column mapping
-            column_mapping = {}
-            missing_columns = []
-            
-            for expected_col in self.expected_columns:
-                found = False
-                for actual_col in sample_df.columns:
-                    if actual_col.lower().strip() == expected_col.lower():
-                        column_mapping[expected_col] = actual_col
-                        found = True
-                        break
+    def _read_csv_chunks(self, file_path, chunk_size, skip_rows=0):
+        """Yield (chunk DataFrame, bytes consumed so far) using the configured parser engine
+        
+        The first skip_rows data rows are parsed but not yielded, so resumed runs see the
+        same rows as the original run even for quoted fields spanning several lines.
+        """
+        if self.parser_engine == 'pyarrow':
+            return self._read_csv_chunks_pyarrow(file_path, chunk_size, skip_rows)
+        return self._read_csv_chunks_pandas(file_path, chunk_size, skip_rows)
+    
+    def _read_csv_chunks_pandas(self, file_path, chunk_size, skip_rows=0):
+        """Read the CSV with pandas' C parser in a single streaming pass"""
+        with open(file_path, 'rb') as csv_file:
+            try:
+                # Every value as a string, so the stored values match the pyarrow engine's
+                reader = pd.read_csv(csv_file, chunksize=chunk_size, dtype=str,
+                                     keep_default_na=False, na_values=CSV_NULL_VALUES)
+            except Exception as e:
+                logger.error(f"CSV validation failed: {str(e)}")
+                raise ValueError(f"Invalid CSV format: {str(e)}")
+            
+            rows_seen = 0
+            for chunk_df in reader:
+                chunk_start = rows_seen
+                rows_seen += len(chunk_df)
+                if rows_seen <= skip_rows:
+                    continue
+                if chunk_start < skip_rows:
+                    chunk_df = chunk_df.iloc[skip_rows - chunk_start:]
+                yield chunk_df, csv_file.tell()
+    
+    def _read_csv_chunks_pyarrow(self, file_path, chunk_size, skip_rows=0):
+        """Stream the CSV through pyarrow's multi-threaded parser, re-slicing its record batches into chunks"""
+        with pa.OSFile(file_path) as csv_file:
+            try:
+                # Read the header with pandas, so BOMs and duplicate column names are handled as by the pandas engine
+                header = [str(col) for col in pd.read_csv(file_path, nrows=0).columns]
                 
-                if not found:
-                    missing_columns.append(expected_col)
-            
-            # Log missing columns but don't fail
-            if missing_columns:
-                logger.warning(f"Missing columns: {missing_columns}")
-            
-            logger.info(f"CSV validation successful. Column mapping: {column_mapping}")
-            return column_mapping
-            
-        except Exception as e:
-            logger.error(f"CSV validation failed: {str(e)}")
-            raise ValueError(f"Invalid CSV format: {str(e)}")
+                # Only parse the expected columns, all of them as strings
+                expected = set(col.lower() for col in self.expected_columns)
+                include_columns = [col for col in header if col.lower().strip() in expected]
+                reader = pa_csv.open_csv(
+                    csv_file,
+                    read_options=pa_csv.ReadOptions(use_threads=True, block_size=PYARROW_BLOCK_SIZE,
+                                                    column_names=header, skip_rows=1),
+                    parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+                    convert_options=pa_csv.ConvertOptions(
+                        include_columns=include_columns,
+                        column_types={col: pa.string() for col in include_columns},
+                        null_values=CSV_NULL_VALUES,
+                        strings_can_be_null=True
+                    )
+                )
+            except Exception as e:
+                logger.error(f"CSV validation failed: {str(e)}")
+                raise ValueError(f"Invalid CSV format: {str(e)}")
+            
+            rows_seen = 0
+            file_size = os.path.getsize(file_path)
+            for chunk, bytes_read in self._rechunk_record_batches(reader, chunk_size, file_size):
+                chunk_start = rows_seen
+                rows_seen += chunk.num_rows
+                if rows_seen <= skip_rows:
+                    continue
+                if chunk_start < skip_rows:
+                    chunk = chunk.slice(skip_rows - chunk_start)
+                
+                # Fill nulls and strip whitespace in Arrow so chunks arrive already normalized
+                chunk_df = pa.table({
+                    name: pa_compute.utf8_trim_whitespace(pa_compute.fill_null(chunk[name], ''))
+                    for name in chunk.column_names
+                }).to_pandas()
+                chunk_df.attrs['normalized_strings'] = True
+                yield chunk_df, bytes_read
+    
+    def _rechunk_record_batches(self, reader, chunk_size, file_size):
+        """Yield (table of chunk_size rows, bytes parsed so far) from a stream of record batches, the last table shorter
+        
+        The reader reads ahead of the batches it has returned, so the bytes parsed are estimated from
+        the one block per batch it parses, interpolated within the batch a chunk ends in.
+        """
+        pending = []
+        pending_rows = 0
+        bytes_parsed = 0
+        for batch in reader:
+            batch_start = bytes_parsed
+            bytes_parsed = min(file_size, bytes_parsed + PYARROW_BLOCK_SIZE)
+            pending.append(batch)
+            pending_rows += batch.num_rows
+            if pending_rows < chunk_size:
+                continue
+            
+            # Every chunk cut here ends within this batch, the earlier ones held fewer than chunk_size rows
+            table = pa.Table.from_batches(pending)
+            batch_offset = pending_rows - batch.num_rows
+            offset = 0
+            while pending_rows - offset >= chunk_size:
+                offset += chunk_size
+                batch_fraction = (offset - batch_offset) / batch.num_rows
+                yield table.slice(offset - chunk_size, chunk_size), batch_start + int((bytes_parsed - batch_start) * batch_fraction)
+            remainder = table.slice(offset)
+            pending = remainder.to_batches()
+            pending_rows = remainder.num_rows
+        
+        if pending_rows:
+            yield pa.Table.from_batches(pending), file_size
     
-    def _count_csv_rows(self, file_path):
-        """Count total rows in CSV file"""
+    def _save_ingest_checkpoint(self, session_id, state, workflow_context=None):
+        """Record the last durable chunk so an interrupted run can resume after it"""
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                reader = csv.reader(f)
-                row_count = sum(1 for row in reader) - 1  # Exclude header
-            return max(0, row_count)
+            checkpoint = dict(state)
+            # Every record of this session up to this primary key has been committed
+            checkpoint['last_record_pk'] = db.session.query(func.max(EmailRecord.id)).filter(
+                EmailRecord.session_id == session_id
+            ).scalar()
+            if workflow_context:
+                for counter in ('excluded_count', 'whitelisted_count', 'rule_match_count'):
+                    checkpoint[counter] = workflow_context[counter]
+            self.session_manager.create_session_checkpoint(session_id, 'ingest', checkpoint)
         except Exception as e:
-            logger.error(f"Error counting CSV rows: {str(e)}")
-            return 0
+            logger.warning(f"Could not save ingest checkpoint for session {session_id}: {str(e)}")
+    
+    def _recover_ingest_checkpoint(self, session_id):
+        """Load the ingest checkpoint and drop records written after it"""
+        checkpoint = self.session_manager.recover_from_checkpoint(session_id, 'ingest')
+        
+        stale_records = EmailRecord.query.filter(EmailRecord.session_id == session_id)
+        if checkpoint and checkpoint.get('last_record_pk') is not None:
+            stale_records = stale_records.filter(EmailRecord.id > checkpoint['last_record_pk'])
+        removed = stale_records.delete(synchronize_session=False)
+        if not checkpoint:
+            ProcessingError.query.filter_by(session_id=session_id).delete(synchronize_session=False)
+        db.session.commit()
+        
+        if removed:
+            logger.info(f"Removed {removed} records of session {session_id} written after the last checkpoint")
+        return checkpoint
     
-    def _process_chunk(self, session_id, chunk_df, column_mapping, start_index):
+    def _build_column_mapping(self, columns):
+        """Create case-insensitive column mapping from the CSV header"""
+        column_mapping = {}
+        missing_columns = []
+        
+        for expected_col in self.expected_columns:
+            found = False
+            for actual_col in columns:
+                if str(actual_col).lower().strip() == expected_col.lower():
+                    column_mapping[expected_col] = actual_col
+                    found = True
+                    break
+            
+            if not found:
+                missing_columns.append(expected_col)
+        
+        # Log missing columns but don't fail
+        if missing_columns:
+            logger.warning(f"Missing columns: {missing_columns}")
+        
+        logger.info(f"CSV validation successful. Column mapping: {column_mapping}")
+        return column_mapping
+    
+    def _estimate_total_records(self, processed_count, bytes_read, file_size):
+        """Estimate total record count from the bytes per row consumed so far"""
+        if bytes_read <= 0 or bytes_read >= file_size:
+            return processed_count
+        estimate = int(round(processed_count * file_size / bytes_read))
+        return max(processed_count, estimate)
+    
+    def _process_chunk(self, session_id, chunk_df, column_mapping, start_index, workflow_context=None):
         """Process a chunk of CSV data"""
         try:
             processed_count = 0
@@ -202,6 +483,9 @@ class DataProcessor:
                         policy_name=record_data.get('policy_name', '')
                     )
                     
+                    if workflow_context:
+                        self._apply_fused_workflow(email_record, workflow_context)
+                    
                     db.session.add(email_record)
                     processed_count += 1
                     
@@ -231,41 +515,188 @@ class DataProcessor:
             logger.error(f"Error processing chunk: {str(e)}")
             raise
     
-    def _apply_workflow(self, session_id):
+    def _process_chunk_bulk(self, session_id, chunk_df, column_mapping, start_index, workflow_context=None):
+        """Process a chunk of CSV data with columnar mapping and a single bulk insert"""
+        try:
+            rows = self._map_chunk_columns(session_id, chunk_df, column_mapping, start_index)
+            if not rows:
+                return 0
+            
+            if workflow_context:
+                rows = [self._apply_fused_workflow_to_row(row, workflow_context) for row in rows]
+            
+            # One executemany INSERT for the whole chunk
+            db.session.execute(insert(EmailRecord.__table__), rows)
+            db.session.commit()
+            logger.info(f"Processed chunk: {len(rows)} records (bulk insert)")
+            return len(rows)
+            
+        except Exception as e:
+            db.session.rollback()
+            logger.warning(f"Bulk insert failed for chunk, falling back to row-by-row processing: {str(e)}")
+            return self._process_chunk(session_id, chunk_df, column_mapping, start_index, workflow_context)
+    
+    def _map_chunk_columns(self, session_id, chunk_df, column_mapping, start_index):
+        """Map and normalize all expected columns of a chunk at once"""
+        row_count = len(chunk_df)
+        mapped = pd.DataFrame(index=chunk_df.index)
+        normalized = chunk_df.attrs.get('normalized_strings', False)
+        
+        for expected_col in self.expected_columns:
+            field = self.column_fields.get(expected_col, expected_col)
+            actual_col = column_mapping.get(expected_col)
+            if actual_col is not None and actual_col in chunk_df.columns:
+                values = chunk_df[actual_col]
+                if normalized:
+                    mapped[field] = values
+                else:
+                    # Convert to string but preserve original case for rule matching
+                    mapped[field] = values.where(values.notna(), '').astype(str).str.strip()
+            else:
+                mapped[field] = ''
+        
+        mapped['session_id'] = session_id
+        mapped['record_id'] = [f"{session_id}_{start_index + i}" for i in range(row_count)]
+        
+        # Build insert parameters column-wise; much cheaper than DataFrame.to_dict('records')
+        fields = list(mapped.columns)
+        columns = [mapped[field].tolist() for field in fields]
+        return [dict(zip(fields, values)) for values in zip(*columns)]
+    
+    def _prepare_fused_workflow(self, session_id):
+        """Load rules and whitelist once for in-memory workflow evaluation during ingest"""
+        exclusion_rules = self.rule_engine.get_exclusion_rules()
+        security_rules = self.rule_engine.get_security_rules()
+        
+        # Detach rules so per-chunk commits don't expire and reload them
+        for rule in exclusion_rules + security_rules:
+            db.session.expunge(rule)
+        exclusion_rules = self.rule_engine.compile_rules(exclusion_rules)
+        security_rules = self.rule_engine.compile_rules(security_rules)
+        
+        logger.info(f"Fused workflow enabled: {len(exclusion_rules)} exclusion rules, "
+                    f"{len(security_rules)} security rules")
+        return {
+            'exclusion_rules': exclusion_rules,
+            'security_rules': security_rules,
+            'exclusion_matchers': self.rule_engine.build_pattern_matchers(exclusion_rules),
+            'security_matchers': self.rule_engine.build_pattern_matchers(security_rules),
+            'rule_profiler': self.rule_engine.create_profiler(session_id),
+            'whitelist_index': self.domain_manager.get_whitelist_index(),
+            'excluded_count': 0,
+            'whitelisted_count': 0,
+            'rule_match_count': 0
+        }
+    
+    def _apply_fused_workflow(self, record, workflow_context):
+        """Apply exclusion, whitelist and security rules to a record before it is written"""
+        # Step 1: Exclusion rules
+        if self.rule_engine.apply_exclusion_rules_to_record(record, workflow_context['exclusion_rules'],
+                                                            workflow_context['exclusion_matchers'],
+                                                            workflow_context['rule_profiler']):
+            workflow_context['excluded_count'] += 1
+            return
+        
+        # Step 2: Whitelist filtering
+        if workflow_context['whitelist_index'] and \
+                self.domain_manager.apply_whitelist_to_record(record, workflow_context['whitelist_index']):
+            workflow_context['whitelisted_count'] += 1
+            return
+        
+        # Step 3: Security rules
+        matched_rules = self.rule_engine.apply_security_rules_to_record(record, workflow_context['security_rules'],
+                                                                        workflow_context['security_matchers'],
+                                                                        workflow_context['rule_profiler'])
+        workflow_context['rule_match_count'] += len(matched_rules)
+    
+    def _apply_fused_workflow_to_row(self, row, workflow_context):
+        """Apply the fused workflow to a mapped insert row"""
+        record = SimpleNamespace(**FUSED_WORKFLOW_DEFAULTS, **row)
+        self._apply_fused_workflow(record, workflow_context)
+        return vars(record)
+    
+    def _finish_fused_workflow(self, session_id, workflow_context):
+        """Mark the stages computed during ingest as applied"""
+        session = ProcessingSession.query.get(session_id)
+        if session:
+            session.exclusion_applied = True
+            session.whitelist_applied = True
+            session.rules_applied = True
+            db.session.commit()
+        if workflow_context['rule_profiler']:
+            workflow_context['rule_profiler'].save()
+        
+        logger.info(f"Fused workflow for session {session_id}: {workflow_context['excluded_count']} excluded, "
+                    f"{workflow_context['whitelisted_count']} whitelisted, "
+                    f"{workflow_context['rule_match_count']} rule matches")
+    
+    def _apply_workflow(self, session_id, skip_stages=None, progress_callback=None, checkpoint=False):
         """Apply 4-step processing workflow with robust error handling"""
         try:
+            skip_stages = skip_stages or []
+            completed_stages = list(skip_stages)
+            
+            def report_progress(stage):
+                if progress_callback:
+                    progress_callback(stage)
+            
+            def complete_stage(stage):
+                # Record finished stages so a resumed run doesn't repeat them
+                completed_stages.append(stage)
+                if checkpoint:
+                    self.session_manager.create_session_checkpoint(session_id, 'workflow', {
+                        'completed_stages': completed_stages
+                    })
+
             logger.info(f"Applying workflow for session {session_id}")
             
             # Step 1: Apply Exclusion Rules
-            try:
-                self._apply_exclusion_rules(session_id)
-                logger.info(f"Step 1 completed: Exclusion rules applied for session {session_id}")
-            except Exception as e:
-                logger.warning(f"Step 1 failed for session {session_id}: {str(e)}")
+            if 'exclusion' not in skip_stages:
+                report_progress('exclusion')
+                try:
+                    self._apply_exclusion_rules(session_id)
+                    complete_stage('exclusion')
+                    logger.info(f"Step 1 completed: Exclusion rules applied for session {session_id}")
+                except Exception as e:
+                    logger.warning(f"Step 1 failed for session {session_id}: {str(e)}")
             
             # Step 2: Apply Whitelist Filtering
-            try:
-                self._apply_whitelist_filtering(session_id)
-                logger.info(f"Step 2 completed: Whitelist filtering applied for session {session_id}")
-            except Exception as e:
-                logger.warning(f"Step 2 failed for session {session_id}: {str(e)}")
+            if 'whitelist' not in skip_stages:
+                report_progress('whitelist')
+                try:
+                    self._apply_whitelist_filtering(session_id)
+                    complete_stage('whitelist')
+                    logger.info(f"Step 2 completed: Whitelist filtering applied for session {session_id}")
+                except Exception as e:
+                    logger.warning(f"Step 2 failed for session {session_id}: {str(e)}")
             
             # Step 3: Apply Security Rules
-            try:
-                self._apply_security_rules(session_id)
-                logger.info(f"Step 3 completed: Security rules applied for session {session_id}")
-            except Exception as e:
-                logger.warning(f"Step 3 failed for session {session_id}: {str(e)}")
+            if 'rules' not in skip_stages:
+                report_progress('rules')
+                try:
+                    self._apply_security_rules(session_id)
+                    complete_stage('rules')
+                    logger.info(f"Step 3 completed: Security rules applied for session {session_id}")
+                except Exception as e:
+                    logger.warning(f"Step 3 failed for session {session_id}: {str(e)}")
             
             # Step 4: Apply ML Analysis
-            try:
-                self._apply_ml_analysis(session_id)
-                logger.info(f"Step 4 completed: ML analysis applied for session {session_id}")
-            except Exception as e:
-                logger.warning(f"Step 4 failed for session {session_id}: {str(e)}")
+            if 'ml' not in skip_stages:
+                report_progress('ml')
+                try:
+                    self._apply_ml_analysis(session_id)
+                    complete_stage('ml')
+                    logger.info(f"Step 4 completed: ML analysis applied for session {session_id}")
+                except Exception as e:
+                    logger.warning(f"Step 4 failed for session {session_id}: {str(e)}")
+            
+            # Roll the session into the cross-session domain statistics
+            self.domain_manager.update_domain_stats(session_id)
             
             logger.info(f"Workflow completed for session {session_id}")
             
+        except ProcessingCancelled:
+            raise
         except Exception as e:
             logger.error(f"Critical error applying workflow for session {session_id}: {str(e)}")
             raise
@@ -328,19 +759,26 @@ class DataProcessor:
             logger.error(f"Error applying security rules: {str(e)}")
             raise
     
-    def _apply_ml_analysis(self, session_id):
-        """Step 4: Apply ML analysis"""
+    def _apply_ml_analysis(self, session_id, progress_callback=None, record_filters=None):
+        """Step 4: Apply ML analysis, to the records matching record_filters when the session's scores allow it"""
         try:
             logger.info(f"Applying ML analysis for session {session_id}")
             
-            # Only analyze non-whitelisted records
-            analysis_results = self.ml_engine.analyze_session(session_id)
+            analysis_results = None
+            if record_filters is not None:
+                analysis_results = self.ml_engine.analyze_records(session_id, record_filters,
+                                                                  progress_callback=progress_callback)
+            if analysis_results is None:
+                # Only analyze non-whitelisted records
+                analysis_results = self.ml_engine.analyze_session(session_id, progress_callback=progress_callback)
             
             # Update session
             session = ProcessingSession.query.get(session_id)
             if session:
                 session.ml_applied = True
-                session.processing_stats = analysis_results.get('processing_stats', {})
+                processing_stats = dict(session.processing_stats or {})
+                processing_stats.update(analysis_results.get('processing_stats', {}))
+                session.processing_stats = processing_stats
                 db.session.commit()
             
             logger.info(f"ML analysis completed for session {session_id}")
@@ -399,3 +837,43 @@ class DataProcessor:
         except Exception as e:
             logger.error(f"Error reprocessing session {session_id}: {str(e)}")
             raise
+    
+    def reapply_whitelist(self, session_id, domains, progress_callback=None):
+        """Re-apply whitelist changes of the given domains to a processed session's affected records"""
+        try:
+            logger.info(f"Re-applying whitelist changes of {len(domains)} domains to session {session_id}")
+            
+            if progress_callback:
+                progress_callback('whitelist')
+            changes = self.domain_manager.reapply_whitelist_domains(session_id, domains)
+            if not changes['whitelisted'] and not changes['unwhitelisted']:
+                return changes
+            
+            session = ProcessingSession.query.get(session_id)
+            
+            # Records no longer whitelisted haven't been through the security rules yet
+            if changes['unwhitelisted_domains'] and session and session.rules_applied:
+                if progress_callback:
+                    progress_callback('rules')
+                self.rule_engine.apply_security_rules(session_id, record_filters=[
+                    EmailRecord.recipients_email_domain.in_(changes['unwhitelisted_domains'])
+                ])
+            
+            # Newly whitelisted records had their scores cleared; only the others need scoring
+            if session and session.ml_applied:
+                if progress_callback:
+                    progress_callback('ml')
+                self._apply_ml_analysis(session_id, progress_callback=progress_callback, record_filters=[
+                    EmailRecord.recipients_email_domain.in_(changes['unwhitelisted_domains'])
+                ])
+            
+            self.domain_manager.update_domain_stats(session_id)
+            
+            logger.info(f"Whitelist changes re-applied to session {session_id}")
+            return changes
+            
+        except ProcessingCancelled:
+            raise
+        except Exception as e:
+            logger.error(f"Error re-applying whitelist to session {session_id}: {str(e)}")
+            raise
@@ -0,0 +1,207 @@
+"""
+Domain classification for Email Guardian
+Classifies recipient domains as disposable, suspicious, public, internal or corporate from
+the MLRiskConfig domain lists and the types of whitelisted domains. Domain lists are hash
+sets looked up with each of the domain's label suffixes, and every distinct domain is
+classified once and kept in an LRU cache shared by the ML engines and the domain manager.
+Each analysis keeps its own list of public email providers (MLRiskConfig.PUBLIC_DOMAIN_LISTS).
+"""
+import functools
+import logging
+import threading
+import numpy as np
+import pandas as pd
+from models import WhitelistDomain
+from ml_config import MLRiskConfig
+from whitelist_index import normalize_domain
+from performance_config import config
+
+logger = logging.getLogger(__name__)
+
+CATEGORIES = ('disposable', 'suspicious', 'public', 'internal', 'corporate', 'unknown')
+
+# Whitelist domain types and the category they give a domain the config lists don't flag
+WHITELIST_TYPE_CATEGORIES = {
+    'corporate': 'corporate',
+    'personal': 'public',
+    'public': 'public',
+    'suspicious': 'suspicious'
+}
+
+# Top-level domains of unremarkable two-label domains
+_GENERIC_TLDS = frozenset(['com', 'org', 'net', 'gov', 'edu', 'corp'])
+
+# Public domain list giving domains the 'public' category
+SCORING_PUBLIC_LIST = 'ml_scoring'
+
+# Domain manager classes: these top-level domains are corporate before any other check,
+# then abuse TLDs and the named disposable services are suspicious
+_CORPORATE_CLASS_TLDS = frozenset(['com', 'corp', 'org', 'gov', 'edu'])
+_SUSPICIOUS_CLASS_SERVICES = ('10minutemail.', 'guerrillamail.', 'mailinator.')
+_UNREMARKABLE_CLASS_TLDS = frozenset(['com', 'org', 'net'])
+
+
+def _domain_suffixes(domain):
+    """The domain and each parent domain, e.g. a.b.com, b.com, com"""
+    labels = domain.split('.')
+    return ['.'.join(labels[index:]) for index in range(len(labels))]
+
+
+def _normalize_keyword(keyword):
+    return keyword.lower().strip()
+
+
+def _normalized(values, normalize=normalize_domain):
+    """Sorted distinct non-empty normalized values of a config list"""
+    return tuple(sorted(set(filter(None, (normalize(str(value)) for value in values or [])))))
+
+
+class DomainClassifier:
+    """Compiled domain lists resolving each distinct domain to a category once"""
+
+    def __init__(self, lists, domain_types=None, cache_size=None):
+        self.lists = lists
+        self.domain_types = dict(domain_types or {})
+        self.public_domain_lists = {name: frozenset(domains) for name, domains in lists['public_domain_lists']}
+        self.public_domains = self.public_domain_lists.get(SCORING_PUBLIC_LIST, frozenset())
+        self.disposable_keywords = tuple(lists['disposable_domain_keywords'])
+        self.suspicious_tlds = frozenset(lists['suspicious_tlds'])
+        self.internal_domains = frozenset(lists['internal_domains'])
+        self.internal_keywords = tuple(lists['internal_domain_keywords'])
+        self.corporate_keywords = tuple(lists['corporate_domain_keywords'])
+        cache_size = cache_size or config.domain_classifier_cache_size
+        self.category = functools.lru_cache(maxsize=cache_size)(self._classify)
+        self.public_lists = functools.lru_cache(maxsize=cache_size)(self._public_lists)
+        self.domain_class = functools.lru_cache(maxsize=cache_size)(self._domain_class)
+
+    @staticmethod
+    def config_lists():
+        """Normalized domain lists of the current MLRiskConfig"""
+        return {
+            'public_domain_lists': tuple(sorted((name, _normalized(domains))
+                                                for name, domains in MLRiskConfig.PUBLIC_DOMAIN_LISTS.items())),
+            'disposable_domain_keywords': _normalized(MLRiskConfig.DISPOSABLE_DOMAIN_KEYWORDS, _normalize_keyword),
+            'suspicious_tlds': _normalized(MLRiskConfig.SUSPICIOUS_TLDS),
+            'internal_domains': _normalized(MLRiskConfig.INTERNAL_DOMAINS),
+            'internal_domain_keywords': _normalized(MLRiskConfig.INTERNAL_DOMAIN_KEYWORDS, _normalize_keyword),
+            'corporate_domain_keywords': _normalized(MLRiskConfig.CORPORATE_DOMAIN_KEYWORDS, _normalize_keyword)
+        }
+
+    def _classify(self, domain):
+        domain = normalize_domain(domain)
+        if not domain:
+            return 'unknown'
+        if any(keyword in domain for keyword in self.disposable_keywords):
+            return 'disposable'
+
+        suffixes = _domain_suffixes(domain)
+        if suffixes[-1] in self.suspicious_tlds:
+            return 'suspicious'
+        if any(suffix in self.public_domains for suffix in suffixes):
+            return 'public'
+        if any(suffix in self.internal_domains for suffix in suffixes) or \
+                any(keyword in domain for keyword in self.internal_keywords):
+            return 'internal'
+
+        # Whitelisted domains and their subdomains take the type they were whitelisted with
+        for suffix in suffixes:
+            category = self.domain_types.get(suffix)
+            if category:
+                return category
+
+        if any(keyword in domain for keyword in self.corporate_keywords):
+            return 'corporate'
+        if len(suffixes) == 2 and suffixes[-1] not in _GENERIC_TLDS:
+            return 'suspicious'
+        return 'corporate'
+
+    def _public_lists(self, domain):
+        """Names of the public domain lists with the domain or one of its parent domains"""
+        suffixes = _domain_suffixes(normalize_domain(domain))
+        return frozenset(name for name, domains in self.public_domain_lists.items()
+                         if any(suffix in domains for suffix in suffixes))
+
+    def _domain_class(self, domain):
+        """Domain manager class: Corporate, Suspicious or Unknown"""
+        domain = normalize_domain(domain)
+        if not domain:
+            return 'Unknown'
+
+        suffixes = _domain_suffixes(domain)
+        tld = suffixes[-1] if len(suffixes) > 1 else None
+        if tld in _CORPORATE_CLASS_TLDS:
+            return 'Corporate'
+        if tld in self.suspicious_tlds or any(service in domain for service in _SUSPICIOUS_CLASS_SERVICES):
+            return 'Suspicious'
+        if any(keyword in domain for keyword in self.corporate_keywords):
+            return 'Corporate'
+        if len(suffixes) == 2 and tld not in _UNREMARKABLE_CLASS_TLDS:
+            return 'Suspicious'
+        return 'Corporate'
+
+    def classify_values(self, values):
+        """Category of each domain in a sequence, classifying each distinct value once"""
+        codes, uniques = pd.factorize(pd.Series(values, dtype=object).fillna(''))
+        categories = [self.category(value) for value in uniques]
+        return [categories[code] for code in codes]
+
+    def is_disposable(self, domain):
+        """True for disposable email services"""
+        return self.category(domain) == 'disposable'
+
+    def is_public(self, domain, list_name=SCORING_PUBLIC_LIST):
+        """True for the free email providers of a public domain list and their subdomains"""
+        return list_name in self.public_lists(domain)
+
+    def public_values(self, values, list_name=SCORING_PUBLIC_LIST):
+        """is_public of each domain in a sequence, looking up each distinct value once"""
+        codes, uniques = pd.factorize(pd.Series(values, dtype=object).fillna(''))
+        flags = np.array([self.is_public(value, list_name) for value in uniques], dtype=bool)
+        return flags[codes]
+
+    def is_external(self, domain):
+        """True for domains outside the organization, False for internal and empty domains"""
+        return self.category(domain) not in ('internal', 'unknown')
+
+
+_classifier = None
+_classifier_lock = threading.Lock()
+
+
+def _whitelist_domain_types():
+    """Category per active whitelisted domain with a known type"""
+    rows = WhitelistDomain.query.with_entities(WhitelistDomain.domain, WhitelistDomain.domain_type).filter_by(
+        is_active=True
+    ).all()
+    domain_types = {}
+    for domain, domain_type in rows:
+        category = WHITELIST_TYPE_CATEGORIES.get((domain_type or '').lower().strip())
+        domain = normalize_domain(domain)
+        if category and domain:
+            domain_types[domain] = category
+    return domain_types
+
+
+def refresh_domain_classifier():
+    """Shared classifier, rebuilt when the config lists or whitelisted domain types changed"""
+    global _classifier
+    lists = DomainClassifier.config_lists()
+    try:
+        domain_types = _whitelist_domain_types()
+    except Exception as e:
+        logger.error(f"Error loading whitelisted domain types for classification: {str(e)}")
+        domain_types = _classifier.domain_types if _classifier is not None else {}
+
+    with _classifier_lock:
+        if _classifier is None or _classifier.lists != lists or _classifier.domain_types != domain_types:
+            _classifier = DomainClassifier(lists, domain_types)
+            logger.info(f"Built domain classifier with {len(lists['public_domain_lists'])} public domain lists and "
+                        f"{len(domain_types)} typed whitelisted domains")
+        return _classifier
+
+
+def get_domain_classifier():
+    """Shared classifier, built on first use"""
+    if _classifier is None:
+        return refresh_domain_classifier()
+    return _classifier
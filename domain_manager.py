@@ -1,35 +1,23 @@
 import logging
-import re
-from collections import defaultdict, Counter
+from collections import defaultdict
 from datetime import datetime
-from models import WhitelistDomain, EmailRecord, ProcessingSession
+from sqlalchemy import update, delete, insert, bindparam, case
+from sqlalchemy.dialects import postgresql, sqlite
+from models import WhitelistDomain, EmailRecord, ProcessingSession, DomainStats, DomainSessionStats, DomainSenderStats
+from whitelist_index import WhitelistIndex
+from domain_classifier import refresh_domain_classifier, get_domain_classifier
+from performance_config import config
 from app import db
 
 logger = logging.getLogger(__name__)
 
+# Justification words that raise a domain's trust score
+BUSINESS_INDICATORS = ['business', 'corporate', 'official', 'legitimate']
+
 class DomainManager:
     """Domain classification and whitelist management system"""
     
     def __init__(self):
-        # Domain classification patterns
-        self.domain_patterns = {
-            'corporate': [
-                r'\.com$', r'\.corp$', r'\.org$', r'\.gov$', r'\.edu$'
-            ],
-            'personal': [
-                r'gmail\.com$', r'yahoo\.com$', r'hotmail\.com$', r'outlook\.com$',
-                r'aol\.com$', r'icloud\.com$', r'protonmail\.com$'
-            ],
-            'public': [
-                r'gmail\.com$', r'yahoo\.com$', r'hotmail\.com$', r'outlook\.com$',
-                r'live\.com$', r'msn\.com$', r'ymail\.com$'
-            ],
-            'suspicious': [
-                r'\.tk$', r'\.ml$', r'\.ga$', r'\.cf$', r'temp.*\.com$',
-                r'10minutemail\.', r'guerrillamail\.', r'mailinator\.'
-            ]
-        }
-        
         # Trust scoring weights
         self.trust_weights = {
             'communication_frequency': 0.3,
@@ -38,51 +26,61 @@ class DomainManager:
             'domain_reputation': 0.1
         }
     
+    def get_whitelist_set(self):
+        """Get the set of active whitelisted domains"""
+        whitelist_domains = WhitelistDomain.query.filter_by(is_active=True).all()
+        return set(domain.domain.lower().strip() for domain in whitelist_domains)
+    
+    def get_whitelist_index(self):
+        """Compile the active whitelisted domains for a processing run"""
+        return WhitelistIndex(self.get_whitelist_set(), config.whitelist_match_mode)
+    
     def apply_whitelist_filtering(self, session_id):
         """Apply whitelist filtering to session records"""
         try:
             logger.info(f"Applying whitelist filtering for session {session_id}")
             
             # Get active whitelist domains
-            whitelist_domains = WhitelistDomain.query.filter_by(is_active=True).all()
-            whitelist_set = set(domain.domain.lower().strip() for domain in whitelist_domains)
+            whitelist_index = self.get_whitelist_index()
             
-            if not whitelist_set:
+            if not whitelist_index:
                 logger.info("No whitelist domains found")
                 return 0
             
-            logger.info(f"Active whitelist domains: {list(whitelist_set)}")
+            logger.info(f"Active whitelist domains ({whitelist_index.mode} matching): {sorted(whitelist_index.domains)}")
             
-            # Get non-excluded records
-            records = EmailRecord.query.filter(
+            # Resolve each distinct domain of the non-excluded records once
+            not_excluded = db.and_(
                 EmailRecord.session_id == session_id,
                 EmailRecord.excluded_by_rule.is_(None)
-            ).all()
-            
+            )
+            domains = db.session.query(EmailRecord.recipients_email_domain).filter(
+                not_excluded,
+                EmailRecord.recipients_email_domain.isnot(None)
+            ).distinct().all()
+            
+            domains_by_match = defaultdict(list)
+            for (domain,) in domains:
+                match = whitelist_index.match(domain)
+                if match:
+                    domains_by_match[match[0]].append(domain)
+            
+            # One UPDATE per whitelisted domain over the record domains it matched
+            table = EmailRecord.__table__
             whitelisted_count = 0
-            
-            for record in records:
-                if record.recipients_email_domain:
-                    domain = record.recipients_email_domain.lower().strip()
-                    
-                    # Direct match
-                    if domain in whitelist_set:
-                        record.whitelisted = True
-                        whitelisted_count += 1
-                        logger.debug(f"Record {record.record_id} whitelisted for domain: {domain}")
-                    else:
-                        # Check if any whitelisted domain is a substring of the record domain
-                        # or if the record domain is a substring of any whitelisted domain
-                        for whitelist_domain in whitelist_set:
-                            if (domain == whitelist_domain or 
-                                domain.endswith('.' + whitelist_domain) or 
-                                whitelist_domain.endswith('.' + domain) or
-                                domain in whitelist_domain or 
-                                whitelist_domain in domain):
-                                record.whitelisted = True
-                                whitelisted_count += 1
-                                logger.debug(f"Record {record.record_id} whitelisted for domain: {domain} (matched with {whitelist_domain})")
-                                break
+            for whitelist_domain, matched_domains in sorted(domains_by_match.items()):
+                count = 0
+                for start in range(0, len(matched_domains), 500):
+                    count += db.session.execute(
+                        update(table).where(
+                            table.c.session_id == session_id,
+                            table.c.excluded_by_rule.is_(None),
+                            table.c.recipients_email_domain.in_(matched_domains[start:start + 500])
+                        ).values(whitelisted=True)
+                    ).rowcount
+                logger.debug(f"Whitelisted {count} records for domain: {whitelist_domain} "
+                             f"({len(matched_domains)} recipient domains)")
+                whitelisted_count += count
             
             db.session.commit()
             logger.info(f"Whitelist filtering applied: {whitelisted_count} records whitelisted")
@@ -93,26 +91,26 @@ class DomainManager:
             db.session.rollback()
             raise
     
+    def apply_whitelist_to_record(self, record, whitelist_index):
+        """Mark a single record as whitelisted if its recipient domain matches the whitelist"""
+        if not record.recipients_email_domain:
+            return False
+        
+        match = whitelist_index.match(record.recipients_email_domain)
+        if match:
+            record.whitelisted = True
+            logger.debug(f"Record {record.record_id} whitelisted for domain: {record.recipients_email_domain} "
+                         f"({match[1]} match with {match[0]})")
+            return True
+        
+        return False
+    
     def classify_domain(self, domain):
         """Classify a domain into categories"""
         if not domain:
             return 'Unknown'
         
-        domain_lower = domain.lower()
-        
-        # Check against patterns
-        for category, patterns in self.domain_patterns.items():
-            for pattern in patterns:
-                if re.search(pattern, domain_lower):
-                    return category.title()
-        
-        # Default classification logic
-        if any(corp in domain_lower for corp in ['company', 'corp', 'enterprise', 'business']):
-            return 'Corporate'
-        elif len(domain_lower.split('.')) == 2 and not domain_lower.endswith(('.com', '.org', '.net')):
-            return 'Suspicious'
-        else:
-            return 'Corporate'
+        return get_domain_classifier().domain_class(domain)
     
     def calculate_domain_trust_score(self, domain, session_records=None):
         """Calculate trust score for a domain (0-100)"""
@@ -120,92 +118,100 @@ class DomainManager:
             if not domain:
                 return 0
             
-            score_components = {
-                'base_score': 50,  # Start with neutral score
-                'frequency_bonus': 0,
-                'risk_penalty': 0,
-                'business_bonus': 0,
-                'reputation_modifier': 0
-            }
+            # Without session records, use the domain's rolling statistics over all processed sessions
+            if not session_records:
+                stats = DomainStats.query.filter_by(domain=domain.lower()).first()
+                if not stats or not stats.communication_count:
+                    return 50  # Neutral score
+                return self._score_domain_trust(domain, stats.communication_count, stats.avg_risk_score,
+                                                stats.business_mentions)
             
             # Get records for this domain
-            if session_records:
-                domain_records = [r for r in session_records 
-                                if r.recipients_email_domain and r.recipients_email_domain.lower() == domain.lower()]
-            else:
-                domain_records = EmailRecord.query.filter(
-                    db.func.lower(EmailRecord.recipients_email_domain) == domain.lower()
-                ).all()
+            domain_records = [r for r in session_records 
+                            if r.recipients_email_domain and r.recipients_email_domain.lower() == domain.lower()]
             
             if not domain_records:
-                return score_components['base_score']
-            
-            # Communication frequency bonus (more communications = more trust)
-            frequency_count = len(domain_records)
-            if frequency_count > 10:
-                score_components['frequency_bonus'] = min(20, frequency_count)
-            elif frequency_count > 5:
-                score_components['frequency_bonus'] = 10
-            elif frequency_count > 2:
-                score_components['frequency_bonus'] = 5
-            
-            # Risk score penalty
+                return 50  # Neutral score
+            
             risk_scores = [r.ml_risk_score for r in domain_records if r.ml_risk_score is not None]
-            if risk_scores:
-                avg_risk = sum(risk_scores) / len(risk_scores)
-                score_components['risk_penalty'] = -int(avg_risk * 40)  # Higher risk = lower trust
-            
-            # Business context bonus
-            business_indicators = ['business', 'corporate', 'official', 'legitimate']
-            justifications = [r.justification or '' for r in domain_records]
-            business_mentions = sum(1 for just in justifications 
-                                  for indicator in business_indicators 
-                                  if indicator in just.lower())
-            
-            if business_mentions > 0:
-                score_components['business_bonus'] = min(15, business_mentions * 3)
-            
-            # Domain reputation modifier based on classification
-            domain_class = self.classify_domain(domain)
-            if domain_class == 'Corporate':
-                score_components['reputation_modifier'] = 10
-            elif domain_class == 'Personal':
-                score_components['reputation_modifier'] = -5
-            elif domain_class == 'Suspicious':
-                score_components['reputation_modifier'] = -25
-            
-            # Calculate final score
-            final_score = sum(score_components.values())
-            final_score = max(0, min(100, final_score))  # Clamp between 0-100
-            
-            return int(final_score)
+            avg_risk = sum(risk_scores) / len(risk_scores) if risk_scores else None
+            business_mentions = sum(self._count_business_mentions(r.justification) for r in domain_records)
+            
+            return self._score_domain_trust(domain, len(domain_records), avg_risk, business_mentions)
             
         except Exception as e:
             logger.error(f"Error calculating trust score for domain {domain}: {str(e)}")
             return 50  # Return neutral score on error
     
+    def _count_business_mentions(self, justification):
+        """Number of business indicators mentioned in a justification"""
+        justification = (justification or '').lower()
+        return sum(1 for indicator in BUSINESS_INDICATORS if indicator in justification)
+    
+    def _score_domain_trust(self, domain, frequency_count, avg_risk, business_mentions, domain_class=None):
+        """Trust score (0-100) from a domain's communication count, average risk and business mentions"""
+        score_components = {
+            'base_score': 50,  # Start with neutral score
+            'frequency_bonus': 0,
+            'risk_penalty': 0,
+            'business_bonus': 0,
+            'reputation_modifier': 0
+        }
+        
+        # Communication frequency bonus (more communications = more trust)
+        if frequency_count > 10:
+            score_components['frequency_bonus'] = min(20, frequency_count)
+        elif frequency_count > 5:
+            score_components['frequency_bonus'] = 10
+        elif frequency_count > 2:
+            score_components['frequency_bonus'] = 5
+        
+        # Risk score penalty
+        if avg_risk is not None:
+            score_components['risk_penalty'] = -int(avg_risk * 40)  # Higher risk = lower trust
+        
+        # Business context bonus
+        if business_mentions > 0:
+            score_components['business_bonus'] = min(15, business_mentions * 3)
+        
+        # Domain reputation modifier based on classification
+        domain_class = domain_class or self.classify_domain(domain)
+        if domain_class == 'Corporate':
+            score_components['reputation_modifier'] = 10
+        elif domain_class == 'Personal':
+            score_components['reputation_modifier'] = -5
+        elif domain_class == 'Suspicious':
+            score_components['reputation_modifier'] = -25
+        
+        # Calculate final score
+        final_score = sum(score_components.values())
+        final_score = max(0, min(100, final_score))  # Clamp between 0-100
+        
+        return int(final_score)
+    
     def analyze_whitelist_recommendations(self, session_id):
         """Analyze and recommend domains for whitelisting"""
         try:
             logger.info(f"Analyzing whitelist recommendations for session {session_id}")
+            refresh_domain_classifier()
             
-            # Get session records
-            records = EmailRecord.query.filter_by(session_id=session_id).all()
+            # Aggregate every per-domain metric in one pass over the session records
+            total_records, domain_aggregates, sender_domain_pairs = self._collect_domain_statistics(session_id)
             
-            if not records:
+            if not total_records:
                 return {'error': 'No records found for session'}
             
             # Analyze domain patterns
-            domain_stats = self._analyze_domain_communication_patterns(records)
+            domain_stats = self._analyze_domain_communication_patterns(domain_aggregates)
             
             # Generate recommendations
-            recommendations = self._generate_domain_recommendations(domain_stats, records)
+            recommendations = self._generate_domain_recommendations(domain_stats, total_records)
             
             # Analyze current whitelist effectiveness
             whitelist_effectiveness = self._analyze_whitelist_effectiveness(session_id)
             
             # BAU pattern analysis
-            bau_patterns = self._analyze_bau_communication_patterns(records)
+            bau_patterns = self._analyze_bau_communication_patterns(domain_stats, sender_domain_pairs)
             
             # Get all domains sorted by different criteria
             all_domains = self._get_all_domains_analysis(domain_stats)
@@ -226,59 +232,86 @@ class DomainManager:
             logger.error(f"Error analyzing whitelist recommendations: {str(e)}")
             return {'error': str(e)}
     
-    def _analyze_domain_communication_patterns(self, records):
-        """Analyze communication patterns for each domain"""
-        domain_stats = defaultdict(lambda: {
-            'communication_count': 0,
-            'unique_senders': set(),
-            'risk_scores': [],
-            'high_risk_count': 0,
-            'justifications': [],
-            'time_patterns': [],
-            'attachment_count': 0,
-            'classification': 'Unknown',
-            'trust_score': 0
-        })
+    def _collect_domain_statistics(self, session_id):
+        """Record count, per-domain aggregates and sender -> domain pair counts of a session, in one pass"""
+        rows = db.session.query(
+            EmailRecord.recipients_email_domain, EmailRecord.sender, EmailRecord.ml_risk_score,
+            EmailRecord.justification, EmailRecord.time, EmailRecord.attachments
+        ).filter(EmailRecord.session_id == session_id).order_by(EmailRecord.id).all()
         
-        for record in records:
-            if not record.recipients_email_domain:
+        domain_aggregates = {}
+        sender_domain_pairs = defaultdict(int)
+        free_email = {}
+        for recipients_domain, sender, risk_score, justification, time, attachments in rows:
+            if not recipients_domain:
                 continue
             
-            domain = record.recipients_email_domain.lower()
-            stats = domain_stats[domain]
+            domain = recipients_domain.lower()
+            stats = domain_aggregates.get(domain)
+            if stats is None:
+                stats = domain_aggregates[domain] = {
+                    'communication_count': 0,
+                    'unique_senders': set(),
+                    'risk_scores': [],
+                    'high_risk_count': 0,
+                    'justifications': [],
+                    'time_patterns': [],
+                    'attachment_count': 0,
+                    'business_mentions': 0
+                }
+                free_email[domain] = self._is_free_email_domain(domain)
             
             stats['communication_count'] += 1
-            if record.sender:
-                stats['unique_senders'].add(record.sender.lower())
-            
-            if record.ml_risk_score is not None:
-                stats['risk_scores'].append(record.ml_risk_score)
-                if record.ml_risk_score > 0.6:
+            if sender:
+                stats['unique_senders'].add(sender.lower())
+                # Regular communication pairs (sender -> domain) - exclude free email domains
+                if not free_email[domain]:
+                    sender_domain_pairs[f"{self._extract_domain_from_email(sender)} -> {domain}"] += 1
+            
+            if risk_score is not None:
+                stats['risk_scores'].append(risk_score)
+                if risk_score > 0.6:
                     stats['high_risk_count'] += 1
             
-            if record.justification:
-                stats['justifications'].append(record.justification)
+            if justification:
+                stats['justifications'].append(justification)
+                stats['business_mentions'] += self._count_business_mentions(justification)
             
-            if record.time:
-                stats['time_patterns'].append(record.time)
+            if time:
+                stats['time_patterns'].append(time)
             
-            if record.attachments:
+            if attachments:
                 stats['attachment_count'] += 1
         
-        # Post-process statistics
+        return len(rows), domain_aggregates, sender_domain_pairs
+    
+    def _analyze_domain_communication_patterns(self, domain_aggregates):
+        """Analyze communication patterns for each domain"""
         processed_stats = {}
-        for domain, stats in domain_stats.items():
-            stats['unique_senders'] = list(stats['unique_senders'])
-            stats['avg_risk_score'] = sum(stats['risk_scores']) / len(stats['risk_scores']) if stats['risk_scores'] else 0
-            stats['classification'] = self.classify_domain(domain)
-            stats['trust_score'] = self.calculate_domain_trust_score(domain, records)
+        for domain, aggregates in domain_aggregates.items():
+            stats = {
+                'communication_count': aggregates['communication_count'],
+                'unique_senders': list(aggregates['unique_senders']),
+                'risk_scores': aggregates['risk_scores'],
+                'high_risk_count': aggregates['high_risk_count'],
+                'justifications': aggregates['justifications'],
+                'time_patterns': aggregates['time_patterns'],
+                'attachment_count': aggregates['attachment_count'],
+                'classification': self.classify_domain(domain)
+            }
+            risk_scores = stats['risk_scores']
+            stats['avg_risk_score'] = sum(risk_scores) / len(risk_scores) if risk_scores else 0
+            stats['trust_score'] = self._score_domain_trust(
+                domain, stats['communication_count'], stats['avg_risk_score'] if risk_scores else None,
+                aggregates['business_mentions'], stats['classification']
+            )
             stats['high_risk_ratio'] = stats['high_risk_count'] / stats['communication_count'] if stats['communication_count'] > 0 else 0
             
-            processed_stats[domain] = dict(stats)
+            processed_stats[domain] = stats
         
         return processed_stats
     
-    def _generate_domain_recommendations(self, domain_stats, records):
+    def _generate_domain_recommendations(self, domain_stats, total_records):
         """Generate whitelist recommendations based on domain analysis"""
         recommendations = []
         
@@ -291,6 +324,9 @@ class DomainManager:
                               key=lambda x: (x[1]['communication_count'], x[1]['trust_score']), 
                               reverse=True)
         
+        # History of the domains across all processed sessions
+        domain_history = self.get_domain_stats(domain_stats)
+        
         for domain, stats in sorted_domains:
             if domain in current_whitelist:
                 continue  # Skip already whitelisted domains
@@ -320,13 +356,27 @@ class DomainManager:
                     'classification': stats['classification'],
                     'confidence_level': confidence_level,
                     'recommendation_reason': self._generate_recommendation_reason(stats),
-                    'potential_impact': self._calculate_whitelist_impact(domain, records)
+                    'potential_impact': self._calculate_whitelist_impact(stats['communication_count'], total_records),
+                    'history': self._domain_history(domain_history.get(domain))
                 }
                 
                 recommendations.append(recommendation)
         
         return sorted(recommendations, key=lambda x: (x['trust_score'], x['communication_count']), reverse=True)
     
+    def get_domain_history(self, domain):
+        """Cross-session statistics and trust score of a single domain"""
+        return self._domain_history(self.get_domain_stats([domain]).get(domain.lower()))
+    
+    def _domain_history(self, history):
+        """Cross-session statistics and trust score of a domain, None if it has no history"""
+        if history is None or not history.communication_count:
+            return None
+        summary = history.to_dict()
+        summary['trust_score'] = self._score_domain_trust(history.domain, history.communication_count,
+                                                          history.avg_risk_score, history.business_mentions)
+        return summary
+    
     def _generate_recommendation_reason(self, stats):
         """Generate human-readable reason for recommendation"""
         reasons = []
@@ -348,14 +398,8 @@ class DomainManager:
         
         return "; ".join(reasons) if reasons else "Meets standard whitelist criteria"
     
-    def _calculate_whitelist_impact(self, domain, records):
+    def _calculate_whitelist_impact(self, domain_count, total_records):
         """Calculate the potential impact of whitelisting a domain"""
-        domain_records = [r for r in records 
-                         if r.recipients_email_domain and r.recipients_email_domain.lower() == domain.lower()]
-        
-        total_records = len(records)
-        domain_count = len(domain_records)
-        
         return {
             'records_affected': domain_count,
             'percentage_of_total': round((domain_count / total_records * 100), 2) if total_records > 0 else 0,
@@ -461,15 +505,9 @@ class DomainManager:
 
     def _is_free_email_domain(self, domain):
         """Check if domain is a free email provider"""
-        free_email_domains = {
-            'gmail.com', 'yahoo.com', 'hotmail.com', 'outlook.com', 'aol.com',
-            'icloud.com', 'live.com', 'msn.com', 'ymail.com', 'protonmail.com',
-            'mail.com', 'zoho.com', 'gmx.com', 'tutanota.com', 'fastmail.com',
-            'hushmail.com', 'rocketmail.com', 'rediffmail.com', 'inbox.com'
-        }
-        return domain.lower() in free_email_domains
+        return get_domain_classifier().is_public(domain, 'free_email')
 
-    def _analyze_bau_communication_patterns(self, records):
+    def _analyze_bau_communication_patterns(self, domain_stats, sender_domain_pairs):
         """Analyze Business As Usual communication patterns"""
         bau_patterns = {
             'high_frequency_domains': [],
@@ -478,16 +516,14 @@ class DomainManager:
             'low_risk_high_volume': []
         }
         
-        # Domain frequency analysis - exclude free email domains
-        domain_frequency = Counter(r.recipients_email_domain.lower() 
-                                 for r in records if r.recipients_email_domain)
+        # Domain frequency analysis, most frequent first in order of first appearance
+        top_domains = sorted(domain_stats.items(), key=lambda item: item[1]['communication_count'], reverse=True)[:20]
         
         # High frequency domains (potential BAU) - exclude free email domains
-        for domain, count in domain_frequency.most_common(20):
+        for domain, stats in top_domains:
+            count = stats['communication_count']
             if count >= 5 and not self._is_free_email_domain(domain):  # Threshold for high frequency and not free email
-                domain_records = [r for r in records 
-                                if r.recipients_email_domain and r.recipients_email_domain.lower() == domain]
-                avg_risk = sum(r.ml_risk_score for r in domain_records if r.ml_risk_score) / len(domain_records)
+                avg_risk = sum(stats['risk_scores']) / count
                 
                 bau_likelihood = 'High'
                 if avg_risk > 0.3 or count < 10:
@@ -503,16 +539,6 @@ class DomainManager:
                     'is_corporate': not self._is_free_email_domain(domain)
                 })
         
-        # Regular communication pairs (sender -> domain) - exclude free email domains
-        sender_domain_pairs = defaultdict(int)
-        for record in records:
-            if record.sender and record.recipients_email_domain:
-                sender_domain = self._extract_domain_from_email(record.sender)
-                recipient_domain = record.recipients_email_domain.lower()
-                if not self._is_free_email_domain(recipient_domain):
-                    pair = f"{sender_domain} -> {recipient_domain}"
-                    sender_domain_pairs[pair] += 1
-        
         for pair, count in sender_domain_pairs.items():
             if count >= 3:  # Regular communication threshold
                 bau_patterns['regular_communication_pairs'].append({
@@ -547,6 +573,217 @@ class DomainManager:
             'recommendation_summary': f"{recommended_count} domains recommended for whitelisting with {high_confidence_count} high-confidence recommendations"
         }
     
+    def get_domain_stats(self, domains):
+        """Rolling cross-session statistics of the given domains, keyed by lower-cased domain"""
+        domains = list(dict.fromkeys(domain.lower() for domain in domains if domain))
+        stats = {}
+        for start in range(0, len(domains), 500):
+            for domain_stats in DomainStats.query.filter(DomainStats.domain.in_(domains[start:start + 500])).all():
+                stats[domain_stats.domain] = domain_stats
+        return stats
+    
+    def update_domain_stats(self, session_id):
+        """Add a processed session to the cross-session domain statistics, replacing its earlier contribution"""
+        try:
+            self._subtract_domain_stats(session_id)
+            
+            session = ProcessingSession.query.get(session_id)
+            seen_at = (session.upload_time if session else None) or datetime.utcnow()
+            _, domain_aggregates, _ = self._collect_domain_statistics(session_id)
+            
+            # Sorted, so concurrent sessions lock shared domain_stats rows in the same order
+            domains = sorted(domain_aggregates)
+            for start in range(0, len(domains), 500):
+                chunk = domains[start:start + 500]
+                session_rows = []
+                for domain in chunk:
+                    aggregates = domain_aggregates[domain]
+                    risk_scores = aggregates['risk_scores']
+                    session_rows.append({
+                        'session_id': session_id,
+                        'domain': domain,
+                        'communication_count': aggregates['communication_count'],
+                        'risk_score_sum': sum(risk_scores),
+                        'risk_score_count': len(risk_scores),
+                        'risk_score_max': max(risk_scores) if risk_scores else None,
+                        'high_risk_count': aggregates['high_risk_count'],
+                        'attachment_count': aggregates['attachment_count'],
+                        'business_mentions': aggregates['business_mentions'],
+                        'senders': sorted(aggregates['unique_senders']),
+                        'seen_at': seen_at
+                    })
+                
+                # Counters are incremented in the database, so concurrent sessions never overwrite each other
+                db.session.execute(self._domain_stats_upsert(), [{
+                    'domain': row['domain'],
+                    'communication_count': row['communication_count'],
+                    'session_count': 1,
+                    'sender_count': 0,
+                    'risk_score_sum': row['risk_score_sum'],
+                    'risk_score_count': row['risk_score_count'],
+                    'risk_score_max': row['risk_score_max'],
+                    'high_risk_count': row['high_risk_count'],
+                    'attachment_count': row['attachment_count'],
+                    'business_mentions': row['business_mentions'],
+                    'first_seen': seen_at,
+                    'last_seen': seen_at,
+                    'updated_at': datetime.utcnow()
+                } for row in session_rows])
+                db.session.execute(insert(DomainSessionStats), session_rows)
+                
+                sender_rows = [{'domain': row['domain'], 'sender': sender, 'session_count': 1}
+                               for row in session_rows for sender in row['senders']]
+                if sender_rows:
+                    db.session.execute(self._domain_sender_stats_upsert(), sender_rows)
+                self._refresh_sender_counts(chunk)
+            
+            db.session.commit()
+            logger.info(f"Domain statistics updated with {len(domains)} domains from session {session_id}")
+        
+        except Exception as e:
+            logger.error(f"Error updating domain statistics for session {session_id}: {str(e)}")
+            db.session.rollback()
+            raise
+    
+    def remove_domain_stats(self, session_id):
+        """Subtract a deleted session from the cross-session domain statistics"""
+        try:
+            self._subtract_domain_stats(session_id)
+            db.session.commit()
+        except Exception as e:
+            logger.error(f"Error removing domain statistics of session {session_id}: {str(e)}")
+            db.session.rollback()
+            raise
+    
+    def _subtract_domain_stats(self, session_id):
+        """Remove a session's contribution to the domain statistics without committing"""
+        session_rows = DomainSessionStats.query.filter_by(session_id=session_id).order_by(DomainSessionStats.domain).all()
+        if not session_rows:
+            return
+        
+        stats = DomainStats.__table__.c
+        session_stats = DomainSessionStats.__table__.c
+        other_sessions = db.and_(session_stats.domain == stats.domain, session_stats.session_id != session_id)
+        # Maximum risk and first/last seen can't be subtracted, take them from the remaining sessions
+        remaining = lambda aggregate: db.select(aggregate).where(other_sessions).scalar_subquery()
+        subtract = update(DomainStats.__table__).where(stats.domain == bindparam('b_domain')).values(
+            communication_count=stats.communication_count - bindparam('b_communication_count'),
+            session_count=stats.session_count - 1,
+            risk_score_count=stats.risk_score_count - bindparam('b_risk_score_count'),
+            risk_score_sum=case(
+                (stats.risk_score_count - bindparam('b_risk_score_count') > 0,
+                 stats.risk_score_sum - bindparam('b_risk_score_sum')),
+                else_=0.0
+            ),
+            high_risk_count=stats.high_risk_count - bindparam('b_high_risk_count'),
+            attachment_count=stats.attachment_count - bindparam('b_attachment_count'),
+            business_mentions=stats.business_mentions - bindparam('b_business_mentions'),
+            risk_score_max=remaining(db.func.max(session_stats.risk_score_max)),
+            first_seen=remaining(db.func.min(session_stats.seen_at)),
+            last_seen=remaining(db.func.max(session_stats.seen_at))
+        )
+        sender_table = DomainSenderStats.__table__
+        subtract_sender = update(sender_table).where(
+            sender_table.c.domain == bindparam('b_domain'), sender_table.c.sender == bindparam('b_sender')
+        ).values(session_count=sender_table.c.session_count - 1)
+        
+        for start in range(0, len(session_rows), 500):
+            chunk = session_rows[start:start + 500]
+            domains = [row.domain for row in chunk]
+            db.session.execute(subtract, [{
+                'b_domain': row.domain,
+                'b_communication_count': row.communication_count,
+                'b_risk_score_count': row.risk_score_count,
+                'b_risk_score_sum': row.risk_score_sum,
+                'b_high_risk_count': row.high_risk_count,
+                'b_attachment_count': row.attachment_count,
+                'b_business_mentions': row.business_mentions
+            } for row in chunk])
+            db.session.execute(delete(DomainStats.__table__).where(
+                stats.domain.in_(domains), ~db.exists().where(other_sessions)
+            ))
+            
+            sender_rows = [{'b_domain': row.domain, 'b_sender': sender} for row in chunk for sender in row.senders or []]
+            if sender_rows:
+                db.session.execute(subtract_sender, sender_rows)
+            db.session.execute(delete(sender_table).where(
+                sender_table.c.domain.in_(domains), sender_table.c.session_count <= 0
+            ))
+            self._refresh_sender_counts(domains)
+        
+        db.session.execute(delete(DomainSessionStats.__table__).where(session_stats.session_id == session_id))
+        # Objects loaded before the statements ran hold the old counts
+        db.session.expire_all()
+    
+    def _insert_on_conflict(self, table):
+        """INSERT statement of the session's database dialect, which supports ON CONFLICT"""
+        if db.session.get_bind().dialect.name == 'postgresql':
+            return postgresql.insert(table)
+        return sqlite.insert(table)
+    
+    def _domain_stats_upsert(self):
+        """Insert a domain's statistics or add a session's contribution to its existing row"""
+        statement = self._insert_on_conflict(DomainStats.__table__)
+        stats, added = DomainStats.__table__.c, statement.excluded
+        return statement.on_conflict_do_update(index_elements=['domain'], set_={
+            'communication_count': stats.communication_count + added.communication_count,
+            'session_count': stats.session_count + added.session_count,
+            'risk_score_sum': stats.risk_score_sum + added.risk_score_sum,
+            'risk_score_count': stats.risk_score_count + added.risk_score_count,
+            'risk_score_max': case(
+                (added.risk_score_max.is_(None), stats.risk_score_max),
+                (db.or_(stats.risk_score_max.is_(None), added.risk_score_max > stats.risk_score_max),
+                 added.risk_score_max),
+                else_=stats.risk_score_max
+            ),
+            'high_risk_count': stats.high_risk_count + added.high_risk_count,
+            'attachment_count': stats.attachment_count + added.attachment_count,
+            'business_mentions': stats.business_mentions + added.business_mentions,
+            'first_seen': case(
+                (db.or_(stats.first_seen.is_(None), added.first_seen < stats.first_seen), added.first_seen),
+                else_=stats.first_seen
+            ),
+            'last_seen': case(
+                (db.or_(stats.last_seen.is_(None), added.last_seen > stats.last_seen), added.last_seen),
+                else_=stats.last_seen
+            ),
+            'updated_at': added.updated_at
+        })
+    
+    def _domain_sender_stats_upsert(self):
+        """Insert a (domain, sender) pair or count one more session for it"""
+        statement = self._insert_on_conflict(DomainSenderStats.__table__)
+        return statement.on_conflict_do_update(index_elements=['domain', 'sender'], set_={
+            'session_count': DomainSenderStats.__table__.c.session_count + statement.excluded.session_count
+        })
+    
+    def _refresh_sender_counts(self, domains):
+        """Recount the distinct senders of domains from their (domain, sender) rows"""
+        stats = DomainStats.__table__.c
+        senders = DomainSenderStats.__table__.c
+        sender_count = db.select(db.func.count(senders.id)).where(senders.domain == stats.domain).scalar_subquery()
+        db.session.execute(update(DomainStats.__table__).where(stats.domain.in_(domains)).values(sender_count=sender_count))
+    
+    def rebuild_domain_stats(self):
+        """Recompute the cross-session domain statistics from every completed session"""
+        try:
+            DomainSenderStats.query.delete()
+            DomainSessionStats.query.delete()
+            DomainStats.query.delete()
+            db.session.commit()
+            
+            session_ids = [row[0] for row in db.session.query(ProcessingSession.id).filter(
+                ProcessingSession.status == 'completed'
+            ).order_by(ProcessingSession.upload_time).all()]
+            for session_id in session_ids:
+                self.update_domain_stats(session_id)
+            return len(session_ids)
+            
+        except Exception as e:
+            logger.error(f"Error rebuilding domain statistics: {str(e)}")
+            db.session.rollback()
+            return 0
+    
     def add_domain_to_whitelist(self, domain, domain_type='Corporate', added_by='System', notes=''):
         """Add a domain to the whitelist"""
         try:
@@ -603,31 +840,168 @@ class DomainManager:
             logger.error(f"Error removing domain from whitelist: {str(e)}")
             return {'status': 'error', 'error': str(e)}
     
-    def bulk_add_domains_to_whitelist(self, domains_list, added_by='Admin'):
-        """Add multiple domains to whitelist in bulk"""
+    def bulk_add_domains_to_whitelist(self, domains_list, added_by='Admin', domain_type='Corporate'):
+        """Add or reactivate multiple whitelist domains in a single transaction"""
+        results = {
+            'added': [],
+            'reactivated': [],
+            'already_exists': [],
+            'errors': []
+        }
         try:
-            results = {
-                'added': [],
-                'reactivated': [],
-                'already_exists': [],
-                'errors': []
-            }
-            
-            for domain in domains_list:
-                domain = domain.strip().lower()
-                if not domain:
-                    continue
-                
-                result = self.add_domain_to_whitelist(domain, added_by=added_by)
-                status = result['status']
-                
-                if status in results:
-                    results[status].append(domain)
+            domains = list(dict.fromkeys(domain.strip().lower() for domain in domains_list if domain and domain.strip()))
+            existing = self._get_whitelist_entries(domains)
+            now = datetime.utcnow()
+            
+            for domain in domains:
+                entry = existing.get(domain)
+                if entry is None:
+                    db.session.add(WhitelistDomain(domain=domain, domain_type=domain_type, added_by=added_by))
+                    results['added'].append(domain)
+                elif not entry.is_active:
+                    entry.is_active = True
+                    entry.added_at = now
+                    entry.added_by = added_by
+                    results['reactivated'].append(domain)
                 else:
-                    results['errors'].append(f"{domain}: {result.get('error', 'Unknown error')}")
+                    results['already_exists'].append(domain)
             
+            db.session.commit()
+            logger.info(f"Bulk whitelist update by {added_by}: {len(results['added'])} added, "
+                        f"{len(results['reactivated'])} reactivated, {len(results['already_exists'])} already active")
             return results
             
         except Exception as e:
+            db.session.rollback()
             logger.error(f"Error in bulk domain addition: {str(e)}")
-            return {'errors': [str(e)]}
+            return {'added': [], 'reactivated': [], 'already_exists': [], 'errors': [str(e)]}
+    
+    def bulk_remove_domains_from_whitelist(self, domains_list):
+        """Deactivate multiple whitelist domains in a single transaction"""
+        results = {
+            'removed': [],
+            'already_inactive': [],
+            'not_found': [],
+            'errors': []
+        }
+        try:
+            domains = list(dict.fromkeys(domain.strip().lower() for domain in domains_list if domain and domain.strip()))
+            existing = self._get_whitelist_entries(domains)
+            
+            for domain in domains:
+                entry = existing.get(domain)
+                if entry is None:
+                    results['not_found'].append(domain)
+                elif entry.is_active:
+                    entry.is_active = False
+                    results['removed'].append(domain)
+                else:
+                    results['already_inactive'].append(domain)
+            
+            db.session.commit()
+            logger.info(f"Bulk whitelist removal: {len(results['removed'])} removed")
+            return results
+            
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error in bulk domain removal: {str(e)}")
+            return {'removed': [], 'already_inactive': [], 'not_found': [], 'errors': [str(e)]}
+    
+    def _get_whitelist_entries(self, domains):
+        """Whitelist entries of the given lower-cased domains, keyed by domain"""
+        entries = {}
+        for start in range(0, len(domains), 500):
+            for entry in WhitelistDomain.query.filter(WhitelistDomain.domain.in_(domains[start:start + 500])).all():
+                entries[entry.domain] = entry
+        return entries
+    
+    def find_sessions_with_domains(self, domains):
+        """Processed sessions with records whose recipient domain matches any of the given whitelist domains"""
+        changed_index = WhitelistIndex(domains, config.whitelist_match_mode)
+        if not changed_index:
+            return []
+        
+        # The per-session domain statistics list every recipient domain of each processed session
+        matched = [domain for (domain,) in db.session.query(DomainSessionStats.domain).distinct()
+                   if changed_index.match(domain)]
+        session_ids = set()
+        for start in range(0, len(matched), 500):
+            session_ids.update(session_id for (session_id,) in db.session.query(DomainSessionStats.session_id).filter(
+                DomainSessionStats.domain.in_(matched[start:start + 500])
+            ).distinct())
+        return sorted(session_ids)
+    
+    def reapply_whitelist_domains(self, session_id, domains):
+        """Update the whitelist flag of a session's records sent to changed whitelist domains
+        
+        Returns the number of records whitelisted and no longer whitelisted, and the recipient
+        domains of the latter, whose records need the security rules applied.
+        """
+        try:
+            changed_index = WhitelistIndex(domains, config.whitelist_match_mode)
+            whitelist_index = self.get_whitelist_index()
+            
+            record_domains = db.session.query(EmailRecord.recipients_email_domain).filter(
+                EmailRecord.session_id == session_id,
+                EmailRecord.excluded_by_rule.is_(None),
+                EmailRecord.recipients_email_domain.isnot(None)
+            ).distinct().all()
+            
+            whitelisted_domains, removed_domains = [], []
+            for (domain,) in record_domains:
+                if changed_index.match(domain):
+                    if whitelist_index.match(domain):
+                        whitelisted_domains.append(domain)
+                    else:
+                        removed_domains.append(domain)
+            
+            # Only the records that were whitelisted until now still need the security rules
+            table = EmailRecord.__table__
+            unwhitelisted_domains = []
+            for start in range(0, len(removed_domains), 500):
+                unwhitelisted_domains.extend(domain for (domain,) in db.session.query(
+                    EmailRecord.recipients_email_domain
+                ).filter(
+                    EmailRecord.session_id == session_id,
+                    EmailRecord.excluded_by_rule.is_(None),
+                    EmailRecord.recipients_email_domain.in_(removed_domains[start:start + 500]),
+                    EmailRecord.whitelisted == True
+                ).distinct())
+            
+            # Whitelisted records are never scored, as in a fresh processing run; case fields are kept,
+            # analysts edit them too
+            not_whitelisted = db.or_(table.c.whitelisted.is_(None), table.c.whitelisted == False)
+            whitelisted_count = unwhitelisted_count = 0
+            for start in range(0, len(whitelisted_domains), 500):
+                whitelisted_count += db.session.execute(
+                    update(table).where(
+                        table.c.session_id == session_id,
+                        table.c.excluded_by_rule.is_(None),
+                        table.c.recipients_email_domain.in_(whitelisted_domains[start:start + 500]),
+                        not_whitelisted
+                    ).values(whitelisted=True, rule_matches=None, ml_risk_score=None, ml_anomaly_score=None,
+                             risk_level=None, ml_explanation=None)
+                ).rowcount
+            for start in range(0, len(unwhitelisted_domains), 500):
+                unwhitelisted_count += db.session.execute(
+                    update(table).where(
+                        table.c.session_id == session_id,
+                        table.c.excluded_by_rule.is_(None),
+                        table.c.recipients_email_domain.in_(unwhitelisted_domains[start:start + 500]),
+                        table.c.whitelisted == True
+                    ).values(whitelisted=False)
+                ).rowcount
+            
+            db.session.commit()
+            logger.info(f"Whitelist re-applied to session {session_id}: {whitelisted_count} records whitelisted, "
+                        f"{unwhitelisted_count} no longer whitelisted")
+            return {
+                'whitelisted': whitelisted_count,
+                'unwhitelisted': unwhitelisted_count,
+                'unwhitelisted_domains': unwhitelisted_domains
+            }
+            
+        except Exception as e:
+            logger.error(f"Error re-applying whitelist to session {session_id}: {str(e)}")
+            db.session.rollback()
+            raise
@@ -0,0 +1,487 @@
+"""
+Persistent background job queue for Email Guardian
+Jobs are stored in the processing_jobs table and run on a bounded pool of worker threads
+"""
+import logging
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import update, select, func, exists
+from sqlalchemy.orm import aliased
+from models import ProcessingJob, ProcessingSession, EmailRecord, ProcessingError, Rule
+from data_processor import DataProcessor, ProcessingCancelled, JobOwnershipLost
+from performance_config import config
+from app import db
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_JOB_STATUSES = ('queued', 'running')
+
+# Jobs that (re)build a session and own its processing status
+SESSION_JOB_TYPES = ('process_csv', 'reprocess_session')
+
+# PostgreSQL advisory lock serializing job claims across processes
+JOB_CLAIM_LOCK_ID = 0x45474A51
+
+class JobQueue:
+    """DB-backed processing job queue with a bounded worker pool"""
+
+    def __init__(self, app, max_workers=None):
+        self.app = app
+        self.max_workers = max_workers or config.max_concurrent_jobs
+        self.max_concurrent_jobs = config.max_concurrent_jobs
+        self.poll_interval = config.job_poll_interval
+        self.heartbeat_interval = config.job_heartbeat_interval
+        self.stale_seconds = config.job_stale_seconds
+        self.max_attempts = config.job_max_attempts
+        self.worker_prefix = f"{socket.gethostname()}:{os.getpid()}"
+
+        self.job_handlers = {
+            'process_csv': self._run_process_csv,
+            'reprocess_session': self._run_reprocess_session,
+            'reapply_whitelist': self._run_reapply_whitelist,
+            'retrain_models': self._run_retrain_models
+        }
+
+        self._workers = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._last_requeue_check = None
+
+    def enqueue(self, job_type, session_id=None, payload=None):
+        """Add a job to the queue and wake up idle workers"""
+        try:
+            job = ProcessingJob(
+                job_type=job_type,
+                session_id=session_id,
+                payload=payload or {},
+                status='queued'
+            )
+            db.session.add(job)
+            db.session.commit()
+            self._wakeup.set()
+
+            logger.info(f"Queued {job_type} job {job.id} for session {session_id}")
+            return job
+
+        except Exception as e:
+            logger.error(f"Error queueing {job_type} job for session {session_id}: {str(e)}")
+            db.session.rollback()
+            raise
+
+    def enqueue_whitelist_reapplication(self, session_id, domains):
+        """Queue re-applying whitelist changes to a session, merging them into a job already waiting for it"""
+        try:
+            job = ProcessingJob.query.filter(
+                ProcessingJob.session_id == session_id,
+                ProcessingJob.status == 'queued'
+            ).order_by(ProcessingJob.id.desc()).with_for_update().first()
+
+            if job and job.job_type in SESSION_JOB_TYPES:
+                # The queued run applies the whitelist as it is when it gets there
+                db.session.commit()
+                return job
+
+            if job and job.job_type == 'reapply_whitelist':
+                payload = dict(job.payload or {})
+                payload['domains'] = sorted(set(payload.get('domains', [])) | set(domains))
+                merged = db.session.execute(
+                    update(ProcessingJob)
+                    .where(ProcessingJob.id == job.id, ProcessingJob.status == 'queued')
+                    .values(payload=payload),
+                    execution_options={'synchronize_session': False}
+                ).rowcount
+                db.session.commit()
+                if merged:
+                    db.session.refresh(job)
+                    logger.info(f"Merged whitelist changes of {len(domains)} domains into job {job.id} for session {session_id}")
+                    return job
+            else:
+                db.session.commit()
+
+        except Exception as e:
+            logger.error(f"Error merging whitelist changes for session {session_id}: {str(e)}")
+            db.session.rollback()
+            raise
+
+        # Nothing waiting, or the waiting job was claimed meanwhile; the new job runs after the running one
+        return self.enqueue('reapply_whitelist', session_id, {'domains': sorted(domains)})
+
+    def get_job(self, job_id):
+        """Get a job by id"""
+        return ProcessingJob.query.get(job_id)
+
+    def get_session_job(self, session_id):
+        """Get the most recent job for a session"""
+        return ProcessingJob.query.filter_by(session_id=session_id).order_by(ProcessingJob.id.desc()).first()
+
+    def get_active_job(self, session_id):
+        """Get the queued or running job for a session, if any"""
+        return ProcessingJob.query.filter(
+            ProcessingJob.session_id == session_id,
+            ProcessingJob.status.in_(ACTIVE_JOB_STATUSES)
+        ).order_by(ProcessingJob.id.desc()).first()
+
+    def cancel(self, job_id):
+        """Cancel a job: queued jobs stop immediately, running jobs at their next progress check"""
+        try:
+            job = ProcessingJob.query.get(job_id)
+            if not job or job.status not in ACTIVE_JOB_STATUSES:
+                return job
+
+            db.session.execute(
+                update(ProcessingJob)
+                .where(ProcessingJob.id == job_id, ProcessingJob.status.in_(ACTIVE_JOB_STATUSES))
+                .values(cancel_requested=True),
+                execution_options={'synchronize_session': False}
+            )
+            cancelled = db.session.execute(
+                update(ProcessingJob)
+                .where(ProcessingJob.id == job_id, ProcessingJob.status == 'queued')
+                .values(status='cancelled', finished_at=datetime.utcnow()),
+                execution_options={'synchronize_session': False}
+            ).rowcount
+
+            if cancelled and job.session_id and job.job_type in SESSION_JOB_TYPES:
+                session = ProcessingSession.query.get(job.session_id)
+                if session:
+                    session.status = 'cancelled'
+                    session.error_message = 'Processing cancelled'
+            db.session.commit()
+            db.session.refresh(job)
+
+            logger.info(f"Cancel requested for job {job_id} (status: {job.status})")
+            return job
+
+        except Exception as e:
+            logger.error(f"Error cancelling job {job_id}: {str(e)}")
+            db.session.rollback()
+            raise
+
+    def start(self):
+        """Re-queue interrupted jobs and start the worker threads (once per process)"""
+        if self._workers:
+            return
+
+        with self._lock:
+            if self._workers:
+                return
+
+            with self.app.app_context():
+                try:
+                    self.requeue_interrupted_jobs()
+                except Exception as e:
+                    logger.error(f"Error re-queueing interrupted jobs: {str(e)}")
+                    db.session.rollback()
+
+            for index in range(self.max_workers):
+                worker_id = f"{self.worker_prefix}:{index}"
+                thread = threading.Thread(target=self._worker_loop, args=(worker_id,), name=f"job-worker-{index}")
+                thread.daemon = True  # Jobs are persisted, an interrupted job is re-queued on the next start
+                thread.start()
+                self._workers.append(thread)
+
+            logger.info(f"Job queue started with {self.max_workers} workers")
+
+    def stop(self, timeout=None):
+        """Ask the worker threads to exit after their current job"""
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._workers:
+            thread.join(timeout)
+
+    def requeue_interrupted_jobs(self):
+        """Put running jobs whose worker stopped sending heartbeats back on the queue"""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.stale_seconds)
+        interrupted_jobs = ProcessingJob.query.filter(
+            ProcessingJob.status == 'running',
+            func.coalesce(ProcessingJob.heartbeat_at, ProcessingJob.started_at) < cutoff
+        ).all()
+
+        for job in interrupted_jobs:
+            previous_worker = job.worker_id
+            owns_session = job.session_id and job.job_type in SESSION_JOB_TYPES
+            session = ProcessingSession.query.get(job.session_id) if owns_session else None
+            if job.cancel_requested:
+                job.status = 'cancelled'
+                job.finished_at = datetime.utcnow()
+                if session:
+                    session.status = 'cancelled'
+                    session.error_message = 'Processing cancelled'
+            elif (job.attempts or 0) >= self.max_attempts:
+                job.status = 'failed'
+                job.error_message = f"Interrupted {job.attempts} times, giving up"
+                job.finished_at = datetime.utcnow()
+                if session:
+                    session.status = 'error'
+                    session.error_message = job.error_message
+            else:
+                job.status = 'queued'
+                job.worker_id = None
+                if session:
+                    session.status = 'queued'
+            logger.warning(f"Job {job.id} for session {job.session_id} was interrupted on {previous_worker}, now {job.status}")
+
+        db.session.commit()
+        self._last_requeue_check = datetime.utcnow()
+        if interrupted_jobs:
+            self._wakeup.set()
+        return len(interrupted_jobs)
+
+    def _requeue_if_due(self):
+        """Check for interrupted jobs at most once per half stale period"""
+        now = datetime.utcnow()
+        if self._last_requeue_check and now - self._last_requeue_check < timedelta(seconds=self.stale_seconds / 2):
+            return
+        self._last_requeue_check = now
+        self.requeue_interrupted_jobs()
+
+    def _worker_loop(self, worker_id):
+        """Claim and run jobs until the queue is stopped"""
+        processor = None
+
+        while not self._stopping.is_set():
+            claimed = False
+            try:
+                with self.app.app_context():
+                    self._requeue_if_due()
+                    job_id = self._claim_next_job(worker_id)
+                    if job_id:
+                        claimed = True
+                        if processor is None:
+                            processor = DataProcessor()
+                        self._run_job(job_id, worker_id, processor)
+            except Exception as e:
+                logger.error(f"Job worker {worker_id} error: {str(e)}")
+
+            if not claimed:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def _lock_job_claims(self):
+        """Serialize job claims until the end of the transaction (PostgreSQL)
+
+        Under READ COMMITTED two claims could both see fewer running jobs than the limit.
+        SQLite needs no lock, it runs the conditional UPDATE with the database write-locked.
+        """
+        if db.engine.dialect.name == 'postgresql':
+            db.session.execute(select(func.pg_advisory_xact_lock(JOB_CLAIM_LOCK_ID)))
+
+    def _claim_next_job(self, worker_id):
+        """Atomically move the oldest queued job to running, respecting the concurrency limit
+
+        Queued jobs of a session that already has a running job wait for it to finish.
+        """
+        try:
+            running_jobs = select(func.count()).select_from(ProcessingJob).where(
+                ProcessingJob.status == 'running'
+            ).scalar_subquery()
+            running_job = aliased(ProcessingJob)
+            session_busy = exists().where(
+                running_job.session_id == ProcessingJob.session_id,
+                running_job.status == 'running'
+            )
+
+            # Retried when another process claimed the candidate first
+            for _ in range(self.max_workers):
+                self._lock_job_claims()
+                job_id = db.session.execute(
+                    select(ProcessingJob.id).where(ProcessingJob.status == 'queued', ~session_busy).order_by(
+                        ProcessingJob.created_at, ProcessingJob.id
+                    ).limit(1).with_for_update(skip_locked=True)
+                ).scalar()
+                if job_id is None:
+                    db.session.commit()
+                    return None
+
+                now = datetime.utcnow()
+                claimed = db.session.execute(
+                    update(ProcessingJob)
+                    .where(
+                        ProcessingJob.id == job_id,
+                        ProcessingJob.status == 'queued',
+                        running_jobs < self.max_concurrent_jobs,
+                        ~session_busy
+                    )
+                    .values(
+                        status='running',
+                        worker_id=worker_id,
+                        started_at=now,
+                        heartbeat_at=now,
+                        attempts=func.coalesce(ProcessingJob.attempts, 0) + 1
+                    ),
+                    execution_options={'synchronize_session': False}
+                ).rowcount
+                db.session.commit()
+
+                if claimed:
+                    logger.info(f"Worker {worker_id} claimed job {job_id}")
+                    return job_id
+
+            return None
+
+        except Exception as e:
+            logger.error(f"Error claiming job for worker {worker_id}: {str(e)}")
+            db.session.rollback()
+            return None
+
+    def _run_job(self, job_id, worker_id, processor):
+        """Run a claimed job with a heartbeat thread watching for cancellation"""
+        job = ProcessingJob.query.get(job_id)
+        job_type, session_id, payload = job.job_type, job.session_id, dict(job.payload or {})
+        # A job claimed again after an interruption continues from the session's checkpoints
+        resume = (job.attempts or 0) > 1
+
+        cancel_event = threading.Event()
+        lost_event = threading.Event()
+        stop_heartbeat = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat_loop,
+            args=(job_id, worker_id, cancel_event, lost_event, stop_heartbeat),
+            name=f"job-heartbeat-{job_id}"
+        )
+        heartbeat.daemon = True
+        heartbeat.start()
+
+        def progress_callback(stage):
+            if lost_event.is_set():
+                raise JobOwnershipLost(f"Job {job_id} was taken over during {stage}")
+            if cancel_event.is_set():
+                raise ProcessingCancelled(f"Job {job_id} cancelled during {stage}")
+
+        status = 'completed'
+        error_message = None
+        try:
+            handler = self.job_handlers.get(job_type)
+            if handler is None:
+                raise ValueError(f"Unknown job type: {job_type}")
+
+            logger.info(f"Running {job_type} job {job_id} for session {session_id} (attempt {job.attempts})")
+            handler(session_id, payload, processor, progress_callback, resume)
+
+        except JobOwnershipLost:
+            # The job was re-queued or given up on, its new state belongs to whoever changed it
+            status = 'cancelled'
+            db.session.rollback()
+            logger.warning(f"Job {job_id} for session {session_id} stopped on {worker_id}, it is no longer running here")
+        except ProcessingCancelled:
+            status = 'cancelled'
+            logger.info(f"Job {job_id} for session {session_id} cancelled")
+        except Exception as e:
+            status = 'failed'
+            error_message = str(e)
+            logger.error(f"Job {job_id} for session {session_id} failed: {error_message}")
+            db.session.rollback()
+            if job_type in SESSION_JOB_TYPES:
+                session = ProcessingSession.query.get(session_id) if session_id else None
+                if session and session.status != 'error':
+                    session.status = 'error'
+                    session.error_message = error_message
+                    db.session.commit()
+            elif session_id and ProcessingSession.query.get(session_id):
+                # The session's data is intact, only this follow-up job failed
+                db.session.add(ProcessingError(
+                    session_id=session_id,
+                    error_type=f'{job_type}_failed',
+                    error_message=f"Job {job_id} failed: {error_message}",
+                    record_data={'job_id': job_id, 'job_type': job_type, 'payload': payload}
+                ))
+                db.session.commit()
+        finally:
+            stop_heartbeat.set()
+            heartbeat.join()
+
+        self._finish_job(job_id, worker_id, status, error_message)
+
+    def _finish_job(self, job_id, worker_id, status, error_message=None):
+        """Record the outcome of a job unless another worker has taken it over"""
+        try:
+            db.session.execute(
+                update(ProcessingJob)
+                .where(ProcessingJob.id == job_id, ProcessingJob.worker_id == worker_id,
+                       ProcessingJob.status == 'running')
+                .values(status=status, error_message=error_message, finished_at=datetime.utcnow()),
+                execution_options={'synchronize_session': False}
+            )
+            db.session.commit()
+            logger.info(f"Job {job_id} finished with status {status}")
+
+        except Exception as e:
+            logger.error(f"Error finishing job {job_id}: {str(e)}")
+            db.session.rollback()
+
+    def _heartbeat_loop(self, job_id, worker_id, cancel_event, lost_event, stop_event):
+        """Periodically refresh the job heartbeat, picking up cancel requests and lost ownership"""
+        jobs = ProcessingJob.__table__
+
+        with self.app.app_context():
+            while not stop_event.wait(self.heartbeat_interval):
+                try:
+                    with db.engine.begin() as connection:
+                        owned = connection.execute(
+                            update(jobs)
+                            .where(jobs.c.id == job_id, jobs.c.worker_id == worker_id, jobs.c.status == 'running')
+                            .values(heartbeat_at=datetime.utcnow())
+                        ).rowcount
+                        cancel_requested = connection.execute(
+                            select(jobs.c.cancel_requested).where(jobs.c.id == job_id)
+                        ).scalar()
+
+                    if not owned:
+                        # A late heartbeat let the job be re-queued, stop before the next owner's run collides
+                        logger.warning(f"Job {job_id} is no longer running on {worker_id}, stopping it")
+                        lost_event.set()
+                        return
+                    if cancel_requested:
+                        cancel_event.set()
+
+                except Exception as e:
+                    logger.warning(f"Heartbeat failed for job {job_id}: {str(e)}")
+
+    def _reset_session(self, session_id):
+        """Clear results left behind by an earlier or interrupted run of a session"""
+        EmailRecord.query.filter_by(session_id=session_id).delete()
+        ProcessingError.query.filter_by(session_id=session_id).delete()
+
+        session = ProcessingSession.query.get(session_id)
+        if not session:
+            raise ValueError(f"Session {session_id} not found")
+
+        session.processed_records = 0
+        session.error_message = None
+        session.current_chunk = 0
+        session.total_chunks = 0
+        session.exclusion_applied = False
+        session.whitelist_applied = False
+        session.rules_applied = False
+        session.ml_applied = False
+        db.session.commit()
+
+    def _run_process_csv(self, session_id, payload, processor, progress_callback, resume=False):
+        """Process a freshly uploaded CSV file"""
+        if not resume:
+            self._reset_session(session_id)
+        processor.process_csv(session_id, payload['file_path'], progress_callback=progress_callback, resume=resume)
+
+    def _run_reprocess_session(self, session_id, payload, processor, progress_callback, resume=False):
+        """Re-process a session's original CSV with the current rules, whitelist and ML keywords"""
+        active_rules = Rule.query.filter_by(is_active=True).all()
+        logger.info(f"Found {len(active_rules)} active rules for re-processing")
+        for rule in active_rules:
+            logger.info(f"Rule: {rule.name} (Type: {rule.rule_type}, Conditions: {rule.conditions})")
+
+        if not resume:
+            self._reset_session(session_id)
+        processor.process_csv(session_id, payload['file_path'], progress_callback=progress_callback, resume=resume)
+
+    def _run_reapply_whitelist(self, session_id, payload, processor, progress_callback, resume=False):
+        """Re-apply whitelist changes to the affected records of a processed session"""
+        # Re-applying is idempotent, a resumed job simply runs again
+        processor.reapply_whitelist(session_id, payload['domains'], progress_callback=progress_callback)
+
+    def _run_retrain_models(self, session_id, payload, processor, progress_callback, resume=False):
+        """Train an anomaly model on the recent sessions and make it the active version"""
+        # The active model only changes once the new version is fully written, a resumed job trains again
+        processor.ml_engine.train_anomaly_model(progress_callback=progress_callback)
@@ -38,10 +38,28 @@ def migrate_database():
             cursor.execute('ALTER TABLE processing_sessions ADD COLUMN total_chunks INTEGER DEFAULT 0')
             print("✓ Added total_chunks column")
         
+        # Attachment keyword timestamps version the cached keyword index
+        cursor.execute("PRAGMA table_info(attachment_keywords)")
+        keyword_columns = [column[1] for column in cursor.fetchall()]
+        
+        for column in ('created_at', 'updated_at'):
+            if keyword_columns and column not in keyword_columns:
+                cursor.execute(f'ALTER TABLE attachment_keywords ADD COLUMN {column} DATETIME')
+                print(f"✓ Added attachment_keywords.{column} column")
+        
         # Commit changes
         conn.commit()
         conn.close()
         
+        # Create new tables and backfill the cross-session domain statistics
+        with app.app_context():
+            db.create_all()
+            from models import DomainStats
+            if DomainStats.query.first() is None:
+                from domain_manager import DomainManager
+                sessions = DomainManager().rebuild_domain_stats()
+                print(f"✓ Built domain statistics from {sessions} sessions")
+        
         print("✓ Database migration completed successfully")
         
     except Exception as e:
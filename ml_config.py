@@ -50,6 +50,38 @@ class MLRiskConfig:
         'ymail.com', 'mail.com', 'protonmail.com'
     ]
     
+    # Free email providers each analysis flags as public, matched with their subdomains
+    PUBLIC_DOMAIN_LISTS = {
+        # ML features and risk scores; domains of this list are in the 'public' category
+        'ml_scoring': ['gmail.com', 'yahoo.com', 'hotmail.com', 'outlook.com', 'aol.com', 'icloud.com'],
+        'ml_explanations': ['gmail.com', 'yahoo.com', 'hotmail.com', 'outlook.com'],
+        'advanced_analysis': ['gmail.com', 'yahoo.com', 'hotmail.com', 'outlook.com'],
+        'basic_analysis': ['gmail.com', 'yahoo.com', 'hotmail.com'],
+        # Whitelist recommendations
+        'free_email': [
+            'gmail.com', 'yahoo.com', 'hotmail.com', 'outlook.com', 'aol.com',
+            'icloud.com', 'live.com', 'msn.com', 'ymail.com', 'protonmail.com',
+            'mail.com', 'zoho.com', 'gmx.com', 'tutanota.com', 'fastmail.com',
+            'hushmail.com', 'rocketmail.com', 'rediffmail.com', 'inbox.com'
+        ]
+    }
+    
+    # Disposable email services, matched anywhere in the domain
+    DISPOSABLE_DOMAIN_KEYWORDS = [
+        'tempmail', 'guerrillamail', '10minutemail', 'mailinator',
+        'throwaway', 'temp-mail', 'discard.email'
+    ]
+    
+    # Top-level domains commonly used for abuse
+    SUSPICIOUS_TLDS = ['tk', 'ml', 'ga', 'cf']
+    
+    # Organization's own domains (not external), matched with their subdomains
+    INTERNAL_DOMAINS = ['company.com', 'corp.com']
+    INTERNAL_DOMAIN_KEYWORDS = ['internal']
+    
+    # Words marking an otherwise unknown domain as corporate
+    CORPORATE_DOMAIN_KEYWORDS = ['company', 'corp', 'enterprise', 'business']
+    
     # Time-based Risk Patterns
     RISKY_TIME_PATTERNS = [
         'weekend', 'saturday', 'sunday',
@@ -102,6 +134,10 @@ class MLRiskConfig:
                 'pattern_score': cls.PATTERN_SCORE
             },
             'public_domains': cls.PUBLIC_DOMAINS,
+            'public_domain_lists': cls.PUBLIC_DOMAIN_LISTS,
+            'disposable_domain_keywords': cls.DISPOSABLE_DOMAIN_KEYWORDS,
+            'suspicious_tlds': cls.SUSPICIOUS_TLDS,
+            'internal_domains': cls.INTERNAL_DOMAINS,
             'time_patterns': cls.RISKY_TIME_PATTERNS,
             'justification_terms': cls.SUSPICIOUS_JUSTIFICATION_TERMS,
             'wordlist_categories': cls.WORDLIST_CATEGORIES,
@@ -2,17 +2,87 @@ import numpy as np
 import pandas as pd
 import json
 import logging
+import re
+from collections import Counter
 from datetime import datetime
-from sklearn.ensemble import IsolationForest
 from sklearn.cluster import DBSCAN
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.preprocessing import StandardScaler
-from models import EmailRecord, AttachmentKeyword
+from sqlalchemy.orm import load_only
+from models import EmailRecord, ProcessingSession
+from attachment_keywords import get_attachment_keyword_index
+from domain_classifier import refresh_domain_classifier, get_domain_classifier
+from model_registry import get_model_registry, fit_anomaly_model
+from parallel_scoring import get_scoring_executor
+from bulk_updates import bulk_update_by_id
 from performance_config import config
 from app import db
 
 logger = logging.getLogger(__name__)
 
+LEAVER_VALUES = ['yes', 'true', '1']
+
+# Scoring patterns, each compiled into a single alternation
+AFTER_HOURS_PATTERN = re.compile('|'.join(map(re.escape, ['22:', '23:', '00:', '01:', '02:', '03:', '04:', '05:'])))
+SUSPICIOUS_JUSTIFICATION_PATTERN = re.compile('|'.join(map(re.escape, ['urgent', 'confidential', 'personal', 'mistake', 'wrong'])))
+
+# Weights of the anomaly score and the rule-based risk in the combined risk score
+SCORE_WEIGHTS = np.array([0.4, 0.6])
+
+# Columns of the feature matrix, in order
+FEATURE_NAMES = [
+    'subject_len', 'has_attachments', 'has_wordlist_match', 'is_suspicious_domain', 'is_public_domain',
+    'is_weekend', 'is_after_hours', 'is_leaver', 'attachment_risk', 'justification_len', 'has_justification'
+]
+
+class SessionSummary:
+    """Running totals over a session's scoring batches, from which the session insights are built"""
+
+    def __init__(self, risk_thresholds):
+        self.risk_thresholds = risk_thresholds
+        self.total = 0
+        self.anomalies = 0
+        self.risk_score_sum = 0.0
+        self.risk_distribution = Counter()
+        self.high_risk_cases = 0
+        self.high_risk_total = 0
+        self.high_risk_factors = Counter()
+        self.factors = Counter()
+        self.domain_counts = Counter()
+
+    def add(self, df, anomaly_scores, risk_scores):
+        """Add a scored batch"""
+        thresholds = self.risk_thresholds
+        self.total += len(df)
+        self.anomalies += int(np.count_nonzero(anomaly_scores > 0.5))
+        self.risk_score_sum += float(np.sum(risk_scores))
+        self.risk_distribution.update({
+            'critical': int(np.count_nonzero(risk_scores > thresholds['critical'])),
+            'high': int(np.count_nonzero((risk_scores > thresholds['high']) & (risk_scores <= thresholds['critical']))),
+            'medium': int(np.count_nonzero((risk_scores > thresholds['medium']) & (risk_scores <= thresholds['high']))),
+            'low': int(np.count_nonzero(risk_scores <= thresholds['medium']))
+        })
+        self.high_risk_cases += int(np.count_nonzero(risk_scores > thresholds['high']))
+
+        factors = {
+            'leaver': np.asarray(df['leaver'].str.lower().isin(LEAVER_VALUES)),
+            'disposable_domain': np.asarray(df['domain_category'] == 'disposable'),
+            'public_domain': np.asarray(df['domain_category'] == 'public'),
+            'attachments': np.asarray(df['attachments'] != ''),
+            'wordlist': np.asarray((df['wordlist_attachment'] != '') | (df['wordlist_subject'] != ''))
+        }
+        high_risk = risk_scores > 0.6
+        self.high_risk_total += int(np.count_nonzero(high_risk))
+        for name, values in factors.items():
+            self.factors[name] += int(np.count_nonzero(values))
+            self.high_risk_factors[name] += int(np.count_nonzero(values & high_risk))
+        for domain, count in df['recipients_email_domain'].value_counts(sort=False).items():
+            self.domain_counts[domain] += int(count)
+
+    def high_risk_rate(self, factor):
+        """Share of the records scoring above 0.6 that have a risk factor"""
+        return self.high_risk_factors[factor] / self.high_risk_total
+
 class MLEngine:
     """Machine learning engine for anomaly detection and risk scoring"""
 
@@ -21,9 +91,19 @@ class MLEngine:
         self.dbscan = None
         self.tfidf_vectorizer = TfidfVectorizer(max_features=config.tfidf_max_features, stop_words='english')
         self.scaler = StandardScaler()
+        self.model_registry = get_model_registry()
+        self.scoring_executor = get_scoring_executor()
         self.fast_mode = config.fast_mode
         logger.info(f"MLEngine initialized with fast_mode={self.fast_mode}")
 
+        # Record columns read by feature engineering, scoring and explanations
+        self.scoring_columns = [
+            EmailRecord.record_id, EmailRecord.sender, EmailRecord.subject, EmailRecord.attachments,
+            EmailRecord.recipients, EmailRecord.recipients_email_domain, EmailRecord.wordlist_attachment,
+            EmailRecord.wordlist_subject, EmailRecord.justification, EmailRecord.time, EmailRecord.leaver,
+            EmailRecord.department, EmailRecord.bunit
+        ]
+
         # Risk thresholds
         self.risk_thresholds = {
             'critical': 0.8,
@@ -32,53 +112,63 @@ class MLEngine:
             'low': 0.0
         }
 
-    def analyze_session(self, session_id):
+    def analyze_session(self, session_id, progress_callback=None):
         """Perform comprehensive ML analysis on session data"""
         try:
             logger.info(f"Starting ML analysis for session {session_id}")
 
-            # Get non-excluded, non-whitelisted records
-            records = EmailRecord.query.filter(
-                EmailRecord.session_id == session_id,
-                EmailRecord.excluded_by_rule.is_(None),
-                db.or_(EmailRecord.whitelisted.is_(None), EmailRecord.whitelisted == False)
-            ).all()
+            record_ids, strata = self._load_record_strata(session_id)
 
-            if len(records) < 3:  # Reduced minimum for faster processing
-                logger.warning(f"Too few records ({len(records)}) for ML analysis")
-                return {'processing_stats': {'ml_records_analyzed': len(records)}}
+            if len(record_ids) < 3:  # Reduced minimum for faster processing
+                logger.warning(f"Too few records ({len(record_ids)}) for ML analysis")
+                return {'processing_stats': {'ml_records_analyzed': len(record_ids)}}
 
-            # Fast mode: limit records for processing speed
-            if self.fast_mode and len(records) > config.max_ml_records:
-                logger.info(f"Fast mode: Processing sample of {config.max_ml_records} records out of {len(records)}")
-                records = records[:config.max_ml_records]
+            # Anomaly detection, with the active registry model when one has been trained and otherwise
+            # a model fitted on a stratified sample of the session
+            model = self._get_anomaly_model()
+            if model is None:
+                training_ids = self._stratified_sample(record_ids, strata, config.max_ml_records)
+                if len(training_ids) < len(record_ids):
+                    logger.info(f"Training on a stratified sample of {len(training_ids)} records "
+                                f"out of {len(record_ids)}")
+                model = self._fit_session_model(self._sample_features(session_id, training_ids))
 
-            # Convert to DataFrame for analysis
-            df = self._records_to_dataframe(records)
+            # Score every record in batches, sharding large batches across the scoring pool
+            summary = SessionSummary(self.risk_thresholds)
+            try:
+                for records in self._iter_record_batches(session_id):
+                    if progress_callback:
+                        progress_callback('ml')
 
-            # Feature engineering
-            features = self._engineer_features(df)
+                    # Convert to DataFrame for analysis
+                    df = self._prepare_dataframe(records)
 
-            # Anomaly detection
-            anomaly_scores = self._detect_anomalies(features)
+                    # Feature engineering
+                    features = self._engineer_features(df)
+                    anomaly_scores = self.scoring_executor.score(model, features) if model else np.zeros(len(features))
 
-            # Risk scoring
-            risk_scores = self._calculate_risk_scores(df, anomaly_scores)
+                    # Risk scoring
+                    risk_scores = self._calculate_risk_scores(df, anomaly_scores)
 
-            # Update records with ML results
-            self._update_records_with_ml_results(records, anomaly_scores, risk_scores)
+                    # Update records with ML results
+                    self._update_records_with_ml_results(records, df, anomaly_scores, risk_scores)
+                    summary.add(df, anomaly_scores, risk_scores)
+            finally:
+                if model:
+                    self.scoring_executor.release(model)
 
             # Generate analysis insights
-            insights = self._generate_insights(df, anomaly_scores, risk_scores)
+            insights = self._generate_insights(summary)
 
             logger.info(f"ML analysis completed for session {session_id}")
 
             return {
                 'processing_stats': {
-                    'ml_records_analyzed': len(records),
-                    'anomalies_detected': sum(1 for score in anomaly_scores if score > 0.5),
-                    'critical_cases': sum(1 for score in risk_scores if score > self.risk_thresholds['critical']),
-                    'high_risk_cases': sum(1 for score in risk_scores if score > self.risk_thresholds['high'])
+                    'ml_records_analyzed': summary.total,
+                    'anomalies_detected': summary.anomalies,
+                    'critical_cases': summary.risk_distribution['critical'],
+                    'high_risk_cases': summary.high_risk_cases,
+                    'anomaly_model': model.version if model else None
                 },
                 'insights': insights
             }
@@ -87,6 +177,137 @@ class MLEngine:
             logger.error(f"Error in ML analysis for session {session_id}: {str(e)}")
             raise
 
+    def analyze_records(self, session_id, record_filters, progress_callback=None):
+        """Score only the session's records matching record_filters, keeping the scores of the others
+
+        Returns None when the session wasn't scored with the active registry model, since the other
+        records' scores then depend on a model fitted to the session and it must be analyzed whole.
+        """
+        try:
+            model = self._get_anomaly_model()
+            session = ProcessingSession.query.get(session_id)
+            scored_with = (session.processing_stats or {}).get('anomaly_model') if session else None
+            if model is None or model.version != scored_with:
+                return None
+
+            logger.info(f"Scoring affected records of session {session_id} with anomaly model {model.version}")
+            try:
+                for records in self._iter_record_batches(session_id, record_filters=record_filters):
+                    if progress_callback:
+                        progress_callback('ml')
+
+                    df = self._prepare_dataframe(records)
+                    anomaly_scores = self.scoring_executor.score(model, self._engineer_features(df))
+                    risk_scores = self._calculate_risk_scores(df, anomaly_scores)
+                    self._update_records_with_ml_results(records, df, anomaly_scores, risk_scores)
+            finally:
+                self.scoring_executor.release(model)
+
+            # Registry scores don't depend on the other records, so the stored ones are still current
+            total, anomalies, critical, high_risk = db.session.query(
+                db.func.count(EmailRecord.id),
+                db.func.count(db.case((EmailRecord.ml_anomaly_score > 0.5, 1))),
+                db.func.count(db.case((EmailRecord.ml_risk_score > self.risk_thresholds['critical'], 1))),
+                db.func.count(db.case((EmailRecord.ml_risk_score > self.risk_thresholds['high'], 1)))
+            ).filter(*self._scoring_filters(session_id)).one()
+
+            return {
+                'processing_stats': {
+                    'ml_records_analyzed': total,
+                    'anomalies_detected': anomalies,
+                    'critical_cases': critical,
+                    'high_risk_cases': high_risk,
+                    'anomaly_model': model.version
+                }
+            }
+
+        except Exception as e:
+            logger.error(f"Error scoring records of session {session_id}: {str(e)}")
+            raise
+
+    def _scoring_filters(self, session_id):
+        """Filters selecting a session's non-excluded, non-whitelisted records"""
+        return (
+            EmailRecord.session_id == session_id,
+            EmailRecord.excluded_by_rule.is_(None),
+            db.or_(EmailRecord.whitelisted.is_(None), EmailRecord.whitelisted == False)
+        )
+
+    def _scoring_query(self, session_id):
+        """Non-excluded, non-whitelisted records of a session, loading only the columns scoring reads"""
+        return EmailRecord.query.filter(*self._scoring_filters(session_id)).options(load_only(*self.scoring_columns))
+
+    def _iter_record_batches(self, session_id, record_ids=None, record_filters=()):
+        """Scoring records in id order, optionally only those matching record_filters, in batches of ml_batch_size"""
+        query = self._scoring_query(session_id).filter(*record_filters).order_by(EmailRecord.id)
+        batch_size = config.ml_batch_size
+
+        if record_ids is not None:
+            for start in range(0, len(record_ids), batch_size):
+                batch_ids = [int(record_id) for record_id in record_ids[start:start + batch_size]]
+                yield query.filter(EmailRecord.id.in_(batch_ids)).all()
+            return
+
+        # Keyset pagination, so each batch is an index range scan however deep into the session
+        last_id = 0
+        while True:
+            records = query.filter(EmailRecord.id > last_id).limit(batch_size).all()
+            if not records:
+                return
+            yield records
+            last_id = records[-1].id
+
+    def _load_record_strata(self, session_id):
+        """Ids of the scoring records and the stratum of each: domain category, leaver and attachment status"""
+        has_attachments = db.func.length(db.func.coalesce(EmailRecord.attachments, '')) > 0
+        rows = db.session.query(
+            EmailRecord.id, EmailRecord.recipients_email_domain, EmailRecord.leaver, has_attachments
+        ).filter(*self._scoring_filters(session_id)).order_by(EmailRecord.id).yield_per(config.ml_batch_size)
+
+        domain_classifier = refresh_domain_classifier()
+        stratum_codes = {}
+        record_ids = []
+        strata = []
+        for record_id, domain, leaver, attachments in rows:
+            key = (domain_classifier.category(domain or ''), (leaver or '').lower() in LEAVER_VALUES, bool(attachments))
+            record_ids.append(record_id)
+            strata.append(stratum_codes.setdefault(key, len(stratum_codes)))
+        return np.array(record_ids, dtype=np.int64), np.array(strata, dtype=np.int64)
+
+    def _stratified_sample(self, record_ids, strata, size):
+        """At most size record ids, drawn from each stratum in proportion to its share of the records
+        and at least one from each stratum when size allows"""
+        if len(record_ids) <= size:
+            return record_ids
+
+        codes, counts = np.unique(strata, return_counts=True)
+        # One record of each stratum is set aside, the rest of the sample is shared out in proportion
+        reserved = 1 if size >= len(codes) else 0
+        spare = size - reserved * len(codes)
+        quotas = reserved + (counts - reserved) * spare / (len(record_ids) - reserved * len(codes))
+        allocation = np.floor(quotas).astype(int)
+        # The rows left after rounding down go to the strata with the largest remainders
+        remaining = size - int(allocation.sum())
+        allocation[np.argsort(allocation - quotas, kind='stable')[:remaining]] += 1
+
+        rng = np.random.default_rng(42)
+        sample = [rng.choice(record_ids[strata == code], count, replace=False)
+                  for code, count in zip(codes, allocation) if count]
+        return np.sort(np.concatenate(sample))
+
+    def _sample_features(self, session_id, record_ids):
+        """Feature matrix of the given records, in id order"""
+        batches = [self._engineer_features(self._prepare_dataframe(records))
+                   for records in self._iter_record_batches(session_id, record_ids)]
+        return np.vstack(batches) if batches else np.empty((0, len(FEATURE_NAMES)))
+
+    def _prepare_dataframe(self, records):
+        """DataFrame of records with each distinct recipient domain and attachment list classified once"""
+        df = self._records_to_dataframe(records)
+        df['domain_category'] = refresh_domain_classifier().classify_values(df['recipients_email_domain'])
+        df['attachment_risk'] = self._calculate_attachment_risks(df['attachments'])
+        return df
+
     def _records_to_dataframe(self, records):
         """Convert EmailRecord objects to pandas DataFrame"""
         data = []
@@ -111,66 +332,49 @@ class MLEngine:
 
     def _engineer_features(self, df):
         """Engineer features for ML analysis"""
-        features = []
-
-        for _, row in df.iterrows():
-            feature_vector = []
-
-            # Text-based features
-            subject_len = len(row['subject'])
-            has_attachments = 1 if row['attachments'] else 0
-            has_wordlist_match = 1 if (row['wordlist_attachment'] or row['wordlist_subject']) else 0
-
-            # Domain features - optimized for all-external email scenario
-            domain = row['recipients_email_domain'].lower()
-            # Since ALL emails are external, focus on domain risk categories
-            # High-risk: Temporary/disposable email services
-            is_suspicious_domain = 1 if any(sus in domain for sus in ['tempmail', 'guerrillamail', '10minutemail', 'mailinator', 'throwaway', 'temp-mail', 'discard.email']) else 0
-            # Medium-risk: Free public email providers (less risky since common)
-            is_public_domain = 1 if any(pub in domain for pub in ['gmail.com', 'yahoo.com', 'hotmail.com', 'outlook.com', 'aol.com', 'icloud.com']) else 0
-            # Legitimate business domains get lowest risk (everything else)
-
-            # Temporal features (if time parsing is possible)
-            is_weekend = 0
-            is_after_hours = 0
-            try:
-                # Basic time analysis - can be enhanced
-                if 'weekend' in row['time'].lower():
-                    is_weekend = 1
-                if any(hour in row['time'] for hour in ['22:', '23:', '00:', '01:', '02:', '03:', '04:', '05:']):
-                    is_after_hours = 1
-            except:
-                pass
-
-            # Leaver status
-            is_leaver = 1 if row['leaver'].lower() in ['yes', 'true', '1'] else 0
-
-            # Attachment risk features
-            attachment_risk = self._calculate_attachment_risk(row['attachments'])
-
-            # Justification sentiment (basic)
-            justification_len = len(row['justification'])
-            has_justification = 1 if justification_len > 0 else 0
-
-            feature_vector = [
-                subject_len,
-                has_attachments,
-                has_wordlist_match,
-                is_suspicious_domain,
-                is_public_domain,
-                is_weekend,
-                is_after_hours,
-                is_leaver,
-                attachment_risk,
-                justification_len,
-                has_justification
-            ]
-
-            features.append(feature_vector)
-
-        return np.array(features)
-
-    def _calculate_attachment_risk(self, attachments):
+        # Text-based features
+        subject_len = df['subject'].str.len()
+        has_attachments = df['attachments'] != ''
+        has_wordlist_match = (df['wordlist_attachment'] != '') | (df['wordlist_subject'] != '')
+
+        # Domain features - optimized for all-external email scenario
+        # Since ALL emails are external, focus on domain risk categories
+        # High-risk: Temporary/disposable email services
+        is_suspicious_domain = df['domain_category'] == 'disposable'
+        # Medium-risk: Free public email providers (less risky since common)
+        is_public_domain = df['domain_category'] == 'public'
+        # Legitimate business domains get lowest risk (everything else)
+
+        # Temporal features - basic time analysis, can be enhanced
+        is_weekend = df['time'].str.lower().str.contains('weekend', regex=False)
+        is_after_hours = df['time'].str.contains(AFTER_HOURS_PATTERN)
+
+        # Leaver status
+        is_leaver = df['leaver'].str.lower().isin(LEAVER_VALUES)
+
+        # Justification sentiment (basic)
+        justification_len = df['justification'].str.len()
+        has_justification = justification_len > 0
+
+        # In FEATURE_NAMES order
+        columns = [
+            subject_len,
+            has_attachments,
+            has_wordlist_match,
+            is_suspicious_domain,
+            is_public_domain,
+            is_weekend,
+            is_after_hours,
+            is_leaver,
+            df['attachment_risk'],
+            justification_len,
+            has_justification
+        ]
+        if not len(df):
+            return np.empty((0, len(FEATURE_NAMES)))
+        return np.column_stack([np.asarray(column, dtype=float) for column in columns])
+
+    def _calculate_attachment_risk(self, attachments, keyword_index=None):
         """Calculate risk score for attachments"""
         if not attachments:
             return 0.0
@@ -196,127 +400,135 @@ class MLEngine:
             if pattern in attachments_lower:
                 risk_score += 0.2
 
-        # Get attachment keywords from database
-        keywords = AttachmentKeyword.query.filter_by(is_active=True).all()
-        for keyword in keywords:
-            if keyword.keyword.lower() in attachments_lower:
-                if keyword.category == 'Suspicious':
-                    risk_score += keyword.risk_score * 0.1
-                elif keyword.category == 'Personal':
-                    risk_score += keyword.risk_score * 0.05
+        # Attachment keywords from database
+        if keyword_index is None:
+            keyword_index = get_attachment_keyword_index()
+        for _, _, weight in keyword_index.matches(attachments_lower):
+            if weight:
+                risk_score += weight
 
         return min(risk_score, 1.0)  # Cap at 1.0
 
-    def _detect_anomalies(self, features):
-        """Detect anomalies using Isolation Forest"""
+    def _calculate_attachment_risks(self, attachments):
+        """Attachment risk of each record, scoring each distinct attachment list once"""
+        codes, uniques = pd.factorize(attachments)
+        keyword_index = get_attachment_keyword_index()
+        risks = np.array([self._calculate_attachment_risk(value, keyword_index) for value in uniques], dtype=float)
+        return risks[codes]
+
+    def _get_anomaly_model(self):
+        """Active registry model if it was trained on the current feature set"""
+        model = self.model_registry.load_active()
+        if model is None:
+            return None
+        if model.feature_count != len(FEATURE_NAMES):
+            logger.warning(f"Anomaly model {model.version} expects {model.feature_count} features, "
+                           f"got {len(FEATURE_NAMES)}; fitting a session model instead")
+            return None
+        return model
+
+    def train_anomaly_model(self, progress_callback=None):
+        """Train and activate a registry model on stratified samples of the most recent completed sessions"""
+        sessions = ProcessingSession.query.filter(
+            ProcessingSession.status == 'completed'
+        ).order_by(ProcessingSession.upload_time.desc()).limit(config.model_baseline_sessions).all()
+        if not sessions:
+            raise ValueError("No completed sessions to train an anomaly model on")
+
+        per_session_limit = max(1, config.model_training_max_records // len(sessions))
+        session_features = []
+        session_ids = []
+        for session in sessions:
+            if progress_callback:
+                progress_callback('model_training')
+            record_ids, strata = self._load_record_strata(session.id)
+            if not len(record_ids):
+                continue
+            sample_ids = self._stratified_sample(record_ids, strata, per_session_limit)
+            session_features.append(self._sample_features(session.id, sample_ids))
+            session_ids.append(session.id)
+
+        if not session_features:
+            raise ValueError("Baseline sessions have no records to train an anomaly model on")
+
+        features = np.vstack(session_features)
+        if progress_callback:
+            progress_callback('model_training')
+        return self.model_registry.train(features, {'sessions': session_ids})
+
+    def _fit_session_model(self, features):
+        """Fit an Isolation Forest on records of the session itself"""
         try:
             if len(features) < 10:
                 # Too few samples for meaningful anomaly detection
-                return np.zeros(len(features))
+                return None
 
-            # Normalize features
-            features_scaled = self.scaler.fit_transform(features)
-
-            # Train Isolation Forest (optimized for speed)
-            self.isolation_forest = IsolationForest(
-                contamination=0.1,  # Expect 10% anomalies
-                random_state=42,
-                n_estimators=config.ml_estimators,
-                n_jobs=1 if self.fast_mode else -1  # Single core in fast mode for stability
-            )
-
-            # Fit and predict
-            anomaly_labels = self.isolation_forest.fit_predict(features_scaled)
-            anomaly_scores = self.isolation_forest.decision_function(features_scaled)
-
-            # Convert to 0-1 scale (higher = more anomalous)
-            anomaly_scores_normalized = np.interp(anomaly_scores, 
-                                                (anomaly_scores.min(), anomaly_scores.max()), 
-                                                (0, 1))
-
-            # Invert so higher scores mean more anomalous
-            anomaly_scores_normalized = 1 - anomaly_scores_normalized
-
-            return anomaly_scores_normalized
+            model = fit_anomaly_model(features)
+            self.scaler, self.isolation_forest = model.scaler, model.forest
+            return model
 
         except Exception as e:
             logger.error(f"Error in anomaly detection: {str(e)}")
-            return np.zeros(len(features))
+            return None
 
     def _calculate_risk_scores(self, df, anomaly_scores):
         """Calculate comprehensive risk scores"""
-        risk_scores = []
-
-        for i, (_, row) in enumerate(df.iterrows()):
-            base_risk = 0.0
-
-            # Anomaly contribution (40% of score)
-            anomaly_contribution = anomaly_scores[i] * 0.4
-
-            # Rule-based risk factors (60% of score)
-            rule_risk = 0.0
-
-            # High-risk indicators
-            if row['leaver'].lower() in ['yes', 'true', '1']:
-                rule_risk += 0.3
-
-            # Domain risk assessment optimized for all-external emails
-            domain = row['recipients_email_domain'].lower()
-            # Suspicious/temporary domains are highest risk
-            if any(sus in domain for sus in ['tempmail', 'guerrillamail', '10minutemail', 'mailinator', 'throwaway', 'temp-mail', 'discard.email']):
-                rule_risk += 0.5  # High risk for disposable emails
-            # Public domains get minimal risk since they're common for legitimate external communication
-            elif any(pub in domain for pub in ['gmail.com', 'yahoo.com', 'hotmail.com', 'outlook.com', 'aol.com', 'icloud.com']):
-                rule_risk += 0.1  # Minimal risk for common public domains
-            # Business domains (everything else) get no domain-based risk penalty
-            # Focus shifts to other risk factors like attachments, keywords, leaver status
-
-            # Attachment risk
-            attachment_risk = self._calculate_attachment_risk(row['attachments'])
-            rule_risk += attachment_risk * 0.3
-
-            # Wordlist matches
-            if row['wordlist_attachment'] or row['wordlist_subject']:
-                rule_risk += 0.2
-
-            # Time-based risk (basic implementation)
-            if 'weekend' in row['time'].lower():
-                rule_risk += 0.1
-
-            # Justification analysis (basic sentiment)
-            justification = row['justification'].lower()
-            suspicious_justification_terms = ['urgent', 'confidential', 'personal', 'mistake', 'wrong']
-            if any(term in justification for term in suspicious_justification_terms):
-                rule_risk += 0.1
-
-            # Combine scores
-            total_risk = anomaly_contribution + (rule_risk * 0.6)
-            risk_scores.append(min(total_risk, 1.0))  # Cap at 1.0
-
-        return risk_scores
-
-    def _update_records_with_ml_results(self, records, anomaly_scores, risk_scores):
+        # Rule-based risk factors, added in a fixed order so scores don't depend on the evaluation path
+        rule_risk = np.zeros(len(df))
+
+        # High-risk indicators
+        rule_risk = np.where(df['leaver'].str.lower().isin(LEAVER_VALUES), rule_risk + 0.3, rule_risk)
+
+        # Domain risk assessment optimized for all-external emails
+        # Suspicious/temporary domains are highest risk, public domains get minimal risk since they're
+        # common for legitimate external communication, business domains get no domain-based penalty
+        rule_risk = np.select(
+            [df['domain_category'] == 'disposable', df['domain_category'] == 'public'],
+            [rule_risk + 0.5, rule_risk + 0.1],
+            rule_risk
+        )
+
+        # Attachment risk
+        rule_risk = rule_risk + np.asarray(df['attachment_risk'], dtype=float) * 0.3
+
+        # Wordlist matches
+        has_wordlist_match = (df['wordlist_attachment'] != '') | (df['wordlist_subject'] != '')
+        rule_risk = np.where(has_wordlist_match, rule_risk + 0.2, rule_risk)
+
+        # Time-based risk (basic implementation)
+        rule_risk = np.where(df['time'].str.lower().str.contains('weekend', regex=False), rule_risk + 0.1, rule_risk)
+
+        # Justification analysis (basic sentiment)
+        suspicious_justification = df['justification'].str.lower().str.contains(SUSPICIOUS_JUSTIFICATION_PATTERN)
+        rule_risk = np.where(suspicious_justification, rule_risk + 0.1, rule_risk)
+
+        # Combine scores: anomaly contribution (40%) and rule-based risk (60%)
+        total_risk = np.asarray(anomaly_scores, dtype=float) * SCORE_WEIGHTS[0] + rule_risk * SCORE_WEIGHTS[1]
+        return np.minimum(total_risk, 1.0)  # Cap at 1.0
+
+    def _assign_risk_levels(self, risk_scores):
+        """Risk level of each risk score"""
+        return np.select(
+            [risk_scores >= self.risk_thresholds['critical'],
+             risk_scores >= self.risk_thresholds['high'],
+             risk_scores >= self.risk_thresholds['medium']],
+            ['Critical', 'High', 'Medium'],
+            'Low'
+        )
+
+    def _update_records_with_ml_results(self, records, df, anomaly_scores, risk_scores):
         """Update database records with ML results"""
         try:
-            for i, record in enumerate(records):
-                record.ml_anomaly_score = float(anomaly_scores[i])
-                record.ml_risk_score = float(risk_scores[i])
-
-                # Assign risk level
-                risk_score = risk_scores[i]
-                if risk_score >= self.risk_thresholds['critical']:
-                    record.risk_level = 'Critical'
-                elif risk_score >= self.risk_thresholds['high']:
-                    record.risk_level = 'High'
-                elif risk_score >= self.risk_thresholds['medium']:
-                    record.risk_level = 'Medium'
-                else:
-                    record.risk_level = 'Low'
-
-                # Generate explanation
-                record.ml_explanation = self._generate_explanation(records[i], anomaly_scores[i], risk_scores[i])
-
-            db.session.commit()
+            risk_levels = self._assign_risk_levels(risk_scores).tolist()
+            explanations = self._generate_explanations(df, anomaly_scores)
+            anomaly_values = np.asarray(anomaly_scores, dtype=float).tolist()
+            risk_values = risk_scores.tolist()
+
+            bulk_update_by_id(EmailRecord, [
+                {'id': record.id, 'ml_anomaly_score': anomaly_values[i], 'ml_risk_score': risk_values[i],
+                 'risk_level': risk_levels[i], 'ml_explanation': explanations[i]}
+                for i, record in enumerate(records)
+            ])
             logger.info(f"Updated {len(records)} records with ML results")
 
         except Exception as e:
@@ -324,28 +536,43 @@ class MLEngine:
             db.session.rollback()
             raise
 
-    def _generate_explanation(self, record, anomaly_score, risk_score):
+    def _generate_explanations(self, df, anomaly_scores):
+        """Human-readable explanation of each record's ML scoring, built once per combination of factors"""
+        anomalous = np.asarray(anomaly_scores) > 0.7
+        is_leaver = np.asarray(df['leaver'].str.lower().isin(LEAVER_VALUES))
+        # Explanations name fewer free email providers than the scoring
+        explained_public = get_domain_classifier().public_values(df['recipients_email_domain'], 'ml_explanations')
+        domain_code = np.select([df['domain_category'] == 'disposable', explained_public], [1, 2], 0)
+        risky_attachments = np.asarray((df['attachments'] != '') & (df['attachment_risk'] > 0.5))
+        has_wordlist_match = np.asarray((df['wordlist_attachment'] != '') | (df['wordlist_subject'] != ''))
+
+        codes = (((anomalous * 2 + is_leaver) * 3 + domain_code) * 2 + risky_attachments) * 2 + has_wordlist_match
+        texts = {}
+        for code in np.unique(codes).tolist():
+            domain_category = {1: 'disposable', 2: 'public'}.get(code // 4 % 3)
+            texts[code] = self._generate_explanation(code // 24 % 2, code // 12 % 2, domain_category,
+                                                     code // 2 % 2, code % 2)
+        return [texts[code] for code in codes.tolist()]
+
+    def _generate_explanation(self, anomalous, is_leaver, domain_category, risky_attachments, has_wordlist_match):
         """Generate human-readable explanation for ML scoring"""
         explanations = []
 
-        if anomaly_score > 0.7:
+        if anomalous:
             explanations.append("Unusual communication pattern detected")
 
-        if record.leaver and record.leaver.lower() in ['yes', 'true', '1']:
+        if is_leaver:
             explanations.append("Sender is a leaver - high risk for data exfiltration")
 
-        domain = (record.recipients_email_domain or '').lower()
-        if any(sus in domain for sus in ['tempmail', 'guerrillamail', '10minutemail', 'mailinator', 'throwaway', 'temp-mail', 'discard.email']):
+        if domain_category == 'disposable':
             explanations.append("Email sent to suspicious/temporary domain")
-        elif any(pub in domain for pub in ['gmail.com', 'yahoo.com', 'hotmail.com', 'outlook.com']):
+        elif domain_category == 'public':
             explanations.append("Email sent to public domain (common for external communication)")
 
-        if record.attachments:
-            attachment_risk = self._calculate_attachment_risk(record.attachments)
-            if attachment_risk > 0.5:
-                explanations.append("High-risk attachments detected")
+        if risky_attachments:
+            explanations.append("High-risk attachments detected")
 
-        if record.wordlist_attachment or record.wordlist_subject:
+        if has_wordlist_match:
             explanations.append("Sensitive keywords detected")
 
         if not explanations:
@@ -353,40 +580,33 @@ class MLEngine:
 
         return "; ".join(explanations)
 
-    def _generate_insights(self, df, anomaly_scores, risk_scores):
+    def _generate_insights(self, summary):
         """Generate session-level insights"""
         insights = {
-            'total_analyzed': len(df),
-            'anomaly_rate': float(np.mean(anomaly_scores > 0.5)),
-            'average_risk_score': float(np.mean(risk_scores)),
+            'total_analyzed': summary.total,
+            'anomaly_rate': summary.anomalies / summary.total,
+            'average_risk_score': summary.risk_score_sum / summary.total,
             'risk_distribution': {
-                'critical': int(sum(1 for score in risk_scores if score > self.risk_thresholds['critical'])),
-                'high': int(sum(1 for score in risk_scores if score > self.risk_thresholds['high'] and score <= self.risk_thresholds['critical'])),
-                'medium': int(sum(1 for score in risk_scores if score > self.risk_thresholds['medium'] and score <= self.risk_thresholds['high'])),
-                'low': int(sum(1 for score in risk_scores if score <= self.risk_thresholds['medium']))
+                level: summary.risk_distribution[level] for level in ('critical', 'high', 'medium', 'low')
             },
-            'top_risk_factors': self._identify_top_risk_factors(df, risk_scores),
-            'recommendations': self._generate_recommendations(df, risk_scores)
+            'top_risk_factors': self._identify_top_risk_factors(summary),
+            'recommendations': self._generate_recommendations(summary)
         }
 
         return insights
 
-    def _identify_top_risk_factors(self, df, risk_scores):
+    def _identify_top_risk_factors(self, summary):
         """Identify top contributing risk factors"""
         risk_factors = []
 
         # Analyze high-risk cases
-        high_risk_indices = [i for i, score in enumerate(risk_scores) if score > 0.6]
-
-        if high_risk_indices:
-            high_risk_df = df.iloc[high_risk_indices]
-
+        if summary.high_risk_total:
             # Check common patterns optimized for all-external email scenario
-            leaver_rate = (high_risk_df['leaver'].str.lower().isin(['yes', 'true', '1'])).mean()
-            suspicious_domain_rate = high_risk_df['recipients_email_domain'].str.contains('tempmail|guerrillamail|10minutemail|mailinator|throwaway|temp-mail|discard', na=False).mean()
-            public_domain_rate = high_risk_df['recipients_email_domain'].str.contains('gmail|yahoo|hotmail|outlook', na=False).mean()
-            attachment_rate = (high_risk_df['attachments'] != '').mean()
-            wordlist_rate = ((high_risk_df['wordlist_attachment'] != '') | (high_risk_df['wordlist_subject'] != '')).mean()
+            leaver_rate = summary.high_risk_rate('leaver')
+            suspicious_domain_rate = summary.high_risk_rate('disposable_domain')
+            public_domain_rate = summary.high_risk_rate('public_domain')
+            attachment_rate = summary.high_risk_rate('attachments')
+            wordlist_rate = summary.high_risk_rate('wordlist')
 
             if leaver_rate > 0.2:
                 risk_factors.append(f"Leaver communications ({leaver_rate:.1%} of high-risk cases)")
@@ -401,37 +621,38 @@ class MLEngine:
 
         return risk_factors
 
-    def _generate_recommendations(self, df, risk_scores):
+    def _generate_recommendations(self, summary):
         """Generate actionable recommendations"""
         recommendations = []
 
-        critical_count = sum(1 for score in risk_scores if score > self.risk_thresholds['critical'])
+        critical_count = summary.risk_distribution['critical']
         if critical_count > 0:
             recommendations.append(f"Immediately review {critical_count} critical risk cases")
 
-        high_count = sum(1 for score in risk_scores if score > self.risk_thresholds['high'])
+        high_count = summary.high_risk_cases
         if high_count > 5:
             recommendations.append(f"Schedule review of {high_count} high-risk cases within 24 hours")
 
         # Domain-specific recommendations optimized for all-external email scenario
-        suspicious_domains = df[df['recipients_email_domain'].str.contains('tempmail|guerrillamail|10minutemail|mailinator|throwaway|temp-mail|discard', na=False)]
-        if len(suspicious_domains) > 0:
-            recommendations.append(f"Immediately review {len(suspicious_domains)} communications to suspicious/temporary domains")
+        suspicious_count = summary.factors['disposable_domain']
+        if suspicious_count > 0:
+            recommendations.append(f"Immediately review {suspicious_count} communications to suspicious/temporary domains")
         
         # Check for unusual domain concentration (might indicate data exfiltration)
-        domain_counts = df['recipients_email_domain'].value_counts()
-        if len(domain_counts) > 0 and domain_counts.iloc[0] > len(df) * 0.3:
-            recommendations.append(f"Investigate high concentration of emails to {domain_counts.index[0]} ({domain_counts.iloc[0]} emails)")
+        if summary.domain_counts:
+            top_domain, top_count = summary.domain_counts.most_common(1)[0]
+            if top_count > summary.total * 0.3:
+                recommendations.append(f"Investigate high concentration of emails to {top_domain} ({top_count} emails)")
         
         # Leaver-specific recommendations
-        leaver_emails = df[df['leaver'].str.lower().isin(['yes', 'true', '1'])]
-        if len(leaver_emails) > 0:
-            recommendations.append(f"Priority review of {len(leaver_emails)} communications from leavers")
+        leaver_count = summary.factors['leaver']
+        if leaver_count > 0:
+            recommendations.append(f"Priority review of {leaver_count} communications from leavers")
         
         # Attachment-based recommendations
-        attachment_emails = df[df['attachments'] != '']
-        if len(attachment_emails) > len(df) * 0.5:
-            recommendations.append(f"High attachment usage detected - review {len(attachment_emails)} emails with attachments")
+        attachment_count = summary.factors['attachments']
+        if attachment_count > summary.total * 0.5:
+            recommendations.append(f"High attachment usage detected - review {attachment_count} emails with attachments")
 
         return recommendations
 
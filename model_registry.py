@@ -0,0 +1,212 @@
+"""
+Anomaly model registry for Email Guardian
+Stores versioned StandardScaler and IsolationForest artifacts on disk with joblib. Models are
+trained on a baseline of historical sessions and every session is scored with the active
+version, so anomaly scores are comparable across sessions. A new version is written to a
+temporary file and activated by atomically replacing the active version pointer, so scoring
+never sees a partially written model.
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+from datetime import datetime
+import joblib
+import numpy as np
+from sklearn.ensemble import IsolationForest
+from sklearn.preprocessing import StandardScaler
+from performance_config import config
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_POINTER = 'active.json'
+
+
+def _atomic_write(path, write):
+    """Write a file next to its destination and move it into place in one step"""
+    directory = os.path.dirname(path)
+    handle, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    os.close(handle)
+    try:
+        write(temp_path)
+        os.replace(temp_path, path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def _write_json(data):
+    def write(path):
+        with open(path, 'w') as file:
+            json.dump(data, file, indent=2)
+    return write
+
+
+class AnomalyModel:
+    """Fitted scaler and forest with the range of their scores on the training baseline"""
+
+    def __init__(self, version, scaler, forest, score_range, metadata=None, path=None):
+        self.version = version
+        self.scaler = scaler
+        self.forest = forest
+        self.score_range = score_range
+        self.metadata = metadata or {}
+        # Artifact file the model was saved to or loaded from, if any
+        self.path = path
+
+    @property
+    def feature_count(self):
+        return self.scaler.n_features_in_
+
+    def score(self, features):
+        """Anomaly score of each feature row on a 0-1 scale, higher is more anomalous"""
+        scores = self.forest.decision_function(self.scaler.transform(features))
+        # Normalize with the training range rather than the session's own, so scores compare across sessions
+        return 1 - np.interp(scores, self.score_range, (0, 1))
+
+
+def save_model_artifact(model, path):
+    """Write a model to an uncompressed joblib file, so its arrays can be memory-mapped when loaded"""
+    artifact = {'scaler': model.scaler, 'forest': model.forest, 'score_range': model.score_range,
+                'metadata': model.metadata}
+    joblib.dump(artifact, path)
+
+
+def load_model_artifact(path, version=None, mmap_mode=None):
+    """Load a model written by save_model_artifact"""
+    artifact = joblib.load(path, mmap_mode=mmap_mode)
+    return AnomalyModel(version, artifact['scaler'], artifact['forest'], tuple(artifact['score_range']),
+                        artifact.get('metadata'), path)
+
+
+def fit_anomaly_model(features, version=None, metadata=None):
+    """Fit a scaler and forest on feature rows, keeping the range of their scores on those rows"""
+    scaler = StandardScaler()
+    features_scaled = scaler.fit_transform(features)
+    forest = IsolationForest(
+        contamination=0.1,  # Expect 10% anomalies
+        random_state=42,
+        n_estimators=config.ml_estimators,
+        n_jobs=1 if config.fast_mode else -1  # Single core in fast mode for stability
+    )
+    forest.fit(features_scaled)
+    training_scores = forest.decision_function(features_scaled)
+    score_range = (float(training_scores.min()), float(training_scores.max()))
+    return AnomalyModel(version, scaler, forest, score_range, metadata)
+
+
+class ModelRegistry:
+    """Versioned anomaly models in a directory with a pointer to the active version"""
+
+    def __init__(self, directory=None):
+        self.directory = directory or config.model_registry_dir
+        self._active = None
+        self._lock = threading.Lock()
+
+    def _model_path(self, version):
+        return os.path.join(self.directory, f"{version}.joblib")
+
+    def _metadata_path(self, version):
+        return os.path.join(self.directory, f"{version}.json")
+
+    def active_version(self):
+        """Version the active pointer refers to, None before the first model is trained"""
+        try:
+            with open(os.path.join(self.directory, ACTIVE_POINTER)) as file:
+                return json.load(file).get('version')
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f"Error reading active model version: {str(e)}")
+            return None
+
+    def load_active(self):
+        """Active model, loaded from disk only when the active version changed"""
+        version = self.active_version()
+        if version is None:
+            return None
+
+        with self._lock:
+            if self._active is None or self._active.version != version:
+                try:
+                    self._active = load_model_artifact(self._model_path(version), version)
+                except Exception as e:
+                    logger.error(f"Error loading anomaly model {version}: {str(e)}")
+                    return None
+                logger.info(f"Loaded anomaly model {version}")
+            return self._active
+
+    def train(self, features, metadata=None):
+        """Fit a scaler and forest on baseline features, save them as a new version and activate it"""
+        if len(features) < 10:
+            raise ValueError(f"Too few baseline records ({len(features)}) to train an anomaly model")
+
+        version = datetime.utcnow().strftime('%Y%m%d%H%M%S%f')
+        metadata = dict(metadata or {}, version=version, trained_at=datetime.utcnow().isoformat(),
+                        records=len(features), features=features.shape[1], estimators=config.ml_estimators)
+        model = fit_anomaly_model(features, version, metadata)
+        if model.score_range[0] == model.score_range[1]:
+            raise ValueError("Baseline records are identical, the anomaly model would score every record the same")
+
+        os.makedirs(self.directory, exist_ok=True)
+        _atomic_write(self._model_path(version), lambda path: save_model_artifact(model, path))
+        _atomic_write(self._metadata_path(version), _write_json(metadata))
+        self.activate(version)
+        self._prune()
+
+        logger.info(f"Trained anomaly model {version} on {len(features)} records")
+        return metadata
+
+    def activate(self, version):
+        """Point the registry at a stored version"""
+        if not os.path.exists(self._model_path(version)):
+            raise ValueError(f"Anomaly model {version} not found")
+        _atomic_write(os.path.join(self.directory, ACTIVE_POINTER), _write_json({'version': version}))
+        logger.info(f"Activated anomaly model {version}")
+
+    def list_versions(self):
+        """Metadata of the stored versions, newest first"""
+        if not os.path.isdir(self.directory):
+            return []
+
+        active_version = self.active_version()
+        versions = []
+        for name in sorted(os.listdir(self.directory), reverse=True):
+            if not name.endswith('.json') or name == ACTIVE_POINTER or name.startswith('.'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as file:
+                    metadata = json.load(file)
+            except Exception as e:
+                logger.error(f"Error reading anomaly model metadata {name}: {str(e)}")
+                continue
+            metadata['active'] = metadata.get('version') == active_version
+            versions.append(metadata)
+        return versions
+
+    def _prune(self):
+        """Delete all but the newest stored versions, never the active one"""
+        active_version = self.active_version()
+        for metadata in self.list_versions()[config.model_versions_kept:]:
+            version = metadata.get('version')
+            if not version or version == active_version:
+                continue
+            for path in (self._model_path(version), self._metadata_path(version)):
+                if os.path.exists(path):
+                    os.remove(path)
+            logger.info(f"Removed anomaly model {version}")
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_model_registry():
+    """Shared registry, so each process loads the active model once"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ModelRegistry()
+        return _registry
@@ -11,7 +11,7 @@ class ProcessingSession(db.Model):
     upload_time = db.Column(db.DateTime, default=datetime.utcnow)
     total_records = db.Column(db.Integer, default=0)
     processed_records = db.Column(db.Integer, default=0)
-    status = db.Column(db.String(50), default='uploaded')  # uploaded, processing, completed, error
+    status = db.Column(db.String(50), default='uploaded')  # uploaded, queued, processing, completed, error, cancelled
     error_message = db.Column(Text)
     processing_stats = db.Column(JSON)
     data_path = db.Column(db.String(500))
@@ -92,6 +92,44 @@ class Rule(db.Model):
     def __repr__(self):
         return f'<Rule {self.name}>'
 
+class RuleStats(db.Model):
+    __tablename__ = 'rule_stats'
+    __table_args__ = (db.UniqueConstraint('rule_id', 'session_id'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    rule_id = db.Column(db.Integer, nullable=False, index=True)
+    session_id = db.Column(db.String(36), nullable=False, index=True)  # Kept after the session is deleted
+    rule_type = db.Column(db.String(50))
+    
+    # Evaluation profile of the rule for one session
+    evaluations = db.Column(db.Integer, default=0)
+    matches = db.Column(db.Integer, default=0)
+    total_time = db.Column(db.Float, default=0.0)  # Seconds spent evaluating the rule
+    slowest_condition = db.Column(Text)
+    slowest_condition_time = db.Column(db.Float)  # Average seconds per evaluation of the slowest condition
+    condition_stats = db.Column(JSON)  # Sampled per-condition evaluations, passes and time
+    
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'rule_id': self.rule_id,
+            'session_id': self.session_id,
+            'rule_type': self.rule_type,
+            'evaluations': self.evaluations,
+            'matches': self.matches,
+            'hit_rate': self.matches / self.evaluations if self.evaluations else 0,
+            'total_time': self.total_time,
+            'avg_time': self.total_time / self.evaluations if self.evaluations else 0,
+            'slowest_condition': self.slowest_condition,
+            'slowest_condition_time': self.slowest_condition_time,
+            'condition_stats': self.condition_stats or [],
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+    
+    def __repr__(self):
+        return f'<RuleStats rule={self.rule_id} session={self.session_id}>'
+
 class WhitelistDomain(db.Model):
     __tablename__ = 'whitelist_domains'
     
@@ -106,6 +144,82 @@ class WhitelistDomain(db.Model):
     def __repr__(self):
         return f'<WhitelistDomain {self.domain}>'
 
+class DomainStats(db.Model):
+    __tablename__ = 'domain_stats'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    domain = db.Column(db.String(255), unique=True, nullable=False)
+    
+    # Rolling aggregates over every processed session, maintained incrementally
+    communication_count = db.Column(db.Integer, default=0)
+    session_count = db.Column(db.Integer, default=0)
+    sender_count = db.Column(db.Integer, default=0)  # Distinct senders across sessions
+    risk_score_sum = db.Column(db.Float, default=0.0)
+    risk_score_count = db.Column(db.Integer, default=0)
+    risk_score_max = db.Column(db.Float)
+    high_risk_count = db.Column(db.Integer, default=0)
+    attachment_count = db.Column(db.Integer, default=0)
+    business_mentions = db.Column(db.Integer, default=0)
+    first_seen = db.Column(db.DateTime)
+    last_seen = db.Column(db.DateTime)
+    
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    @property
+    def avg_risk_score(self):
+        return self.risk_score_sum / self.risk_score_count if self.risk_score_count else None
+    
+    def to_dict(self):
+        return {
+            'domain': self.domain,
+            'communication_count': self.communication_count,
+            'session_count': self.session_count,
+            'sender_count': self.sender_count,
+            'avg_risk_score': self.avg_risk_score,
+            'max_risk_score': self.risk_score_max,
+            'high_risk_count': self.high_risk_count,
+            'attachment_count': self.attachment_count,
+            'first_seen': self.first_seen.isoformat() if self.first_seen else None,
+            'last_seen': self.last_seen.isoformat() if self.last_seen else None
+        }
+    
+    def __repr__(self):
+        return f'<DomainStats {self.domain}>'
+
+class DomainSessionStats(db.Model):
+    __tablename__ = 'domain_session_stats'
+    __table_args__ = (db.UniqueConstraint('session_id', 'domain'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.String(36), nullable=False, index=True)
+    domain = db.Column(db.String(255), nullable=False, index=True)
+    
+    # One session's contribution to DomainStats, subtracted when the session is deleted or reprocessed
+    communication_count = db.Column(db.Integer, default=0)
+    risk_score_sum = db.Column(db.Float, default=0.0)
+    risk_score_count = db.Column(db.Integer, default=0)
+    risk_score_max = db.Column(db.Float)
+    high_risk_count = db.Column(db.Integer, default=0)
+    attachment_count = db.Column(db.Integer, default=0)
+    business_mentions = db.Column(db.Integer, default=0)
+    senders = db.Column(JSON)  # Distinct lower-cased senders
+    seen_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<DomainSessionStats {self.domain} session={self.session_id}>'
+
+class DomainSenderStats(db.Model):
+    __tablename__ = 'domain_sender_stats'
+    __table_args__ = (db.UniqueConstraint('domain', 'sender'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    domain = db.Column(db.String(255), nullable=False, index=True)
+    sender = db.Column(db.String(255), nullable=False)
+    session_count = db.Column(db.Integer, default=0)  # Sessions in which the sender wrote to the domain
+    
+    def __repr__(self):
+        return f'<DomainSenderStats {self.sender} -> {self.domain}>'
+
 class AttachmentKeyword(db.Model):
     __tablename__ = 'attachment_keywords'
     
@@ -114,6 +228,8 @@ class AttachmentKeyword(db.Model):
     category = db.Column(db.String(50), nullable=False)  # Business, Personal, Suspicious
     risk_score = db.Column(db.Integer, default=1)  # 1-10 scale
     is_active = db.Column(db.Boolean, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     def __repr__(self):
         return f'<AttachmentKeyword {self.keyword}>'
@@ -152,3 +268,40 @@ class ProcessingError(db.Model):
     
     def __repr__(self):
         return f'<ProcessingError {self.error_type}>'
+
+class ProcessingJob(db.Model):
+    __tablename__ = 'processing_jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.String(36), index=True)  # Kept after the session is deleted for job history
+    job_type = db.Column(db.String(50), nullable=False)  # process_csv, reprocess_session, reapply_whitelist, retrain_models
+    payload = db.Column(JSON)  # Job parameters, e.g. the uploaded file path
+    status = db.Column(db.String(20), default='queued', index=True)  # queued, running, completed, failed, cancelled
+    cancel_requested = db.Column(db.Boolean, default=False)
+    attempts = db.Column(db.Integer, default=0)
+    worker_id = db.Column(db.String(100))
+    error_message = db.Column(Text)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'session_id': self.session_id,
+            'job_type': self.job_type,
+            'status': self.status,
+            'cancel_requested': self.cancel_requested,
+            'attempts': self.attempts,
+            'worker_id': self.worker_id,
+            'error_message': self.error_message,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'heartbeat_at': self.heartbeat_at.isoformat() if self.heartbeat_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+    
+    def __repr__(self):
+        return f'<ProcessingJob {self.id} {self.job_type} {self.status}>'
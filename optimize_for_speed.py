@@ -15,7 +15,7 @@ def enable_speed_optimizations():
     speed_settings = {
         'EMAIL_GUARDIAN_FAST_MODE': 'true',
         'EMAIL_GUARDIAN_CHUNK_SIZE': '2000',          # Larger chunks for faster processing
-        'EMAIL_GUARDIAN_MAX_ML_RECORDS': '1000',      # Limit ML processing for speed
+        'EMAIL_GUARDIAN_MAX_ML_RECORDS': '1000',      # Limit ML training sample for speed
         'EMAIL_GUARDIAN_ML_ESTIMATORS': '25',         # Fewer estimators for speed
         'EMAIL_GUARDIAN_PROGRESS_INTERVAL': '1000',   # Less frequent UI updates
         'EMAIL_GUARDIAN_TFIDF_FEATURES': '200',       # Reduced feature set
@@ -0,0 +1,126 @@
+"""
+Parallel anomaly scoring for Email Guardian
+Splits a feature matrix into shards and scores them with a fitted anomaly model in a pool of
+worker processes. The model is shared through its joblib file, which the workers load
+memory-mapped so the forest's arrays are read from the page cache instead of being copied
+into every process. Scores are computed row by row, so the concatenated shards equal
+scoring the whole matrix in one process. Starting the pool costs every worker an import of
+the app, so scoring stays in process unless EMAIL_GUARDIAN_ML_SCORING_WORKERS is raised.
+"""
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from model_registry import save_model_artifact, load_model_artifact
+from performance_config import config
+
+logger = logging.getLogger(__name__)
+
+# Models loaded by a worker process, by the key they were shared under
+_worker_models = OrderedDict()
+_WORKER_MODEL_CACHE_SIZE = 4
+
+
+def _score_shard(path, key, features):
+    """Score one shard in a worker process"""
+    model = _worker_models.get(key)
+    if model is None:
+        model = load_model_artifact(path, mmap_mode='r')
+        # The pool provides the parallelism, each worker scores on one core
+        model.forest.n_jobs = 1
+        _worker_models[key] = model
+        while len(_worker_models) > _WORKER_MODEL_CACHE_SIZE:
+            _worker_models.popitem(last=False)
+    return model.score(features)
+
+
+class ScoringExecutor:
+    """Process pool scoring large feature matrices in shards"""
+
+    def __init__(self, workers=None, shard_size=None):
+        workers = config.ml_scoring_workers if workers is None else workers
+        self.workers = workers if workers > 0 else (os.cpu_count() or 1)
+        self.shard_size = shard_size or config.ml_scoring_shard_size
+        self._executor = None
+        self._lock = threading.Lock()
+        # Worker cache key of each temporary model file this executor wrote, by path
+        self._temporary_keys = {}
+
+    def shard_count(self, rows):
+        """Number of shards to split a matrix into, 1 when it should be scored in process"""
+        return max(1, min(self.workers, rows // self.shard_size))
+
+    def score(self, model, features):
+        """Anomaly score of each feature row, computed across the pool when the matrix is large enough"""
+        shards = self.shard_count(len(features))
+        if shards == 1:
+            return model.score(features)
+
+        try:
+            path, key = self._share_model(model)
+            executor = self._get_executor()
+            futures = [executor.submit(_score_shard, path, key, shard) for shard in np.array_split(features, shards)]
+            return np.concatenate([future.result() for future in futures])
+
+        except Exception as e:
+            logger.error(f"Error in parallel anomaly scoring, scoring in process: {str(e)}")
+            self.shutdown()
+            return model.score(features)
+
+    def release(self, model):
+        """Remove the file a model was shared through, if the executor wrote one"""
+        with self._lock:
+            path = model.path if model.path in self._temporary_keys else None
+            if path:
+                del self._temporary_keys[path]
+                model.path = None
+        if path and os.path.exists(path):
+            os.remove(path)
+
+    def shutdown(self):
+        """Stop the worker processes"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _share_model(self, model):
+        """Artifact path workers load the model from and the key they cache it under"""
+        with self._lock:
+            if model.path is None:
+                # Models fitted for a session have no artifact yet, the temporary one becomes their path
+                handle, path = tempfile.mkstemp(prefix='email-guardian-model-', suffix='.joblib')
+                os.close(handle)
+                save_model_artifact(model, path)
+                model.path = path
+                # Temporary file names may be reused once removed, so the key is unique to this file
+                self._temporary_keys[path] = uuid.uuid4().hex
+            # Registry artifacts are never rewritten, their path identifies the model
+            return model.path, self._temporary_keys.get(model.path, model.path)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # Spawn fresh interpreters so no database connections or locks are inherited
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+                logger.info(f"Started anomaly scoring pool with {self.workers} processes")
+            return self._executor
+
+
+_scoring_executor = None
+_scoring_executor_lock = threading.Lock()
+
+
+def get_scoring_executor():
+    """Shared executor, so each process starts one scoring pool"""
+    global _scoring_executor
+    with _scoring_executor_lock:
+        if _scoring_executor is None:
+            _scoring_executor = ScoringExecutor()
+        return _scoring_executor
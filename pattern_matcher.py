@@ -0,0 +1,106 @@
+"""
+Multi-pattern literal matching for Email Guardian
+Finds which of a fixed set of literals occur in a text with a single Aho-Corasick scan,
+so the cost of checking many `contains` conditions grows with text length rather than
+with the number of conditions. Uses pyahocorasick, a declared dependency. Rule evaluation
+only builds matchers with it, since the pure-Python automaton is slower than the
+per-condition substring scans it would replace.
+"""
+import logging
+from collections import deque
+
+try:
+    import ahocorasick
+except ImportError:  # Not installed, fall back to the pure-Python automaton
+    ahocorasick = None
+
+logger = logging.getLogger(__name__)
+
+
+class PatternMatcher:
+    """Aho-Corasick automaton over a set of literals"""
+
+    def __init__(self, literals):
+        self.literals = frozenset(literals)
+        # The empty literal occurs in every text
+        self._always = frozenset([''] if '' in self.literals else [])
+        words = sorted(literal for literal in self.literals if literal)
+
+        self._automaton = None
+        if not words:
+            self.find = lambda text: self._always
+        elif ahocorasick is not None:
+            self._automaton = ahocorasick.Automaton()
+            for word in words:
+                self._automaton.add_word(word, word)
+            self._automaton.make_automaton()
+            self.find = self._find_native
+        else:
+            self._build(words)
+            self.find = self._find_python
+
+    def _build(self, words):
+        """Build goto, failure and output tables"""
+        goto = [{}]
+        output = [()]
+        for word in words:
+            node = 0
+            for char in word:
+                next_node = goto[node].get(char)
+                if next_node is None:
+                    next_node = len(goto)
+                    goto[node][char] = next_node
+                    goto.append({})
+                    output.append(())
+                node = next_node
+            output[node] = output[node] + (word,)
+
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in goto[node].items():
+                queue.append(child)
+                state = fail[node]
+                while state and char not in goto[state]:
+                    state = fail[state]
+                fail[child] = goto[state].get(char, 0)
+                output[child] = output[child] + output[fail[child]]
+
+        self._goto = goto
+        self._fail = fail
+        self._output = output
+
+    def _find_native(self, text):
+        found = set(self._always)
+        for _, word in self._automaton.iter(text):
+            found.add(word)
+        return found
+
+    def _find_python(self, text):
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        found = set(self._always)
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node]:
+                found.update(output[node])
+        return found
+
+
+def build_pattern_matchers(literals_by_field, min_literals=1):
+    """PatternMatcher per field for fields with at least min_literals literals, none without pyahocorasick"""
+    if ahocorasick is None:
+        return {}
+
+    matchers = {}
+    for field, literals in literals_by_field.items():
+        if len(literals) >= min_literals:
+            matchers[field] = PatternMatcher(literals)
+    if matchers:
+        logger.info(f"Built pattern matchers for {len(matchers)} fields")
+    return matchers
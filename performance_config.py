@@ -4,6 +4,9 @@ Optimizes processing speed for different environments
 """
 import os
 
+# Relative directories are resolved against the project, not the working directory
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
 class PerformanceConfig:
     """Configuration class for performance optimization"""
     
@@ -13,7 +16,14 @@ class PerformanceConfig:
         
         # Processing parameters
         self.chunk_size = int(os.environ.get('EMAIL_GUARDIAN_CHUNK_SIZE', '1000' if self.fast_mode else '500'))
+        # Records the session anomaly model trains on; every record is scored in batches of ml_batch_size
         self.max_ml_records = int(os.environ.get('EMAIL_GUARDIAN_MAX_ML_RECORDS', '5000' if self.fast_mode else '15000'))
+        self.ml_batch_size = int(os.environ.get('EMAIL_GUARDIAN_ML_BATCH_SIZE', '5000'))
+        # Experimental: processes scoring shards of at least ml_scoring_shard_size records; 1 scores in process,
+        # 0 uses every core. No multi-core measurement shows a speedup yet, and each process re-imports the app
+        # and loads the model, so leave it at 1 unless benchmarks.py parallel-scoring shows a gain on the host
+        self.ml_scoring_workers = int(os.environ.get('EMAIL_GUARDIAN_ML_SCORING_WORKERS', '1'))
+        self.ml_scoring_shard_size = int(os.environ.get('EMAIL_GUARDIAN_ML_SCORING_SHARD_SIZE', '2000'))
         self.ml_estimators = int(os.environ.get('EMAIL_GUARDIAN_ML_ESTIMATORS', '50' if self.fast_mode else '100'))
         self.progress_update_interval = int(os.environ.get('EMAIL_GUARDIAN_PROGRESS_INTERVAL', '500' if self.fast_mode else '100'))
         
@@ -23,6 +33,55 @@ class PerformanceConfig:
         
         # Database settings
         self.batch_commit_size = int(os.environ.get('EMAIL_GUARDIAN_BATCH_SIZE', '100' if self.fast_mode else '50'))
+        
+        # Ingest settings
+        self.bulk_insert = os.environ.get('EMAIL_GUARDIAN_BULK_INSERT', 'true').lower() == 'true'
+        self.parser_engine = os.environ.get('EMAIL_GUARDIAN_PARSER_ENGINE', 'pandas').lower()  # pandas, pyarrow
+        self.fused_workflow = os.environ.get('EMAIL_GUARDIAN_FUSED_WORKFLOW', 'false').lower() == 'true'
+        
+        # Rule engine settings
+        self.rule_debug_logging = os.environ.get('EMAIL_GUARDIAN_RULE_DEBUG', 'false').lower() == 'true'
+        self.rule_evaluator = os.environ.get('EMAIL_GUARDIAN_RULE_EVALUATOR', 'row').lower()  # row, vectorized
+        self.rule_sql_pushdown = os.environ.get('EMAIL_GUARDIAN_RULE_SQL_PUSHDOWN', 'true').lower() == 'true'
+        # Fields with at least this many `contains` literals in a rule are matched in one pyahocorasick scan
+        self.pattern_matcher_min_literals = int(os.environ.get('EMAIL_GUARDIAN_PATTERN_MATCHER_MIN_LITERALS', '8'))
+        self.rule_profiling = os.environ.get('EMAIL_GUARDIAN_RULE_PROFILING', 'true').lower() == 'true'
+        self.rule_profile_sample_interval = int(os.environ.get('EMAIL_GUARDIAN_RULE_PROFILE_SAMPLE_INTERVAL', '100'))
+        self.rule_condition_ordering = os.environ.get('EMAIL_GUARDIAN_RULE_CONDITION_ORDERING', 'true').lower() == 'true'
+        self.regex_time_budget_ms = float(os.environ.get('EMAIL_GUARDIAN_REGEX_TIME_BUDGET_MS', '50'))  # 0 disables
+        self.regex_max_alternatives = int(os.environ.get('EMAIL_GUARDIAN_REGEX_MAX_ALTERNATIVES', '50'))
+        self.regex_max_length = int(os.environ.get('EMAIL_GUARDIAN_REGEX_MAX_LENGTH', '1000'))
+        self.rule_preview_sample_size = int(os.environ.get('EMAIL_GUARDIAN_RULE_PREVIEW_SAMPLE_SIZE', '100000'))
+        # Larger sample sizes requested for a preview are capped, since the snapshot is held in memory
+        self.rule_preview_max_sample_size = int(os.environ.get('EMAIL_GUARDIAN_RULE_PREVIEW_MAX_SAMPLE_SIZE', '500000'))
+        self.rule_preview_cache_size = int(os.environ.get('EMAIL_GUARDIAN_RULE_PREVIEW_CACHE_SIZE', '4'))
+        self.rule_preview_cache_ttl = int(os.environ.get('EMAIL_GUARDIAN_RULE_PREVIEW_CACHE_TTL', '300'))
+        
+        # Whitelist settings
+        # suffix: exact domain or subdomain; legacy: two-way substring matching of earlier versions
+        self.whitelist_match_mode = os.environ.get('EMAIL_GUARDIAN_WHITELIST_MATCH_MODE', 'suffix').lower()
+        
+        # Domain classification settings
+        self.domain_classifier_cache_size = int(os.environ.get('EMAIL_GUARDIAN_DOMAIN_CLASSIFIER_CACHE_SIZE', '100000'))
+        
+        # Session data, checkpoints and models; shared by the web server and every worker
+        self.data_dir = os.path.join(PROJECT_DIR, os.environ.get('EMAIL_GUARDIAN_DATA_DIR', 'data'))
+        
+        # Anomaly model registry settings
+        model_dir = os.environ.get('EMAIL_GUARDIAN_MODEL_DIR')
+        self.model_registry_dir = os.path.join(PROJECT_DIR, model_dir) if model_dir else os.path.join(self.data_dir, 'ml_models')
+        self.model_baseline_sessions = int(os.environ.get('EMAIL_GUARDIAN_MODEL_BASELINE_SESSIONS', '10'))
+        self.model_training_max_records = int(os.environ.get('EMAIL_GUARDIAN_MODEL_TRAINING_MAX_RECORDS', '50000'))
+        self.model_versions_kept = int(os.environ.get('EMAIL_GUARDIAN_MODEL_VERSIONS_KEPT', '5'))
+        
+        # Background job queue settings
+        self.max_concurrent_jobs = int(os.environ.get('EMAIL_GUARDIAN_MAX_CONCURRENT_JOBS', '2'))
+        self.job_poll_interval = float(os.environ.get('EMAIL_GUARDIAN_JOB_POLL_INTERVAL', '2'))
+        self.job_heartbeat_interval = float(os.environ.get('EMAIL_GUARDIAN_JOB_HEARTBEAT_INTERVAL', '10'))
+        self.job_stale_seconds = int(os.environ.get('EMAIL_GUARDIAN_JOB_STALE_SECONDS', '120'))
+        self.job_max_attempts = int(os.environ.get('EMAIL_GUARDIAN_JOB_MAX_ATTEMPTS', '3'))
+        # Set to false when jobs are run by separate worker processes (python worker.py)
+        self.in_process_workers = os.environ.get('EMAIL_GUARDIAN_IN_PROCESS_WORKERS', 'true').lower() == 'true'
     
     def get_config_summary(self):
         """Return configuration summary for logging"""
@@ -30,11 +89,44 @@ class PerformanceConfig:
             'fast_mode': self.fast_mode,
             'chunk_size': self.chunk_size,
             'max_ml_records': self.max_ml_records,
+            'ml_batch_size': self.ml_batch_size,
+            'ml_scoring_workers': self.ml_scoring_workers,
+            'ml_scoring_shard_size': self.ml_scoring_shard_size,
             'ml_estimators': self.ml_estimators,
             'progress_update_interval': self.progress_update_interval,
             'tfidf_max_features': self.tfidf_max_features,
             'skip_advanced_analysis': self.skip_advanced_analysis,
-            'batch_commit_size': self.batch_commit_size
+            'batch_commit_size': self.batch_commit_size,
+            'bulk_insert': self.bulk_insert,
+            'parser_engine': self.parser_engine,
+            'fused_workflow': self.fused_workflow,
+            'rule_debug_logging': self.rule_debug_logging,
+            'rule_evaluator': self.rule_evaluator,
+            'rule_sql_pushdown': self.rule_sql_pushdown,
+            'pattern_matcher_min_literals': self.pattern_matcher_min_literals,
+            'rule_profiling': self.rule_profiling,
+            'rule_profile_sample_interval': self.rule_profile_sample_interval,
+            'rule_condition_ordering': self.rule_condition_ordering,
+            'regex_time_budget_ms': self.regex_time_budget_ms,
+            'regex_max_alternatives': self.regex_max_alternatives,
+            'regex_max_length': self.regex_max_length,
+            'rule_preview_sample_size': self.rule_preview_sample_size,
+            'rule_preview_max_sample_size': self.rule_preview_max_sample_size,
+            'rule_preview_cache_size': self.rule_preview_cache_size,
+            'rule_preview_cache_ttl': self.rule_preview_cache_ttl,
+            'whitelist_match_mode': self.whitelist_match_mode,
+            'domain_classifier_cache_size': self.domain_classifier_cache_size,
+            'data_dir': self.data_dir,
+            'model_registry_dir': self.model_registry_dir,
+            'model_baseline_sessions': self.model_baseline_sessions,
+            'model_training_max_records': self.model_training_max_records,
+            'model_versions_kept': self.model_versions_kept,
+            'max_concurrent_jobs': self.max_concurrent_jobs,
+            'job_poll_interval': self.job_poll_interval,
+            'job_heartbeat_interval': self.job_heartbeat_interval,
+            'job_stale_seconds': self.job_stale_seconds,
+            'job_max_attempts': self.job_max_attempts,
+            'in_process_workers': self.in_process_workers
         }
 
 # Global configuration instance
@@ -5,7 +5,7 @@ Run this to check processing status and fix stuck sessions
 """
 
 from app import app, db
-from models import ProcessingSession, EmailRecord
+from models import ProcessingSession, EmailRecord, ProcessingJob
 import logging
 
 logging.basicConfig(level=logging.INFO)
@@ -46,6 +46,15 @@ def fix_stuck_sessions():
         print(f"🔧 Found {len(stuck_sessions)} stuck processing sessions")
         
         for session in stuck_sessions:
+            # Sessions owned by a queued or running job are handled by the job queue
+            active_job = ProcessingJob.query.filter(
+                ProcessingJob.session_id == session.id,
+                ProcessingJob.status.in_(['queued', 'running'])
+            ).first()
+            if active_job:
+                print(f"⏳ Session {session.id[:8]}... is owned by job {active_job.id} ({active_job.status}), skipping")
+                continue
+            
             record_count = EmailRecord.query.filter_by(session_id=session.id).count()
             
             if record_count > 0 and session.processed_records > 0:
@@ -0,0 +1,135 @@
+"""
+Regex safety for Email Guardian rules
+Analyst-supplied regex patterns are compiled once through a shared cache, checked for
+constructs prone to catastrophic backtracking when rules are saved, and evaluated under a
+per-evaluation time budget. Searches run through the `regex` package, which interrupts a
+search once it exceeds the budget, so a pathological pattern can't hang processing.
+"""
+import functools
+import logging
+import re
+import time
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+import regex
+
+from performance_config import config
+
+logger = logging.getLogger(__name__)
+
+# Flags of every rule regex: case-insensitive, ^/$ match at line boundaries
+RULE_REGEX_FLAGS = re.IGNORECASE | re.MULTILINE
+
+_REPEAT_OPS = {sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT}
+_POSSESSIVE_REPEAT = getattr(sre_parse, 'POSSESSIVE_REPEAT', None)
+_ATOMIC_GROUP = getattr(sre_parse, 'ATOMIC_GROUP', None)
+
+
+class RegexBudgetExceeded(Exception):
+    """Raised when a regex search takes longer than the evaluation budget"""
+
+    def __init__(self, pattern, elapsed):
+        self.pattern = pattern
+        self.elapsed = elapsed
+        super().__init__(f"Regex '{pattern}' exceeded the {config.regex_time_budget_ms:g} ms evaluation budget "
+                         f"({elapsed * 1000:.0f} ms)")
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_pattern(pattern):
+    """Compile a rule regex, shared by every evaluator"""
+    return re.compile(pattern, RULE_REGEX_FLAGS)
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile_interruptible(pattern):
+    return regex.compile(pattern, regex.IGNORECASE | regex.MULTILINE | regex.VERSION0)
+
+
+class GuardedPattern:
+    """Compiled rule regex whose searches are bounded by the evaluation time budget"""
+    __slots__ = ('pattern', '_compiled', '_interruptible', '_budget')
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self._compiled = compile_pattern(pattern)
+        self._interruptible = None
+        try:
+            self._interruptible = _compile_interruptible(pattern)
+        except Exception as e:
+            # Saving such a pattern is rejected, this only affects rules saved before the check
+            logger.warning(f"Regex '{pattern}' can't be evaluated with a timeout, checking its budget after each search: {str(e)}")
+        self._budget = config.regex_time_budget_ms / 1000.0
+
+    def search(self, text):
+        """Search text, raising RegexBudgetExceeded when the search takes longer than the budget"""
+        if self._budget <= 0:
+            return self._compiled.search(text)
+
+        started = time.perf_counter()
+        if self._interruptible is not None:
+            try:
+                match = self._interruptible.search(text, timeout=self._budget)
+            except TimeoutError:
+                raise RegexBudgetExceeded(self.pattern, time.perf_counter() - started)
+            # Callers only test for a match, searching again with re could backtrack without a timeout
+            return match
+
+        match = self._compiled.search(text)
+        elapsed = time.perf_counter() - started
+        if elapsed > self._budget:
+            raise RegexBudgetExceeded(self.pattern, elapsed)
+        return match
+
+
+def check_pattern_complexity(pattern):
+    """Problems that make a pattern unsafe to evaluate against every record"""
+    if not isinstance(pattern, str):
+        pattern = str(pattern)
+    if len(pattern) > config.regex_max_length:
+        return [f"Pattern is longer than {config.regex_max_length} characters"]
+    try:
+        parsed = sre_parse.parse(pattern, RULE_REGEX_FLAGS)
+    except re.error as e:
+        return [f"Invalid regex pattern - {str(e)}"]
+    try:
+        _compile_interruptible(pattern)
+    except Exception as e:
+        return [f"Pattern can't be evaluated with a time budget - {str(e)}"]
+
+    problems = []
+    _check_items(parsed, False, problems)
+    return list(dict.fromkeys(problems))
+
+
+def _check_items(items, in_repeat, problems):
+    """Walk parsed regex items looking for nested quantifiers and large alternations"""
+    for op, av in items:
+        if op in _REPEAT_OPS:
+            low, high, sub = av
+            unbounded = high == sre_parse.MAXREPEAT
+            if in_repeat and unbounded:
+                problems.append("Nested quantifiers (e.g. (a+)+) can cause catastrophic backtracking")
+            _check_items(sub, in_repeat or high > 1, problems)
+        elif op == _POSSESSIVE_REPEAT or op == _ATOMIC_GROUP:
+            # Possessive repeats and atomic groups never backtrack into their contents
+            continue
+        elif op == sre_parse.SUBPATTERN:
+            _check_items(av[-1], in_repeat, problems)
+        elif op == sre_parse.BRANCH:
+            branches = av[1]
+            if len(branches) > config.regex_max_alternatives:
+                problems.append(f"Alternation with {len(branches)} branches exceeds the limit of "
+                                f"{config.regex_max_alternatives}")
+            for branch in branches:
+                _check_items(branch, in_repeat, problems)
+        elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            _check_items(av[1], in_repeat, problems)
+        elif op == sre_parse.GROUPREF_EXISTS:
+            for branch in av[1:]:
+                if branch is not None:
+                    _check_items(branch, in_repeat, problems)
@@ -4,15 +4,17 @@ import csv
 import json
 from datetime import datetime
 from app import app, db
-from models import ProcessingSession, EmailRecord, Rule, WhitelistDomain, AttachmentKeyword, ProcessingError, RiskFactor
+from models import ProcessingSession, EmailRecord, Rule, WhitelistDomain, AttachmentKeyword, ProcessingError, RiskFactor, ProcessingJob, RuleStats
 from session_manager import SessionManager
 from data_processor import DataProcessor
 from ml_engine import MLEngine
 from advanced_ml_engine import AdvancedMLEngine
 from performance_config import config
 from ml_config import MLRiskConfig
+from domain_classifier import refresh_domain_classifier
 from rule_engine import RuleEngine
 from domain_manager import DomainManager
+from job_queue import JobQueue
 import uuid
 import os
 import json
@@ -29,6 +31,14 @@ advanced_ml_engine = AdvancedMLEngine()
 rule_engine = RuleEngine()
 domain_manager = DomainManager()
 ml_config = MLRiskConfig()
+job_queue = JobQueue(app)
+
+@app.before_request
+def start_job_queue():
+    """Start the background job workers with the first request"""
+    # With separate worker processes the web process only enqueues jobs and reads their status
+    if config.in_process_workers:
+        job_queue.start()
 
 @app.route('/')
 def index():
@@ -65,35 +75,15 @@ def upload_file():
         session = ProcessingSession(
             id=session_id,
             filename=filename,
-            status='uploaded'
+            status='queued'
         )
         db.session.add(session)
         db.session.commit()
 
-        # Process the file asynchronously (start processing and redirect immediately)
-        flash(f'File uploaded successfully. Processing started. Session ID: {session_id}', 'success')
-
-        # Start processing in background with proper Flask context
+        # Queue the file for background processing and redirect immediately
         try:
-            # Quick validation only
-            import threading
-            def background_processing():
-                with app.app_context():  # Create Flask application context
-                    try:
-                        data_processor.process_csv(session_id, upload_path)
-                        logger.info(f"Background processing completed for session {session_id}")
-                    except Exception as e:
-                        logger.error(f"Background processing error for session {session_id}: {str(e)}")
-                        session = ProcessingSession.query.get(session_id)
-                        if session:
-                            session.status = 'error'
-                            session.error_message = str(e)
-                            db.session.commit()
-
-            # Start background thread
-            thread = threading.Thread(target=background_processing)
-            thread.daemon = True
-            thread.start()
+            job_queue.enqueue('process_csv', session_id, {'file_path': os.path.abspath(upload_path)})
+            flash(f'File uploaded successfully. Processing queued. Session ID: {session_id}', 'success')
 
             return redirect(url_for('dashboard', session_id=session_id))
         except Exception as e:
@@ -151,6 +141,8 @@ def processing_status(session_id):
         except Exception as e:
             logger.warning(f"Could not get workflow stats: {str(e)}")
 
+    job = job_queue.get_session_job(session_id)
+
     return jsonify({
         'status': session.status,
         'total_records': session.total_records or 0,
@@ -160,9 +152,50 @@ def processing_status(session_id):
         'total_chunks': session.total_chunks or 0,
         'chunk_progress_percent': int((session.current_chunk or 0) / max(session.total_chunks or 1, 1) * 100),
         'error_message': session.error_message,
-        'workflow_stats': workflow_stats
+        'workflow_stats': workflow_stats,
+        'job': job.to_dict() if job else None
     })
 
+@app.route('/api/cancel-processing/<session_id>', methods=['POST'])
+def cancel_processing(session_id):
+    """Cancel the queued or running processing job for a session"""
+    try:
+        ProcessingSession.query.get_or_404(session_id)
+
+        job = job_queue.get_active_job(session_id)
+        if not job:
+            return jsonify({'error': 'No queued or running job for this session'}), 404
+
+        job = job_queue.cancel(job.id)
+        return jsonify({
+            'success': True,
+            'message': 'Processing cancelled' if job.status == 'cancelled' else 'Cancellation requested',
+            'job': job.to_dict()
+        })
+
+    except Exception as e:
+        logger.error(f"Error cancelling processing for session {session_id}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/jobs')
+def api_jobs():
+    """List recent processing jobs"""
+    status = request.args.get('status')
+    limit = request.args.get('limit', 50, type=int)
+
+    query = ProcessingJob.query
+    if status:
+        query = query.filter_by(status=status)
+    jobs = query.order_by(ProcessingJob.id.desc()).limit(limit).all()
+
+    return jsonify({'jobs': [job.to_dict() for job in jobs]})
+
+@app.route('/api/jobs/<int:job_id>')
+def api_job_status(job_id):
+    """Get the status of a processing job"""
+    job = ProcessingJob.query.get_or_404(job_id)
+    return jsonify(job.to_dict())
+
 @app.route('/api/dashboard-stats/<session_id>')
 def api_dashboard_stats(session_id):
     """Get real-time dashboard statistics for animations"""
@@ -295,7 +328,7 @@ def dashboard(session_id):
     session = ProcessingSession.query.get_or_404(session_id)
 
     # If still processing, show processing view
-    if session.status in ['uploaded', 'processing']:
+    if session.status in ['uploaded', 'queued', 'processing']:
         return render_template('processing.html', session=session)
 
     # Get processing statistics
@@ -782,7 +815,39 @@ def rules():
     return render_template('rules.html',
                          security_rules=security_rules,
                          exclusion_rules=exclusion_rules,
-                         rule_counts=rule_counts)
+                         rule_counts=rule_counts,
+                         rule_stats=get_rule_stats_summary([rule.id for rule in security_rules + exclusion_rules]))
+
+def get_rule_stats_summary(rule_ids):
+    """Evaluation statistics per rule across all profiled sessions"""
+    if not rule_ids:
+        return {}
+    summary = {}
+    totals = db.session.query(
+        RuleStats.rule_id,
+        db.func.count(RuleStats.id),
+        db.func.sum(RuleStats.evaluations),
+        db.func.sum(RuleStats.matches),
+        db.func.sum(RuleStats.total_time),
+        db.func.max(RuleStats.id)
+    ).filter(RuleStats.rule_id.in_(rule_ids)).group_by(RuleStats.rule_id).all()
+    latest_ids = [row[5] for row in totals]
+    latest = {stats.id: stats for stats in RuleStats.query.filter(RuleStats.id.in_(latest_ids)).all()} if latest_ids else {}
+
+    for rule_id, sessions, evaluations, matches, total_time, latest_id in totals:
+        evaluations = evaluations or 0
+        latest_stats = latest.get(latest_id)
+        summary[rule_id] = {
+            'sessions': sessions,
+            'evaluations': evaluations,
+            'matches': matches or 0,
+            'hit_rate': (matches or 0) / evaluations if evaluations else 0,
+            'total_time': total_time or 0,
+            'avg_time': (total_time or 0) / evaluations if evaluations else 0,
+            'slowest_condition': latest_stats.slowest_condition if latest_stats else None,
+            'slowest_condition_time': latest_stats.slowest_condition_time if latest_stats else None
+        }
+    return summary
 
 @app.route('/api/rules', methods=['POST'])
 def create_rule():
@@ -809,6 +874,11 @@ def create_rule():
                 json.loads(conditions)
             except json.JSONDecodeError:
                 return jsonify({'success': False, 'message': 'Invalid JSON in conditions'}), 400
+
+        # Reject regex patterns that are invalid or prone to catastrophic backtracking
+        regex_problems = rule_engine.check_regex_conditions(conditions)
+        if regex_problems:
+            return jsonify({'success': False, 'message': '; '.join(regex_problems), 'errors': regex_problems}), 400
         
         # Process actions
         actions = data.get('actions', {})
@@ -851,6 +921,48 @@ def create_rule():
         db.session.rollback()
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@app.route('/api/rules/preview', methods=['POST'])
+def preview_rules():
+    """Preview candidate and saved rules together against a session or a sample of recent records"""
+    try:
+        data = request.get_json() or {}
+
+        rules_data = list(data.get('rules') or [])
+        rule_ids = data.get('rule_ids') or []
+        if rule_ids:
+            saved_rules = {rule.id: rule for rule in Rule.query.filter(Rule.id.in_(rule_ids)).all()}
+            for rule_id in rule_ids:
+                rule = saved_rules.get(rule_id)
+                if not rule:
+                    return jsonify({'success': False, 'message': f'Rule {rule_id} not found'}), 404
+                rules_data.append({'name': rule.name, 'conditions': rule.conditions, 'actions': rule.actions})
+        if not rules_data:
+            return jsonify({'success': False, 'message': 'No rules to preview'}), 400
+
+        session_id = data.get('session_id')
+        if session_id and not ProcessingSession.query.get(session_id):
+            return jsonify({'success': False, 'message': 'Session not found'}), 404
+
+        sample_size = data.get('sample_size')
+        if sample_size is not None:
+            if isinstance(sample_size, bool) or not str(sample_size).strip().isdigit() or int(sample_size) <= 0:
+                return jsonify({'success': False, 'message': 'sample_size must be a positive integer'}), 400
+            # Capped at rule_preview_max_sample_size by the preview
+            sample_size = int(sample_size)
+
+        preview = rule_engine.preview_rules(
+            rules_data,
+            session_id=session_id,
+            sample_size=sample_size,
+            sample_limit=min(int(data.get('sample_limit', 10)), 100)
+        )
+        if 'error' in preview:
+            return jsonify({'success': False, 'message': preview['error']}), 500
+        return jsonify({'success': True, **preview})
+    except Exception as e:
+        logger.error(f"Error previewing rules: {str(e)}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
 @app.route('/api/rules/<int:rule_id>', methods=['GET'])
 def get_rule(rule_id):
     """Get individual rule details"""
@@ -874,6 +986,33 @@ def get_rule(rule_id):
         logger.error(f"Error getting rule {rule_id}: {str(e)}")
         return jsonify({'success': False, 'message': f'Error fetching rule details: {str(e)}'}), 500
 
+@app.route('/api/rules/<int:rule_id>/stats', methods=['GET'])
+def get_rule_stats(rule_id):
+    """Get evaluation statistics of a rule, overall and per session"""
+    try:
+        rule = Rule.query.get(rule_id)
+        if not rule:
+            return jsonify({'success': False, 'message': 'Rule not found'}), 404
+
+        query = RuleStats.query.filter_by(rule_id=rule_id)
+        session_id = request.args.get('session_id')
+        if session_id:
+            query = query.filter_by(session_id=session_id)
+        limit = min(request.args.get('limit', 50, type=int), 500)
+        sessions = query.order_by(RuleStats.updated_at.desc()).limit(limit).all()
+
+        return jsonify({
+            'success': True,
+            'rule_id': rule.id,
+            'name': rule.name,
+            'rule_type': rule.rule_type,
+            'summary': get_rule_stats_summary([rule.id]).get(rule.id),
+            'sessions': [stats.to_dict() for stats in sessions]
+        })
+    except Exception as e:
+        logger.error(f"Error getting stats for rule {rule_id}: {str(e)}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
 @app.route('/api/rules/<int:rule_id>', methods=['PUT'])
 def update_rule(rule_id):
     """Update an existing rule"""
@@ -885,6 +1024,11 @@ def update_rule(rule_id):
         if 'is_active' in data and data['is_active'] is None:
             rule.is_active = not rule.is_active
         else:
+            if data.get('conditions') is not None:
+                regex_problems = rule_engine.check_regex_conditions(data['conditions'])
+                if regex_problems:
+                    return jsonify({'success': False, 'message': '; '.join(regex_problems), 'errors': regex_problems}), 400
+
             # Update rule fields
             for field in ['name', 'rule_type', 'description', 'priority', 'conditions', 'actions', 'is_active']:
                 if field in data and data[field] is not None:
@@ -908,6 +1052,7 @@ def delete_rule(rule_id):
     """Delete a rule"""
     try:
         rule = Rule.query.get_or_404(rule_id)
+        RuleStats.query.filter_by(rule_id=rule_id).delete()
         db.session.delete(rule)
         db.session.commit()
 
@@ -1326,6 +1471,18 @@ def api_whitelist_analysis(session_id):
         logger.error(f"Error getting whitelist analysis for session {session_id}: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/domain_stats/<path:domain>')
+def api_domain_stats(domain):
+    """Get cross-session statistics and trust score of a recipient domain"""
+    try:
+        history = domain_manager.get_domain_history(domain)
+        if not history:
+            return jsonify({'error': 'No statistics for domain'}), 404
+        return jsonify(history)
+    except Exception as e:
+        logger.error(f"Error getting domain statistics for {domain}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/case/<session_id>/<record_id>')
 def api_case_details(session_id, record_id):
     """Get individual case details"""
@@ -1368,6 +1525,10 @@ def api_exclusion_rules():
 
     elif request.method == 'POST':
         data = request.get_json()
+        regex_problems = rule_engine.check_regex_conditions(data['conditions'])
+        if regex_problems:
+            return jsonify({'success': False, 'message': '; '.join(regex_problems), 'errors': regex_problems}), 400
+
         rule = Rule(
             name=data['name'],
             description=data.get('description', ''),
@@ -1398,6 +1559,11 @@ def api_exclusion_rule(rule_id):
 
     elif request.method == 'PUT':
         data = request.get_json()
+        if data.get('conditions') is not None:
+            regex_problems = rule_engine.check_regex_conditions(data['conditions'])
+            if regex_problems:
+                return jsonify({'success': False, 'message': '; '.join(regex_problems), 'errors': regex_problems}), 400
+
         rule.name = data.get('name', rule.name)
         rule.description = data.get('description', rule.description)
         rule.conditions = data.get('conditions', rule.conditions)
@@ -1420,6 +1586,20 @@ def api_toggle_exclusion_rule(rule_id):
     db.session.commit()
     return jsonify({'status': 'toggled', 'is_active': rule.is_active})
 
+def queue_whitelist_reapplication(domains):
+    """Queue re-applying whitelist changes to the processed sessions with records sent to the domains"""
+    jobs = []
+    if not domains:
+        return jobs
+    for session_id in domain_manager.find_sessions_with_domains(domains):
+        session = ProcessingSession.query.get(session_id)
+        # Sessions that haven't reached the whitelist stage yet apply the current whitelist themselves
+        if not session or not session.whitelist_applied:
+            continue
+        # Merged into a job already waiting for the session, never run alongside another job of it
+        jobs.append(job_queue.enqueue_whitelist_reapplication(session_id, domains))
+    return jobs
+
 @app.route('/api/whitelist-domains', methods=['GET', 'POST'])
 def api_whitelist_domains():
     """Get all whitelist domains or create new one"""
@@ -1463,7 +1643,9 @@ def api_whitelist_domains():
             db.session.commit()
 
             logger.info(f"Added whitelist domain: {domain}")
-            return jsonify({'success': True, 'message': f'Domain {domain} added successfully', 'id': whitelist_domain.id})
+            jobs = queue_whitelist_reapplication([domain])
+            return jsonify({'success': True, 'message': f'Domain {domain} added successfully', 'id': whitelist_domain.id,
+                            'reapply_jobs': [job.id for job in jobs]})
 
         except Exception as e:
             logger.error(f"Error adding whitelist domain: {str(e)}")
@@ -1505,11 +1687,53 @@ def api_whitelist_domain(domain_id):
 
     elif request.method == 'DELETE':
         domain_name = domain.domain
+        was_active = domain.is_active
         db.session.delete(domain)
         db.session.commit()
 
         logger.info(f"Domain {domain_name} removed from whitelist")
-        return jsonify({'success': True, 'message': f'Domain {domain_name} deleted successfully'})
+        jobs = queue_whitelist_reapplication([domain_name] if was_active else [])
+        return jsonify({'success': True, 'message': f'Domain {domain_name} deleted successfully',
+                        'reapply_jobs': [job.id for job in jobs]})
+
+@app.route('/api/whitelist-domains/bulk', methods=['POST'])
+def api_bulk_whitelist_domains():
+    """Add or remove many whitelist domains in one transaction and re-apply them to the affected sessions"""
+    try:
+        data = request.get_json() or {}
+        domains = data.get('domains') or []
+        if isinstance(domains, str):
+            domains = domains.splitlines()
+        action = data.get('action', 'add')
+
+        if action == 'add':
+            results = domain_manager.bulk_add_domains_to_whitelist(
+                domains,
+                added_by=data.get('added_by', 'Admin'),
+                domain_type=data.get('domain_type', 'Corporate')
+            )
+            changed = results['added'] + results['reactivated']
+        elif action == 'remove':
+            results = domain_manager.bulk_remove_domains_from_whitelist(domains)
+            changed = results['removed']
+        else:
+            return jsonify({'success': False, 'message': f'Unknown action: {action}'}), 400
+
+        if results['errors']:
+            return jsonify({'success': False, 'message': '; '.join(results['errors']), 'results': results}), 500
+
+        jobs = queue_whitelist_reapplication(changed)
+        return jsonify({
+            'success': True,
+            'message': f'{len(changed)} whitelist domains changed, re-applying to {len(jobs)} sessions',
+            'results': results,
+            'reapply_jobs': [job.id for job in jobs]
+        })
+
+    except Exception as e:
+        logger.error(f"Error in bulk whitelist update: {str(e)}")
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
 
 # Admin Dashboard API Endpoints
 @app.route('/admin/api/performance-metrics')
@@ -1766,19 +1990,39 @@ def admin_backup_database():
 
 @app.route('/admin/api/retrain-models', methods=['POST'])
 def admin_retrain_models():
-    """Retrain ML models"""
+    """Queue retraining of the anomaly model on the recent sessions"""
     try:
-        # This would trigger ML model retraining in a real implementation
-        # For now, return success
+        # A retrain already waiting or running covers this request
+        job = ProcessingJob.query.filter(
+            ProcessingJob.job_type == 'retrain_models',
+            ProcessingJob.status.in_(['queued', 'running'])
+        ).order_by(ProcessingJob.id.desc()).first()
+        if job is None:
+            job = job_queue.enqueue('retrain_models')
+
         return jsonify({
-            'success': True, 
-            'message': 'ML models retrained successfully',
-            'models_updated': ['isolation_forest', 'text_classifier', 'risk_scorer']
+            'success': True,
+            'message': 'ML model retraining queued, the new model is activated once training completes',
+            'job': job.to_dict(),
+            'active_model': ml_engine.model_registry.active_version()
         })
     except Exception as e:
         logger.error(f"Error retraining models: {str(e)}")
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@app.route('/admin/api/ml-models')
+def admin_ml_models():
+    """List the stored anomaly model versions"""
+    try:
+        registry = ml_engine.model_registry
+        return jsonify({
+            'active_model': registry.active_version(),
+            'models': registry.list_versions()
+        })
+    except Exception as e:
+        logger.error(f"Error listing ML models: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/admin/api/update-ml-keywords', methods=['POST'])
 def admin_update_ml_keywords():
     """Update ML keywords database"""
@@ -1855,11 +2099,13 @@ def api_toggle_whitelist_domain(domain_id):
 
         status = 'activated' if domain.is_active else 'deactivated'
         logger.info(f"Domain {domain.domain} {status}")
+        jobs = queue_whitelist_reapplication([domain.domain])
 
         return jsonify({
             'success': True, 
             'message': f'Domain {domain.domain} {status} successfully',
-            'is_active': domain.is_active
+            'is_active': domain.is_active,
+            'reapply_jobs': [job.id for job in jobs]
         })
 
     except Exception as e:
@@ -1874,15 +2120,10 @@ def admin_update_whitelist():
         domains = request.form.get('domains', '').strip()
         if domains:
             domain_list = [d.strip().lower() for d in domains.split('\n') if d.strip()]
-            for domain in domain_list:
-                if not WhitelistDomain.query.filter_by(domain=domain).first():
-                    whitelist_entry = WhitelistDomain(
-                        domain=domain,
-                        domain_type='Corporate',
-                        added_by='Admin'
-                    )
-                    db.session.add(whitelist_entry)
-            db.session.commit()
+            results = domain_manager.bulk_add_domains_to_whitelist(domain_list, added_by='Admin')
+            if results['errors']:
+                raise RuntimeError('; '.join(results['errors']))
+            queue_whitelist_reapplication(results['added'] + results['reactivated'])
             flash(f'Added {len(domain_list)} domains to whitelist', 'success')
         return redirect(url_for('admin'))
     except Exception as e:
@@ -2148,6 +2389,7 @@ def delete_session(session_id):
         session = ProcessingSession.query.get_or_404(session_id)
 
         # Delete associated email records
+        domain_manager.remove_domain_stats(session_id)
         EmailRecord.query.filter_by(session_id=session_id).delete()
 
         # Delete processing errors
@@ -2191,6 +2433,7 @@ def cleanup_old_sessions():
         for session in old_sessions:
             try:
                 # Delete associated records
+                domain_manager.remove_domain_stats(session.id)
                 EmailRecord.query.filter_by(session_id=session.id).delete()
                 ProcessingError.query.filter_by(session_id=session.id).delete()
 
@@ -2417,6 +2660,14 @@ def api_ml_config():
             if 'public_domains' in data:
                 ml_config.PUBLIC_DOMAINS = data['public_domains']
 
+            # Domain lists are read by the shared domain classifier from the config class
+            if 'public_domain_lists' in data:
+                MLRiskConfig.PUBLIC_DOMAIN_LISTS = {**MLRiskConfig.PUBLIC_DOMAIN_LISTS, **data['public_domain_lists']}
+            for key in ('disposable_domain_keywords', 'suspicious_tlds', 'internal_domains'):
+                if key in data:
+                    setattr(MLRiskConfig, key.upper(), data[key])
+            refresh_domain_classifier()
+
             if 'suspicious_justification_terms' in data:
                 ml_config.SUSPICIOUS_JUSTIFICATION_TERMS = data['suspicious_justification_terms']
 
@@ -2975,7 +3226,7 @@ def config_last_modified():
         # Check modification times of configuration tables
         last_rule_update = db.session.query(db.func.max(Rule.updated_at)).scalar() or datetime.min
         last_whitelist_update = db.session.query(db.func.max(WhitelistDomain.added_at)).scalar() or datetime.min
-        last_keyword_update = db.session.query(db.func.max(AttachmentKeyword.created_at)).scalar() or datetime.min
+        last_keyword_update = db.session.query(db.func.max(AttachmentKeyword.updated_at)).scalar() or datetime.min
 
         # Get the most recent update
         last_modified = max(last_rule_update, last_whitelist_update, last_keyword_update)
@@ -2992,41 +3243,33 @@ def config_last_modified():
 def debug_whitelist_matching(session_id):
     """Debug endpoint to check whitelist domain matching"""
     try:
-        # Get active whitelist domains
-        whitelist_domains = WhitelistDomain.query.filter_by(is_active=True).all()
-        whitelist_set = {domain.domain.lower().strip() for domain in whitelist_domains}
+        # Compile active whitelist domains as processing does
+        whitelist_index = domain_manager.get_whitelist_index()
         
         # Get unique domains from email records
-        records = EmailRecord.query.filter_by(session_id=session_id).all()
-        email_domains = {record.recipients_email_domain.lower().strip() 
-                        for record in records 
-                        if record.recipients_email_domain}
+        email_domains = {domain.lower().strip()
+                         for (domain,) in db.session.query(EmailRecord.recipients_email_domain).filter(
+                             EmailRecord.session_id == session_id).distinct()
+                         if domain}
         
         # Check matches
         matches = []
         non_matches = []
         
         for email_domain in email_domains:
-            matched = False
-            for whitelist_domain in whitelist_set:
-                if (email_domain == whitelist_domain or 
-                    email_domain.endswith('.' + whitelist_domain) or 
-                    whitelist_domain.endswith('.' + email_domain) or
-                    email_domain in whitelist_domain or 
-                    whitelist_domain in email_domain):
-                    matches.append({
-                        'email_domain': email_domain,
-                        'whitelist_domain': whitelist_domain,
-                        'match_type': 'exact' if email_domain == whitelist_domain else 'partial'
-                    })
-                    matched = True
-                    break
-            
-            if not matched:
+            match = whitelist_index.match(email_domain)
+            if match:
+                matches.append({
+                    'email_domain': email_domain,
+                    'whitelist_domain': match[0],
+                    'match_type': match[1]
+                })
+            else:
                 non_matches.append(email_domain)
         
         return jsonify({
-            'whitelist_domains': list(whitelist_set),
+            'match_mode': whitelist_index.mode,
+            'whitelist_domains': sorted(whitelist_index.domains),
             'email_domains': list(email_domains),
             'matches': matches,
             'non_matches': non_matches,
@@ -3450,7 +3693,7 @@ def reprocess_session_data(session_id):
     try:
         session = ProcessingSession.query.get_or_404(session_id)
 
-        if session.status == 'processing':
+        if session.status == 'processing' or job_queue.get_active_job(session_id):
             return jsonify({
                 'error': 'Session is already processing'
             }), 400
@@ -3476,51 +3719,18 @@ def reprocess_session_data(session_id):
                 'error': 'Original CSV file not found for re-processing'
             }), 404
 
-        # Update session status
-        session.status = 'processing'
-        session.processed_records = 0
+        # Queue re-processing with current configurations; the worker clears the old results
+        session.status = 'queued'
         session.error_message = None
-        session.current_chunk = 0
-        session.total_chunks = 0
-        db.session.commit()
-
-        # Clear existing processed data for this session
-        EmailRecord.query.filter_by(session_id=session_id).delete()
-        ProcessingError.query.filter_by(session_id=session_id).delete()
         db.session.commit()
 
-        # Re-process with current configurations in background thread
-        def background_reprocessing():
-            with app.app_context():
-                try:
-                    logger.info(f"Starting re-processing for session {session_id}")
-                    
-                    # Log current rules
-                    active_rules = Rule.query.filter_by(is_active=True).all()
-                    logger.info(f"Found {len(active_rules)} active rules for re-processing")
-                    for rule in active_rules:
-                        logger.info(f"Rule: {rule.name} (Type: {rule.rule_type}, Conditions: {rule.conditions})")
-                    
-                    data_processor.process_csv(session_id, csv_path)
-                    logger.info(f"Background re-processing completed for session {session_id}")
-                except Exception as e:
-                    logger.error(f"Background re-processing error for session {session_id}: {str(e)}")
-                    session = ProcessingSession.query.get(session_id)
-                    if session:
-                        session.status = 'error'
-                        session.error_message = str(e)
-                        db.session.commit()
-
-        # Start background thread
-        import threading
-        thread = threading.Thread(target=background_reprocessing)
-        thread.daemon = True
-        thread.start()
+        job = job_queue.enqueue('reprocess_session', session_id, {'file_path': os.path.abspath(csv_path)})
 
         return jsonify({
             'success': True,
-            'message': 'Re-processing started with current configurations',
-            'session_id': session_id
+            'message': 'Re-processing queued with current configurations',
+            'session_id': session_id,
+            'job_id': job.id
         })
 
     except Exception as e:
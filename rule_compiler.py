@@ -0,0 +1,463 @@
+"""
+Rule compiler for Email Guardian
+Turns rule condition JSON into predicate closures that are built once per rule version
+and evaluated against a per-record context. The compiled predicates reproduce the
+RuleEngine condition interpreter exactly, including its handling of malformed rules.
+"""
+import copy
+import json
+import logging
+import re
+from regex_guard import GuardedPattern
+
+logger = logging.getLogger(__name__)
+
+# Common CSV representations of empty/none values, compared as ""
+EMPTY_VALUES = frozenset(['', 'none', 'null', 'n/a', 'na', 'nil'])
+
+# Operators that compare lower-cased values
+CASE_INSENSITIVE_OPERATORS = frozenset([
+    'equals', 'contains', 'not_equals', 'not_contains', 'starts_with', 'ends_with', 'in_list'
+])
+
+_missing_fields_logged = set()
+
+
+def normalize_value(value):
+    """Convert a value to a stripped string, mapping empty markers to ''"""
+    text = str(value).strip() if value is not None else ""
+    if text.lower() in EMPTY_VALUES:
+        return ""
+    return text
+
+
+def get_field_value(record, field):
+    """Get a field value from a record, '' for missing fields and None"""
+    try:
+        if hasattr(record, field):
+            value = getattr(record, field)
+            return value if value is not None else ''
+        if field not in _missing_fields_logged:
+            _missing_fields_logged.add(field)
+            logger.warning(f"Field '{field}' not found in record")
+        return ''
+    except Exception as e:
+        logger.error(f"Error getting field value for '{field}': {str(e)}")
+        return ''
+
+
+class RecordContext:
+    """Field values of one record, converted once and shared by every rule evaluated on it"""
+    __slots__ = ('record', 'matchers', '_raw', '_text', '_lower', '_found')
+
+    def __init__(self, record, matchers=None):
+        self.record = record
+        self.matchers = matchers
+        self._raw = {}
+        self._text = {}
+        self._lower = {}
+        self._found = {}
+
+    def raw(self, field):
+        """Field value as stored on the record"""
+        try:
+            return self._raw[field]
+        except KeyError:
+            value = self._raw[field] = get_field_value(self.record, field)
+            return value
+
+    def text(self, field):
+        """Stripped field value with empty markers mapped to ''"""
+        try:
+            return self._text[field]
+        except KeyError:
+            value = self._text[field] = normalize_value(self.raw(field))
+            return value
+
+    def lower(self, field):
+        """Lower-cased normalized field value"""
+        try:
+            return self._lower[field]
+        except KeyError:
+            value = self._lower[field] = self.text(field).lower()
+            return value
+
+    def contains(self, field, literal):
+        """Whether the lower-cased field value contains literal"""
+        matcher = self.matchers.get(field) if self.matchers else None
+        if matcher is None or literal not in matcher.literals:
+            return literal in self.lower(field)
+        try:
+            found = self._found[field]
+        except KeyError:
+            # One scan finds every literal of the field's matcher
+            found = self._found[field] = matcher.find(self.lower(field))
+        return literal in found
+
+    def invalidate(self):
+        """Forget cached values after the record has been modified"""
+        self._raw.clear()
+        self._text.clear()
+        self._lower.clear()
+        self._found.clear()
+
+
+class CompiledRule:
+    """A rule together with its condition tree and compiled predicate"""
+    __slots__ = ('rule', 'tree', 'predicate', 'updated_at', 'conditions', 'condition_stats')
+
+    def __init__(self, rule, predicate, tree=None, condition_stats=None):
+        self.rule = rule
+        self.tree = tree
+        self.predicate = predicate
+        self.updated_at = rule.updated_at
+        self.conditions = copy.deepcopy(rule.conditions)
+        self.condition_stats = condition_stats
+
+    def matches(self, record):
+        """Evaluate the rule against a single record"""
+        return self.predicate(record if isinstance(record, RecordContext) else RecordContext(record))
+
+
+class _AlwaysFalse(Exception):
+    """Raised while parsing conditions the interpreter fails on for every record"""
+    pass
+
+
+# Condition tree nodes shared by the compiled and vectorized evaluators:
+#   ('never',) / ('always',)        constant results
+#   ('all', [nodes]) / ('any', [nodes])
+#   ('condition', field, operator, operand)
+NEVER = ('never',)
+ALWAYS = ('always',)
+
+
+def _all_of(nodes):
+    """AND node with nested ANDs flattened and constants folded"""
+    children = []
+    for node in nodes:
+        if node is NEVER:
+            return NEVER
+        if node is ALWAYS:
+            continue
+        children.extend(node[1] if node[0] == 'all' else [node])
+
+    if not children:
+        return ALWAYS
+    if len(children) == 1:
+        return children[0]
+    return ('all', children)
+
+
+def _any_of(nodes):
+    """OR node with nested ORs flattened and constants folded"""
+    children = []
+    for node in nodes:
+        if node is ALWAYS:
+            return ALWAYS
+        if node is NEVER:
+            continue
+        children.extend(node[1] if node[0] == 'any' else [node])
+
+    if not children:
+        return NEVER
+    if len(children) == 1:
+        return children[0]
+    return ('any', children)
+
+
+def parse_conditions(conditions):
+    """Normalize a rule's conditions into a condition tree"""
+    try:
+        if not conditions:
+            return NEVER
+        if isinstance(conditions, dict):
+            return _parse_dict(conditions)
+        if isinstance(conditions, list):
+            return _all_of([_parse_single(condition) for condition in conditions])
+        if isinstance(conditions, str):
+            try:
+                parsed = json.loads(conditions)
+            except json.JSONDecodeError:
+                logger.error(f"Invalid JSON conditions: {conditions}")
+                return NEVER
+            if isinstance(parsed, dict):
+                return _parse_dict(parsed)
+            if isinstance(parsed, list):
+                # An empty parsed list matches every record, like the interpreter's all([])
+                return _all_of([_parse_single(condition) for condition in parsed])
+            return NEVER
+
+        logger.warning(f"Unknown condition format: {type(conditions)}")
+        return NEVER
+
+    except _AlwaysFalse:
+        return NEVER
+
+
+def _parse_dict(conditions):
+    if 'logic' in conditions and 'conditions' in conditions:
+        return _parse_complex(conditions)
+    return _parse_single(conditions)
+
+
+def _parse_complex(conditions):
+    """Parse an AND/OR condition group"""
+    logic = conditions.get('logic', 'AND')
+    if not isinstance(logic, str):
+        # The interpreter fails on logic.upper() and rejects the whole rule
+        raise _AlwaysFalse()
+    logic = logic.upper()
+
+    condition_list = conditions.get('conditions', [])
+    if not condition_list:
+        return NEVER
+    if isinstance(condition_list, (str, dict)):
+        # Iterating a string or dict yields no valid condition, so every entry is False
+        return NEVER
+    if not isinstance(condition_list, (list, tuple)):
+        raise _AlwaysFalse()
+
+    nodes = []
+    for condition in condition_list:
+        if isinstance(condition, dict) and 'logic' in condition:
+            nodes.append(_parse_complex(condition))
+        else:
+            nodes.append(_parse_single(condition))
+
+    if logic == 'OR':
+        return _any_of(nodes)
+    return _all_of(nodes)
+
+
+def _parse_single(condition):
+    """Parse a single field/operator/value condition, precomputing its operand"""
+    if not isinstance(condition, dict):
+        return NEVER
+
+    field = condition.get('field')
+    operator = condition.get('operator')
+    value = condition.get('value')
+
+    if not field or not operator or not isinstance(operator, str):
+        return NEVER
+    if not isinstance(field, str):
+        field = None  # Attribute lookup fails, the record value is ''
+
+    if operator in CASE_INSENSITIVE_OPERATORS and operator != 'in_list':
+        return ('condition', field, operator, normalize_value(value).lower())
+
+    if operator == 'regex':
+        try:
+            # Regex uses the original case of both pattern and record value
+            pattern = GuardedPattern(str(value))
+        except re.error as e:
+            logger.warning(f"Invalid regex pattern '{value}': {str(e)}")
+            return NEVER
+        return ('condition', field, operator, pattern)
+
+    if operator in ('greater_than', 'less_than'):
+        try:
+            threshold = float(value)
+        except Exception:
+            return NEVER
+        return ('condition', field, operator, threshold)
+
+    if operator == 'in_list':
+        if isinstance(value, list):
+            values = frozenset(str(v).strip().lower() for v in value)
+        else:
+            values = frozenset(v.strip().lower() for v in str(value).split(','))
+        return ('condition', field, operator, values)
+
+    if operator in ('is_empty', 'is_not_empty'):
+        return ('condition', field, operator, None)
+
+    logger.warning(f"Unknown operator: {operator}")
+    return NEVER
+
+
+def condition_fields(node):
+    """Fields referenced by a condition tree"""
+    if node[0] == 'condition':
+        return {node[1]}
+    if node[0] in ('all', 'any'):
+        fields = set()
+        for child in node[1]:
+            fields |= condition_fields(child)
+        return fields
+    return set()
+
+
+def contains_literals(node, literals_by_field):
+    """Collect the contains/not_contains literals of a condition tree per field"""
+    if node[0] == 'condition':
+        _, field, operator, operand = node
+        if field is not None and operator in ('contains', 'not_contains'):
+            literals_by_field.setdefault(field, set()).add(operand)
+    elif node[0] in ('all', 'any'):
+        for child in node[1]:
+            contains_literals(child, literals_by_field)
+    return literals_by_field
+
+
+def condition_label(node):
+    """Readable description of a condition node, also used as its statistics key"""
+    _, field, operator, operand = node
+    if operator == 'regex':
+        operand = operand.pattern
+    elif operator == 'in_list':
+        operand = ', '.join(sorted(operand))
+    elif operand is None:
+        return f"{field} {operator}"
+    return f"{field} {operator} {operand}"
+
+
+def condition_leaves(node):
+    """Condition nodes of a tree, in evaluation order"""
+    if node[0] == 'condition':
+        return [node]
+    if node[0] in ('all', 'any'):
+        return [leaf for child in node[1] for leaf in condition_leaves(child)]
+    return []
+
+
+def _estimate(node, condition_stats):
+    """(cost, pass rate) of a node from condition statistics, None if unknown"""
+    if node[0] == 'condition':
+        return condition_stats.get(condition_label(node))
+    estimates = [_estimate(child, condition_stats) for child in node[1]]
+    if None in estimates:
+        return None
+    cost = sum(estimate[0] for estimate in estimates)
+    probability = 1.0
+    if node[0] == 'all':
+        for _, pass_rate in estimates:
+            probability *= pass_rate
+        return cost, probability
+    for _, pass_rate in estimates:
+        probability *= 1 - pass_rate
+    return cost, 1 - probability
+
+
+def order_conditions(node, condition_stats):
+    """Reorder AND/OR groups so cheap, decisive conditions short-circuit first
+
+    Conditions have no side effects, so the order only changes evaluation time. A group
+    is reordered only when every member has statistics.
+    """
+    if node[0] not in ('all', 'any'):
+        return node
+    children = [order_conditions(child, condition_stats) for child in node[1]]
+    estimates = [_estimate(child, condition_stats) for child in children]
+    if None not in estimates:
+        # AND stops at the first False, OR at the first True: rank by cost per chance of stopping
+        decisive = (lambda pass_rate: 1 - pass_rate) if node[0] == 'all' else (lambda pass_rate: pass_rate)
+        ranks = [cost / decisive(pass_rate) if decisive(pass_rate) > 0 else float('inf')
+                 for cost, pass_rate in estimates]
+        children = [child for _, _, child in sorted(zip(ranks, range(len(children)), children),
+                                                    key=lambda item: item[:2])]
+    return (node[0], children)
+
+
+def _never(context):
+    return False
+
+
+def _always(context):
+    return True
+
+
+def build_predicate(node):
+    """Build a predicate over a RecordContext from a condition tree"""
+    kind = node[0]
+    if kind == 'never':
+        return _never
+    if kind == 'always':
+        return _always
+
+    if kind == 'all':
+        children = [build_predicate(child) for child in node[1]]
+
+        def predicate(context):
+            for child in children:
+                if not child(context):
+                    return False
+            return True
+        return predicate
+
+    if kind == 'any':
+        children = [build_predicate(child) for child in node[1]]
+
+        def predicate(context):
+            for child in children:
+                if child(context):
+                    return True
+            return False
+        return predicate
+
+    _, field, operator, operand = node
+    if operator == 'equals':
+        return lambda context: context.lower(field) == operand
+    if operator == 'contains':
+        return lambda context: context.contains(field, operand)
+    if operator == 'not_equals':
+        return lambda context: context.lower(field) != operand
+    if operator == 'not_contains':
+        return lambda context: not context.contains(field, operand)
+    if operator == 'starts_with':
+        return lambda context: context.lower(field).startswith(operand)
+    if operator == 'ends_with':
+        return lambda context: context.lower(field).endswith(operand)
+    if operator == 'in_list':
+        return lambda context: context.lower(field) in operand
+    if operator == 'regex':
+        search = operand.search
+        return lambda context: search(str(context.raw(field))) is not None
+    if operator == 'is_empty':
+        return lambda context: context.text(field) == ""
+    if operator == 'is_not_empty':
+        return lambda context: context.text(field) != ""
+
+    greater = operator == 'greater_than'
+
+    def compare(context):
+        try:
+            number = float(context.raw(field))
+        except Exception:
+            return False
+        return number > operand if greater else number < operand
+    return compare
+
+
+def compile_conditions(conditions):
+    """Compile a rule's conditions into a predicate over a RecordContext"""
+    return build_predicate(parse_conditions(conditions))
+
+
+class RuleCompiler:
+    """Compiles rules into predicates and caches them per rule version"""
+
+    def __init__(self):
+        self._cache = {}
+
+    def compile(self, rule, condition_stats=None):
+        """Get the compiled form of a rule, recompiling when the rule or its condition statistics changed"""
+        if rule.id is not None:
+            cached = self._cache.get(rule.id)
+            if cached and cached.updated_at == rule.updated_at and cached.conditions == rule.conditions \
+                    and cached.condition_stats == condition_stats:
+                cached.rule = rule
+                return cached
+
+        tree = parse_conditions(rule.conditions)
+        if condition_stats:
+            tree = order_conditions(tree, condition_stats)
+        compiled = CompiledRule(rule, build_predicate(tree), tree, condition_stats)
+        if rule.id is not None:
+            self._cache[rule.id] = compiled
+        return compiled
+
+    def clear(self):
+        """Drop all cached predicates"""
+        self._cache.clear()
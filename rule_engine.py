@@ -1,8 +1,18 @@
 import json
 import re
 import logging
+import time
 from datetime import datetime
-from models import Rule, EmailRecord
+from sqlalchemy import update
+from models import Rule, EmailRecord, ProcessingError
+from rule_compiler import RuleCompiler, CompiledRule, RecordContext, contains_literals
+from pattern_matcher import build_pattern_matchers
+from vectorized_rules import VectorizedRuleEvaluator
+from rule_sql import condition_to_sql, has_non_ascii_values, UntranslatableCondition
+from rule_profiler import RuleProfiler, load_condition_stats
+from regex_guard import GuardedPattern, RegexBudgetExceeded, check_pattern_complexity
+from rule_preview import preview_rules
+from performance_config import config
 from app import db
 
 logger = logging.getLogger(__name__)
@@ -21,6 +31,100 @@ class RuleEngine:
             'leaver', 'termination_date', 'wordlist_attachment', 'wordlist_subject',
             'bunit', 'department', 'status', 'user_response', 'final_outcome', 'justification'
         ]
+        
+        # Rules are compiled once per version; per-condition debug logging is opt-in
+        self.rule_compiler = RuleCompiler()
+        self.debug_logging = config.rule_debug_logging
+        self.rule_evaluator = config.rule_evaluator
+        self.sql_pushdown = config.rule_sql_pushdown
+        self.profiling = config.rule_profiling
+        self.condition_ordering = config.rule_condition_ordering
+        self.disabled_rules = set()  # Ids of rules disabled for the rest of the current run
+        self.vectorized_evaluator = VectorizedRuleEvaluator(self)
+    
+    def get_exclusion_rules(self):
+        """Get active exclusion rules in evaluation order"""
+        return Rule.query.filter_by(
+            rule_type='exclusion',
+            is_active=True
+        ).order_by(Rule.priority.desc()).all()
+    
+    def get_security_rules(self):
+        """Get active security rules (including those without explicit rule_type) in evaluation order"""
+        return Rule.query.filter(
+            Rule.is_active == True,
+            db.or_(Rule.rule_type == 'security', Rule.rule_type.is_(None))
+        ).order_by(Rule.priority.desc()).all()
+    
+    def compile_rules(self, rules):
+        """Compile rules into cached predicates for a processing run"""
+        # Rules disabled by an earlier run get another chance
+        self.disabled_rules.difference_update(rule.id for rule in rules)
+        if self.debug_logging:
+            # The condition interpreter logs every comparison it makes
+            return [
+                CompiledRule(rule, lambda context, rule=rule: self._evaluate_rule_conditions(context.record, rule))
+                for rule in rules
+            ]
+        condition_stats = load_condition_stats([rule.id for rule in rules]) if self.condition_ordering else {}
+        return [self.rule_compiler.compile(rule, condition_stats.get(rule.id)) for rule in rules]
+    
+    def is_rule_disabled(self, compiled_rule):
+        """Whether a rule was disabled for the rest of the current run"""
+        return compiled_rule.rule.id in self.disabled_rules
+    
+    def disable_rule(self, compiled_rule, error, session_id):
+        """Stop evaluating a rule for the rest of the run and report it on the session"""
+        rule = compiled_rule.rule
+        if rule.id in self.disabled_rules:
+            return
+        self.disabled_rules.add(rule.id)
+        logger.warning(f"Disabled rule '{rule.name}' for session {session_id}: {str(error)}")
+        try:
+            db.session.add(ProcessingError(
+                session_id=session_id,
+                error_type='rule_disabled',
+                error_message=f"Rule '{rule.name}' disabled for this session: {str(error)}",
+                record_data={
+                    'rule_id': rule.id,
+                    'rule_name': rule.name,
+                    'pattern': error.pattern,
+                    'elapsed_ms': round(error.elapsed * 1000, 1)
+                }
+            ))
+        except Exception as e:
+            logger.error(f"Error reporting disabled rule '{rule.name}': {str(e)}")
+    
+    def check_regex_conditions(self, conditions):
+        """Problems with the regex patterns of a rule's conditions, checked before the rule is saved"""
+        if isinstance(conditions, str):
+            try:
+                conditions = json.loads(conditions)
+            except (json.JSONDecodeError, TypeError):
+                return []
+        
+        problems = []
+        if isinstance(conditions, list):
+            for condition in conditions:
+                problems.extend(self.check_regex_conditions(condition))
+        elif isinstance(conditions, dict):
+            if conditions.get('operator') == 'regex':
+                pattern = conditions.get('value')
+                problems.extend(f"Regex '{pattern}': {problem}" for problem in check_pattern_complexity(str(pattern)))
+            problems.extend(self.check_regex_conditions(conditions.get('conditions')))
+        return problems
+    
+    def create_profiler(self, session_id):
+        """Rule statistics collector for a session run, None when profiling is disabled"""
+        return RuleProfiler(session_id) if self.profiling else None
+    
+    def build_pattern_matchers(self, compiled_rules):
+        """Build one multi-pattern matcher per field from the contains literals of a run's rules"""
+        literals_by_field = {}
+        for compiled_rule in compiled_rules:
+            if compiled_rule.tree is not None:
+                contains_literals(compiled_rule.tree, literals_by_field)
+        return build_pattern_matchers(literals_by_field, config.pattern_matcher_min_literals)
     
     def apply_exclusion_rules(self, session_id):
         """Apply exclusion rules to filter records before processing"""
@@ -28,10 +132,7 @@ class RuleEngine:
             logger.info(f"Applying exclusion rules for session {session_id}")
             
             # Get all active exclusion rules
-            exclusion_rules = Rule.query.filter_by(
-                rule_type='exclusion',
-                is_active=True
-            ).order_by(Rule.priority.desc()).all()
+            exclusion_rules = self.get_exclusion_rules()
             
             if not exclusion_rules:
                 logger.info("No exclusion rules found")
@@ -40,32 +141,13 @@ class RuleEngine:
             logger.info(f"Found {len(exclusion_rules)} active exclusion rules")
             for rule in exclusion_rules:
                 logger.info(f"Exclusion rule: {rule.name} - Conditions: {rule.conditions}")
+            exclusion_rules = self.compile_rules(exclusion_rules)
             
-            # Get all records for the session
-            records = EmailRecord.query.filter_by(session_id=session_id).all()
-            logger.info(f"Processing {len(records)} records for exclusion rules")
-            excluded_count = 0
-            
-            for record in records:
-                if record.excluded_by_rule:  # Already excluded
-                    continue
-                
-                # Log sample record data for debugging
-                if excluded_count < 5:  # Only log first few records
-                    logger.info(f"Sample record {record.record_id}: leaver='{record.leaver}', attachments='{record.attachments}', wordlist_attachment='{record.wordlist_attachment}'")
-                
-                for rule in exclusion_rules:
-                    try:
-                        if self._evaluate_rule_conditions(record, rule):
-                            record.excluded_by_rule = rule.name
-                            excluded_count += 1
-                            logger.info(f"Record {record.record_id} excluded by rule: {rule.name}")
-                            break  # First matching rule excludes the record
-                    except Exception as e:
-                        logger.error(f"Error evaluating exclusion rule '{rule.name}': {str(e)}")
-                        continue
+            profiler = self.create_profiler(session_id)
+            excluded_count = self._run_exclusion_rules(session_id, exclusion_rules, profiler)
+            if profiler:
+                profiler.save()
             
-            db.session.commit()
             logger.info(f"Exclusion rules applied: {excluded_count} records excluded")
             return excluded_count
             
@@ -74,16 +156,111 @@ class RuleEngine:
             db.session.rollback()
             raise
     
-    def apply_security_rules(self, session_id):
-        """Apply security rules to detect threats and violations"""
+    def _run_exclusion_rules(self, session_id, exclusion_rules, profiler=None):
+        """Evaluate compiled exclusion rules with the fastest applicable evaluator"""
+        # Leading rules that translate to SQL run as UPDATEs; the rest are evaluated in Python
+        pushed_count, excluded_count = self._push_down_exclusion_rules(session_id, exclusion_rules, profiler)
+        exclusion_rules = exclusion_rules[pushed_count:]
+        if not exclusion_rules:
+            return excluded_count
+        
+        if self.rule_evaluator == 'vectorized':
+            vectorized_count = self.vectorized_evaluator.apply_exclusion_rules(session_id, exclusion_rules, profiler)
+            if vectorized_count is not None:
+                return excluded_count + vectorized_count
+            logger.info("Exclusion rules need per-record evaluation, using row evaluator")
+        
+        # Get all records for the session
+        records = EmailRecord.query.filter_by(session_id=session_id).all()
+        logger.info(f"Processing {len(records)} records for exclusion rules")
+        matchers = self.build_pattern_matchers(exclusion_rules)
+        
+        for record in records:
+            if record.excluded_by_rule:  # Already excluded
+                continue
+            
+            # Log sample record data for debugging
+            if self.debug_logging and excluded_count < 5:  # Only log first few records
+                logger.info(f"Sample record {record.record_id}: leaver='{record.leaver}', attachments='{record.attachments}', wordlist_attachment='{record.wordlist_attachment}'")
+            
+            if self.apply_exclusion_rules_to_record(record, exclusion_rules, matchers, profiler):
+                excluded_count += 1
+        
+        db.session.commit()
+        return excluded_count
+    
+    def _push_down_exclusion_rules(self, session_id, exclusion_rules, profiler=None):
+        """Run leading translatable exclusion rules as UPDATE statements; returns (rules run, records excluded)"""
+        if not self.sql_pushdown or not exclusion_rules:
+            return 0, 0
+        
+        table = EmailRecord.__table__
+        not_excluded = db.and_(
+            table.c.session_id == session_id,
+            db.or_(table.c.excluded_by_rule.is_(None), table.c.excluded_by_rule == '')
+        )
+        statements = []
+        for compiled_rule in exclusion_rules:
+            if compiled_rule.tree is None:
+                break
+            try:
+                predicate = condition_to_sql(compiled_rule.tree, table)
+            except UntranslatableCondition as e:
+                logger.info(f"Exclusion rule '{compiled_rule.rule.name}' can't run in SQL ({str(e)}), evaluating it and later rules in Python")
+                break
+            statements.append(update(table).where(not_excluded, predicate).values(excluded_by_rule=compiled_rule.rule.name))
+        
+        if not statements:
+            return 0, 0
+        
+        # The database lower-cases ASCII only, other text is left to the Python evaluators
+        trees = [compiled_rule.tree for compiled_rule in exclusion_rules[:len(statements)]]
+        if db.session.query(db.exists().where(has_non_ascii_values(table, trees, not_excluded))).scalar():
+            logger.info("Exclusion rule fields hold non-ASCII text, evaluating exclusion rules in Python")
+            return 0, 0
+        
+        # Priority order is kept by running one UPDATE per rule over still-unexcluded records
+        db.session.flush()
+        remaining = db.session.query(db.func.count()).select_from(table).where(not_excluded).scalar() if profiler else 0
+        excluded_count = 0
+        for compiled_rule, statement in zip(exclusion_rules, statements):
+            started = time.perf_counter()
+            rowcount = db.session.execute(statement).rowcount
+            if profiler:
+                profiler.record(compiled_rule, remaining, rowcount, time.perf_counter() - started)
+                remaining -= rowcount
+            excluded_count += rowcount
+        db.session.commit()
+        logger.info(f"Applied {len(statements)} exclusion rules in SQL: {excluded_count} records excluded")
+        return len(statements), excluded_count
+    
+    def apply_exclusion_rules_to_record(self, record, exclusion_rules, matchers=None, profiler=None):
+        """Exclude a single record by the first matching compiled rule; returns the rule name or None"""
+        context = RecordContext(record, matchers)
+        for compiled_rule in exclusion_rules:
+            if self.is_rule_disabled(compiled_rule):
+                continue
+            rule = compiled_rule.rule
+            try:
+                if profiler.evaluate(compiled_rule, context) if profiler else compiled_rule.predicate(context):
+                    record.excluded_by_rule = rule.name
+                    if self.debug_logging:
+                        logger.info(f"Record {record.record_id} excluded by rule: {rule.name}")
+                    return rule.name  # First matching rule excludes the record
+            except RegexBudgetExceeded as e:
+                self.disable_rule(compiled_rule, e, record.session_id)
+            except Exception as e:
+                logger.error(f"Error evaluating exclusion rule '{rule.name}': {str(e)}")
+                continue
+        return None
+    
+    def apply_security_rules(self, session_id, record_filters=()):
+        """Apply security rules to detect threats and violations, optionally to the records matching record_filters"""
         try:
             logger.info(f"Applying security rules for session {session_id}")
             
             # Get all active security rules (including those without explicit rule_type)
-            security_rules = Rule.query.filter(
-                Rule.is_active == True,
-                db.or_(Rule.rule_type == 'security', Rule.rule_type.is_(None))
-            ).order_by(Rule.priority.desc()).all()
+            security_rules = self.get_security_rules()
             
             if not security_rules:
                 logger.info("No security rules found")
@@ -92,56 +269,14 @@ class RuleEngine:
             logger.info(f"Found {len(security_rules)} active security rules")
             for rule in security_rules:
                 logger.info(f"Security rule: {rule.name} - Conditions: {rule.conditions}")
+            security_rules = self.compile_rules(security_rules)
             
-            # Get non-excluded, non-whitelisted records
-            records = EmailRecord.query.filter(
-                EmailRecord.session_id == session_id,
-                EmailRecord.excluded_by_rule.is_(None)
-            ).filter(
-                db.or_(EmailRecord.whitelisted.is_(None), EmailRecord.whitelisted == False)
-            ).all()
-            
-            logger.info(f"Evaluating {len(records)} records against security rules")
+            # A run over part of the session would replace its statistics with the part's counts
+            profiler = self.create_profiler(session_id) if not record_filters else None
+            rule_matches = self._run_security_rules(session_id, security_rules, profiler, record_filters)
+            if profiler:
+                profiler.save()
             
-            rule_matches = []
-            matches_found = 0
-            
-            for record in records:
-                matched_rules = []
-                
-                # Log sample record data for debugging
-                if matches_found < 5:  # Only log first few records
-                    logger.info(f"Sample record {record.record_id}: leaver='{record.leaver}', attachments='{record.attachments}', wordlist_attachment='{record.wordlist_attachment}'")
-                
-                for rule in security_rules:
-                    try:
-                        if self._evaluate_rule_conditions(record, rule):
-                            logger.info(f"SECURITY MATCH: Rule '{rule.name}' matched record {record.record_id}")
-                            matched_rules.append({
-                                'rule_id': rule.id,
-                                'rule_name': rule.name,
-                                'description': rule.description,
-                                'priority': rule.priority,
-                                'actions': rule.actions
-                            })
-                            
-                            # Apply rule actions
-                            self._apply_rule_actions(record, rule)
-                            matches_found += 1
-                    except Exception as e:
-                        logger.error(f"Error evaluating rule '{rule.name}': {str(e)}")
-                        continue
-                
-                if matched_rules:
-                    record.rule_matches = json.dumps(matched_rules)
-                    rule_matches.extend(matched_rules)
-                    
-                    # Mark as Critical if any security rule matches
-                    if not record.risk_level or record.risk_level != 'Critical':
-                        record.risk_level = 'Critical'
-                        record.ml_risk_score = max(record.ml_risk_score or 0, 0.9)
-            
-            db.session.commit()
             logger.info(f"Security rules applied: {len(rule_matches)} rule matches found")
             return rule_matches
             
@@ -150,6 +285,86 @@ class RuleEngine:
             db.session.rollback()
             raise
     
+    def _run_security_rules(self, session_id, security_rules, profiler=None, record_filters=()):
+        """Evaluate compiled security rules with the fastest applicable evaluator"""
+        if self.rule_evaluator == 'vectorized':
+            rule_matches = self.vectorized_evaluator.apply_security_rules(session_id, security_rules, profiler,
+                                                                         record_filters)
+            if rule_matches is not None:
+                return rule_matches
+            logger.info("Security rules need per-record evaluation, using row evaluator")
+        
+        # Get non-excluded, non-whitelisted records
+        records = EmailRecord.query.filter(
+            EmailRecord.session_id == session_id,
+            EmailRecord.excluded_by_rule.is_(None)
+        ).filter(
+            db.or_(EmailRecord.whitelisted.is_(None), EmailRecord.whitelisted == False),
+            *record_filters
+        ).all()
+        
+        logger.info(f"Evaluating {len(records)} records against security rules")
+        
+        rule_matches = []
+        matchers = self.build_pattern_matchers(security_rules)
+        
+        for record in records:
+            # Log sample record data for debugging
+            if self.debug_logging and len(rule_matches) < 5:  # Only log first few records
+                logger.info(f"Sample record {record.record_id}: leaver='{record.leaver}', attachments='{record.attachments}', wordlist_attachment='{record.wordlist_attachment}'")
+            
+            rule_matches.extend(self.apply_security_rules_to_record(record, security_rules, matchers, profiler))
+        
+        db.session.commit()
+        return rule_matches
+    
+    def apply_security_rules_to_record(self, record, security_rules, matchers=None, profiler=None):
+        """Evaluate compiled security rules against a single record and apply their effects"""
+        matched_rules = []
+        context = RecordContext(record, matchers)
+        
+        for compiled_rule in security_rules:
+            if self.is_rule_disabled(compiled_rule):
+                continue
+            rule = compiled_rule.rule
+            try:
+                if profiler.evaluate(compiled_rule, context) if profiler else compiled_rule.predicate(context):
+                    self._record_security_match(record, rule, matched_rules)
+                    if rule.actions:
+                        # Later rules must see the updated record
+                        context.invalidate()
+            except RegexBudgetExceeded as e:
+                self.disable_rule(compiled_rule, e, record.session_id)
+            except Exception as e:
+                logger.error(f"Error evaluating rule '{rule.name}': {str(e)}")
+                continue
+        
+        self._finish_security_matches(record, matched_rules)
+        return matched_rules
+    
+    def _record_security_match(self, record, rule, matched_rules):
+        """Record a matched security rule and apply its actions to the record"""
+        if self.debug_logging:
+            logger.info(f"SECURITY MATCH: Rule '{rule.name}' matched record {record.record_id}")
+        matched_rules.append({
+            'rule_id': rule.id,
+            'rule_name': rule.name,
+            'description': rule.description,
+            'priority': rule.priority,
+            'actions': rule.actions
+        })
+        self._apply_rule_actions(record, rule)
+    
+    def _finish_security_matches(self, record, matched_rules):
+        """Store a record's security matches and raise its risk level"""
+        if matched_rules:
+            record.rule_matches = json.dumps(matched_rules)
+            
+            # Mark as Critical if any security rule matches
+            if not record.risk_level or record.risk_level != 'Critical':
+                record.risk_level = 'Critical'
+                record.ml_risk_score = max(record.ml_risk_score or 0, 0.9)
+    
     def _evaluate_rule_conditions(self, record, rule):
         """Evaluate rule conditions against a record"""
         try:
@@ -184,6 +399,8 @@ class RuleEngine:
                         result = self._evaluate_single_condition(record, cond)
                         results.append(result)
                         logger.debug(f"Condition {cond} evaluated to: {result}")
+                    except RegexBudgetExceeded:
+                        raise
                     except Exception as e:
                         logger.error(f"Error evaluating condition {cond}: {str(e)}")
                         results.append(False)
@@ -203,6 +420,8 @@ class RuleEngine:
             logger.warning(f"Unknown condition format for rule '{rule.name}': {type(conditions)}")
             return False
             
+        except RegexBudgetExceeded:
+            raise
         except Exception as e:
             logger.error(f"Error evaluating rule conditions for rule {rule.name}: {str(e)}")
             return False
@@ -263,6 +482,8 @@ class RuleEngine:
             logger.info(f"RULE DEBUG - Condition result: '{record_value}' {operator} '{value}' = {result}")
             return result
             
+        except RegexBudgetExceeded:
+            raise
         except Exception as e:
             logger.error(f"Error evaluating single condition: {str(e)}")
             return False
@@ -306,7 +527,7 @@ class RuleEngine:
             elif operator == 'regex':
                 try:
                     # Use original case for regex
-                    pattern = re.compile(str(condition_value), re.IGNORECASE | re.MULTILINE)
+                    pattern = GuardedPattern(str(condition_value))
                     result = bool(pattern.search(str(record_value)))
                 except re.error as e:
                     logger.warning(f"Invalid regex pattern '{condition_value}': {str(e)}")
@@ -339,6 +560,8 @@ class RuleEngine:
             logger.info(f"OPERATOR RESULT: {result}")
             return result
                 
+        except RegexBudgetExceeded:
+            raise
         except Exception as e:
             logger.error(f"Error applying operator {operator}: {str(e)}")
             return False
@@ -473,9 +696,11 @@ class RuleEngine:
                 actions=rule_data.get('actions', {})
             )
             
+            compiled_rule = self.compile_rules([temp_rule])[0]
+            
             matches = []
             for record in test_records:
-                if self._evaluate_rule_conditions(record, temp_rule):
+                if compiled_rule.matches(record):
                     matches.append({
                         'record_id': record.record_id,
                         'sender': record.sender,
@@ -494,6 +719,14 @@ class RuleEngine:
             logger.error(f"Error testing rule: {str(e)}")
             return {'error': str(e)}
     
+    def preview_rules(self, rules_data, session_id=None, sample_size=None, sample_limit=10):
+        """Evaluate candidate rules together over a session or a sample of recent records"""
+        try:
+            return preview_rules(self, rules_data, session_id, sample_size, sample_limit)
+        except Exception as e:
+            logger.error(f"Error previewing rules: {str(e)}")
+            return {'error': str(e)}
+    
     def get_rule_impact_preview(self, rule_id, session_id=None):
         """Preview the impact of applying a rule"""
         try:
@@ -588,6 +821,8 @@ class RuleEngine:
                 re.compile(condition.get('value', ''))
             except re.error as e:
                 errors.append(f"{prefix}: Invalid regex pattern - {str(e)}")
+        elif condition.get('operator') == 'regex':
+            errors.extend(f"{prefix}: {problem}" for problem in check_pattern_complexity(str(condition.get('value', ''))))
         
         return errors
     
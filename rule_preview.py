@@ -0,0 +1,221 @@
+"""
+Batched what-if rule previews for Email Guardian
+Evaluates many candidate rules together against a session, or a sample of recent records
+across sessions, and reports match counts, overlap between rules and sample matches. The
+record columns are kept in a cached columnar snapshot so repeated previews only pay for
+evaluating the rules.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from sqlalchemy import func
+from models import Rule, EmailRecord
+from vectorized_rules import FrameContext, evaluate_mask
+from regex_guard import RegexBudgetExceeded
+from performance_config import config
+from app import db
+
+logger = logging.getLogger(__name__)
+
+
+class RecordSnapshot:
+    """Columns of a fixed set of records, loaded on first use and kept between previews"""
+
+    def __init__(self, scope, filters, version):
+        self.scope = scope
+        self.filters = filters
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.lock = threading.Lock()
+        ids = db.session.query(EmailRecord.id).filter(*filters).order_by(EmailRecord.id).all()
+        self.ids = np.fromiter((row[0] for row in ids), dtype=np.int64, count=len(ids))
+        self.frame = FrameContext({}, len(self.ids))
+
+    @property
+    def size(self):
+        return len(self.ids)
+
+    def load(self, fields):
+        """Load the columns not yet in the snapshot; False if the records changed since it was taken"""
+        missing = [field for field in fields if field not in self.frame.columns]
+        if not missing:
+            return True
+
+        rows = db.session.query(EmailRecord.id, *[getattr(EmailRecord, field) for field in missing]).filter(
+            *self.filters
+        ).order_by(EmailRecord.id).all()
+        ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        if not np.array_equal(ids, self.ids):
+            return False
+        for index, field in enumerate(missing):
+            self.frame.columns[field] = [row[index + 1] for row in rows]
+        return True
+
+
+class SnapshotCache:
+    """LRU of record snapshots per session or sample size, refreshed when records are added or removed"""
+
+    def __init__(self, max_entries=None, ttl=None):
+        self.max_entries = max(1, max_entries or config.rule_preview_cache_size)
+        self.ttl = config.rule_preview_cache_ttl if ttl is None else ttl
+        self._snapshots = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(session_id, sample_size):
+        return ('session', session_id) if session_id else ('sample', sample_size)
+
+    def get(self, session_id=None, sample_size=None):
+        """Snapshot of a session's records, or of the most recent sample_size records; returns (snapshot, cached)"""
+        key = self._key(session_id, sample_size)
+        if session_id:
+            version = db.session.query(func.count(EmailRecord.id), func.max(EmailRecord.id)).filter(
+                EmailRecord.session_id == session_id
+            ).one()
+        else:
+            version = db.session.query(func.count(EmailRecord.id), func.max(EmailRecord.id)).one()
+        version = tuple(version)
+
+        with self._lock:
+            snapshot = self._snapshots.get(key)
+            if snapshot is not None and snapshot.version == version and \
+                    time.monotonic() - snapshot.loaded_at <= self.ttl:
+                self._snapshots.move_to_end(key)
+                return snapshot, True
+
+        if session_id:
+            filters = [EmailRecord.session_id == session_id]
+        else:
+            count, max_id = version
+            # The most recent sample_size records across all sessions
+            min_id = db.session.query(EmailRecord.id).order_by(EmailRecord.id.desc()).offset(
+                max(0, min(sample_size, count) - 1)
+            ).limit(1).scalar()
+            filters = [EmailRecord.id.between(min_id or 0, max_id or 0)]
+        snapshot = RecordSnapshot(key[0], filters, version)
+
+        with self._lock:
+            self._snapshots[key] = snapshot
+            self._snapshots.move_to_end(key)
+            while len(self._snapshots) > self.max_entries:
+                self._snapshots.popitem(last=False)
+        logger.info(f"Loaded rule preview snapshot {key} with {snapshot.size} records")
+        return snapshot, False
+
+    def invalidate(self, session_id=None, sample_size=None):
+        """Drop the snapshot of a session or sample size"""
+        with self._lock:
+            self._snapshots.pop(self._key(session_id, sample_size), None)
+
+    def clear(self):
+        """Drop all snapshots"""
+        with self._lock:
+            self._snapshots.clear()
+
+
+snapshot_cache = SnapshotCache()
+
+
+def _evaluate_candidates(rule_engine, frame, candidates):
+    """Masks of the candidate rules over a snapshot frame, recording failures on their results"""
+    frame.use_matchers(rule_engine.build_pattern_matchers([compiled_rule for _, compiled_rule, _ in candidates]))
+    evaluated = []
+    for result, compiled_rule, _ in candidates:
+        try:
+            evaluated.append((result, evaluate_mask(compiled_rule.tree, frame)))
+        except RegexBudgetExceeded as e:
+            result['error'] = str(e)
+        except Exception as e:
+            logger.error(f"Error previewing rule '{result['name']}': {str(e)}")
+            result['error'] = str(e)
+    return evaluated
+
+
+def preview_rules(rule_engine, rules_data, session_id=None, sample_size=None, sample_limit=10):
+    """Evaluate candidate rules together and report their matches and overlap"""
+    started = time.perf_counter()
+    if sample_size is not None and sample_size <= 0:
+        raise ValueError('sample_size must be a positive number of records')
+    sample_size = min(sample_size or config.rule_preview_sample_size, config.rule_preview_max_sample_size)
+
+    results = []
+    candidates = []
+    for index, rule_data in enumerate(rules_data):
+        name = rule_data.get('name') or f"Rule {index + 1}"
+        result = {'index': index, 'name': name}
+        results.append(result)
+
+        regex_problems = rule_engine.check_regex_conditions(rule_data.get('conditions'))
+        if regex_problems:
+            result['error'] = '; '.join(regex_problems)
+            continue
+        compiled_rule = rule_engine.rule_compiler.compile(Rule(
+            name=name,
+            conditions=rule_data.get('conditions'),
+            actions=rule_data.get('actions', {})
+        ))
+        fields = rule_engine.vectorized_evaluator._rule_fields([compiled_rule])
+        if fields is None:
+            result['error'] = 'Rule reads fields that can only be evaluated per record'
+            continue
+        candidates.append((result, compiled_rule, fields))
+
+    fields = sorted(set(field for _, _, rule_fields in candidates for field in rule_fields))
+    for _ in range(2):
+        snapshot, cached = snapshot_cache.get(session_id, sample_size)
+        with snapshot.lock:
+            if snapshot.load(fields):
+                evaluated = _evaluate_candidates(rule_engine, snapshot.frame, candidates)
+                break
+        # Records changed between the version check and loading the columns
+        snapshot_cache.invalidate(session_id, sample_size)
+    else:
+        raise RuntimeError('Records changed while the preview snapshot was loaded, try again')
+
+    total = snapshot.size
+    coverage = np.zeros(total, dtype=np.int32)
+    for _, mask in evaluated:
+        coverage += mask
+
+    sample_ids = {}
+    for result, mask in evaluated:
+        matched = np.flatnonzero(mask)
+        result['match_count'] = len(matched)
+        result['match_percentage'] = (len(matched) / total * 100) if total else 0
+        result['unique_matches'] = int(np.count_nonzero(mask & (coverage == 1)))
+        sample_ids[result['index']] = [int(record_id) for record_id in snapshot.ids[matched[:sample_limit]]]
+
+    overlap = []
+    for position, (result, mask) in enumerate(evaluated):
+        for other, other_mask in evaluated[position + 1:]:
+            count = int(np.count_nonzero(mask & other_mask))
+            if count:
+                overlap.append({'rules': [result['index'], other['index']], 'count': count})
+
+    records = {}
+    wanted = [record_id for ids in sample_ids.values() for record_id in ids]
+    if wanted:
+        for record in EmailRecord.query.filter(EmailRecord.id.in_(set(wanted))).all():
+            records[record.id] = {
+                'record_id': record.record_id,
+                'session_id': record.session_id,
+                'sender': record.sender,
+                'subject': (record.subject or '')[:100],  # Truncate for display
+                'recipients_email_domain': record.recipients_email_domain
+            }
+    for result in results:
+        if result['index'] in sample_ids:
+            result['sample_matches'] = [records[record_id] for record_id in sample_ids[result['index']] if record_id in records]
+
+    return {
+        'scope': 'session' if session_id else 'sample',
+        'session_id': session_id,
+        'total_tested': total,
+        'any_match_count': int(np.count_nonzero(coverage)),
+        'rules': results,
+        'overlap': overlap,
+        'snapshot_cached': cached,
+        'elapsed': time.perf_counter() - started
+    }
@@ -0,0 +1,148 @@
+"""
+Rule evaluation profiler for Email Guardian
+Records per-rule evaluation counts, matches and time for a session, samples the cost and
+pass rate of individual conditions, and stores the results as RuleStats. The condition
+statistics are fed back into the rule compiler to order conditions for short-circuiting.
+"""
+import logging
+import time
+from sqlalchemy import func
+from models import RuleStats
+from rule_compiler import build_predicate, condition_label, condition_leaves
+from performance_config import config
+from app import db
+
+logger = logging.getLogger(__name__)
+
+
+class _RuleProfile:
+    """Counters of one rule during a session run"""
+    __slots__ = ('rule_id', 'rule_type', 'evaluations', 'matches', 'total_time', 'record_evaluations', 'timed',
+                 'timed_time', 'conditions')
+
+    def __init__(self, compiled_rule):
+        self.rule_id = compiled_rule.rule.id
+        self.rule_type = compiled_rule.rule.rule_type
+        self.evaluations = 0
+        self.matches = 0
+        self.total_time = 0.0  # Measured time of whole-session evaluations
+        self.record_evaluations = 0  # Record-at-a-time evaluations, of which `timed` were sampled
+        self.timed = 0
+        self.timed_time = 0.0
+        # label -> [predicate, evaluations, passes, time]
+        self.conditions = {}
+        if compiled_rule.tree is not None:
+            for leaf in condition_leaves(compiled_rule.tree):
+                self.conditions.setdefault(condition_label(leaf), [build_predicate(leaf), 0, 0, 0.0])
+
+
+class RuleProfiler:
+    """Collects rule evaluation statistics for one session"""
+
+    def __init__(self, session_id, sample_interval=None):
+        self.session_id = session_id
+        self.sample_interval = max(1, sample_interval or config.rule_profile_sample_interval)
+        self._profiles = {}
+
+    def _profile(self, compiled_rule):
+        profile = self._profiles.get(compiled_rule)
+        if profile is None:
+            profile = self._profiles[compiled_rule] = _RuleProfile(compiled_rule)
+        return profile
+
+    def evaluate(self, compiled_rule, context):
+        """Evaluate a compiled rule against a record context, timing every sample_interval-th evaluation"""
+        profile = self._profiles.get(compiled_rule) or self._profile(compiled_rule)
+        profile.evaluations += 1
+        profile.record_evaluations += 1
+        if profile.record_evaluations % self.sample_interval != 1 % self.sample_interval:
+            result = compiled_rule.predicate(context)
+            if result:
+                profile.matches += 1
+            return result
+
+        started = time.perf_counter()
+        result = compiled_rule.predicate(context)
+        profile.timed_time += time.perf_counter() - started
+        profile.timed += 1
+        if result:
+            profile.matches += 1
+
+        # Time every condition of the sampled record on its own, without short-circuiting
+        for counters in profile.conditions.values():
+            started = time.perf_counter()
+            passed = counters[0](context)
+            counters[3] += time.perf_counter() - started
+            counters[1] += 1
+            if passed:
+                counters[2] += 1
+        return result
+
+    def record(self, compiled_rule, evaluations, matches, elapsed):
+        """Record a rule evaluated over many records at once"""
+        profile = self._profile(compiled_rule)
+        profile.evaluations += evaluations
+        profile.matches += matches
+        profile.total_time += elapsed
+
+    def record_condition(self, compiled_rule, node, evaluations, passes, elapsed):
+        """Record a condition evaluated over many records at once"""
+        counters = self._profile(compiled_rule).conditions.get(condition_label(node))
+        if counters is not None:
+            counters[1] += evaluations
+            counters[2] += passes
+            counters[3] += elapsed
+
+    def save(self):
+        """Store the collected statistics, replacing earlier runs of the same session"""
+        try:
+            for profile in self._profiles.values():
+                if profile.rule_id is None:
+                    continue
+
+                condition_stats = [
+                    {'condition': label, 'evaluations': evaluations, 'passes': passes, 'time': elapsed}
+                    for label, (_, evaluations, passes, elapsed) in profile.conditions.items() if evaluations
+                ]
+                slowest = max(condition_stats, key=lambda stats: stats['time'] / stats['evaluations'], default=None)
+
+                stats = RuleStats.query.filter_by(rule_id=profile.rule_id, session_id=self.session_id).first()
+                if stats is None:
+                    stats = RuleStats(rule_id=profile.rule_id, session_id=self.session_id)
+                    db.session.add(stats)
+                stats.rule_type = profile.rule_type
+                stats.evaluations = profile.evaluations
+                stats.matches = profile.matches
+                # Sampled record evaluations are extrapolated to the whole run
+                sampled_time = profile.timed_time * profile.record_evaluations / profile.timed if profile.timed else 0.0
+                stats.total_time = profile.total_time + sampled_time
+                stats.slowest_condition = slowest['condition'] if slowest else None
+                stats.slowest_condition_time = slowest['time'] / slowest['evaluations'] if slowest else None
+                stats.condition_stats = condition_stats or db.null()
+            db.session.commit()
+            self._profiles.clear()
+        except Exception as e:
+            logger.error(f"Error saving rule statistics for session {self.session_id}: {str(e)}")
+            db.session.rollback()
+
+
+def load_condition_stats(rule_ids):
+    """Average cost and pass rate per condition from each rule's latest profiled session"""
+    if not rule_ids:
+        return {}
+    try:
+        latest = db.session.query(func.max(RuleStats.id)).filter(
+            RuleStats.rule_id.in_(rule_ids),
+            RuleStats.condition_stats.isnot(None)
+        ).group_by(RuleStats.rule_id)
+
+        condition_stats = {}
+        for stats in RuleStats.query.filter(RuleStats.id.in_(latest.scalar_subquery())).all():
+            condition_stats[stats.rule_id] = {
+                entry['condition']: (entry['time'] / entry['evaluations'], entry['passes'] / entry['evaluations'])
+                for entry in stats.condition_stats or [] if entry.get('evaluations')
+            }
+        return condition_stats
+    except Exception as e:
+        logger.error(f"Error loading rule condition statistics: {str(e)}")
+        return {}
@@ -0,0 +1,119 @@
+"""
+SQL translation of rule conditions for Email Guardian
+Turns compiled condition trees into native SQLAlchemy expressions (trim, lower, CASE, LIKE)
+so rules run inside the database on SQLite and PostgreSQL. Text is normalized the way the
+Python evaluators normalize it for ASCII values; callers check has_non_ascii_values first,
+as SQLite's lower() leaves other characters unchanged.
+"""
+import logging
+from sqlalchemy import and_, or_, true, false, func, case, literal, Integer, Float, String
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+from rule_compiler import EMPTY_VALUES, condition_fields
+
+logger = logging.getLogger(__name__)
+
+# Characters str.strip() removes from ASCII text
+STRIP_CHARACTERS = ''.join(chr(code) for code in range(128) if chr(code).isspace())
+
+
+class UntranslatableCondition(Exception):
+    """Raised when a condition has no SQL equivalent"""
+    pass
+
+
+class strip_text(FunctionElement):
+    """Text with STRIP_CHARACTERS removed from both ends"""
+    type = String()
+    inherit_cache = True
+
+
+@compiles(strip_text)
+def _compile_strip_text(element, compiler, **kw):
+    return f"btrim({compiler.process(element.clauses, **kw)})"
+
+
+@compiles(strip_text, 'sqlite')
+def _compile_strip_text_sqlite(element, compiler, **kw):
+    return f"trim({compiler.process(element.clauses, **kw)})"
+
+
+class byte_length(FunctionElement):
+    """Length of text in bytes"""
+    type = Integer()
+    inherit_cache = True
+
+
+@compiles(byte_length)
+def _compile_byte_length(element, compiler, **kw):
+    return f"octet_length({compiler.process(element.clauses, **kw)})"
+
+
+@compiles(byte_length, 'sqlite')
+def _compile_byte_length_sqlite(element, compiler, **kw):
+    return f"length(CAST({compiler.process(element.clauses, **kw)} AS BLOB))"
+
+
+def normalized_text(column):
+    """Lower-cased stripped column value with empty markers mapped to '', as RecordContext.lower"""
+    lowered = func.lower(strip_text(func.coalesce(column, ''), literal(STRIP_CHARACTERS)))
+    return case((lowered.in_(sorted(EMPTY_VALUES)), ''), else_=lowered)
+
+
+def has_non_ascii_values(table, nodes, *filters):
+    """Expression true for rows matching filters whose text fields read by nodes hold non-ASCII values"""
+    fields = set().union(*[condition_fields(node) for node in nodes])
+    columns = [table.c[field] for field in sorted(fields, key=str)
+               if field is not None and field in table.c and isinstance(table.c[field].type, String)]
+    if not columns:
+        return false()
+    return and_(*filters, or_(*[byte_length(column) != func.length(column) for column in columns]))
+
+
+def condition_to_sql(node, table):
+    """Translate a condition tree into a SQL expression over table's columns"""
+    kind = node[0]
+    if kind == 'never':
+        return false()
+    if kind == 'always':
+        return true()
+    if kind == 'all':
+        return and_(*[condition_to_sql(child, table) for child in node[1]])
+    if kind == 'any':
+        return or_(*[condition_to_sql(child, table) for child in node[1]])
+
+    _, field, operator, operand = node
+    column = table.c.get(field) if field is not None else None
+    if column is None:
+        raise UntranslatableCondition(f"field '{field}'")
+
+    if operator in ('greater_than', 'less_than'):
+        # Python parses text with float(), only numeric columns compare the same way
+        if not isinstance(column.type, (Integer, Float)):
+            raise UntranslatableCondition(f"numeric comparison on '{field}'")
+        return column > operand if operator == 'greater_than' else column < operand
+
+    # Numbers, booleans and datetimes are stringified differently by the database
+    if not isinstance(column.type, String):
+        raise UntranslatableCondition(f"field '{field}'")
+    value = normalized_text(column)
+    if operator == 'equals':
+        return value == operand
+    if operator == 'not_equals':
+        return value != operand
+    if operator == 'contains':
+        return value.contains(operand, autoescape=True)
+    if operator == 'not_contains':
+        return ~value.contains(operand, autoescape=True)
+    if operator == 'starts_with':
+        return value.startswith(operand, autoescape=True)
+    if operator == 'ends_with':
+        return value.endswith(operand, autoescape=True)
+    if operator == 'in_list':
+        return value.in_(sorted(operand))
+    if operator == 'is_empty':
+        return value == ''
+    if operator == 'is_not_empty':
+        return value != ''
+    # Regex searches can't be given a time budget inside the database
+    raise UntranslatableCondition(f"operator '{operator}'")
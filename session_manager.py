@@ -2,8 +2,11 @@ import json
 import os
 import gzip
 import logging
+import tempfile
 from datetime import datetime
 from models import ProcessingSession, EmailRecord
+from domain_manager import DomainManager
+from performance_config import config
 from app import db
 
 logger = logging.getLogger(__name__)
@@ -12,8 +15,9 @@ class SessionManager:
     """Manages session data persistence and compression"""
 
     def __init__(self):
-        self.data_dir = 'data'
+        self.data_dir = config.data_dir
         os.makedirs(self.data_dir, exist_ok=True)
+        self.domain_manager = DomainManager()
 
     def save_session_data(self, session_id, data):
         """Save session data with automatic compression for large files"""
@@ -126,8 +130,16 @@ class SessionManager:
             }
 
             checkpoint_path = os.path.join(self.data_dir, f"{session_id}_checkpoint_{stage}.json")
-            with open(checkpoint_path, 'w', encoding='utf-8') as f:
-                json.dump(checkpoint_data, f, indent=2)
+            # Write next to the checkpoint and move it into place, so a crash never leaves a truncated file
+            handle, temp_path = tempfile.mkstemp(dir=self.data_dir, prefix='.tmp-')
+            try:
+                with os.fdopen(handle, 'w', encoding='utf-8') as f:
+                    json.dump(checkpoint_data, f, indent=2)
+                os.replace(temp_path, checkpoint_path)
+            except Exception:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
 
             logger.info(f"Checkpoint created for {session_id} at stage {stage}")
             return checkpoint_path
@@ -153,6 +165,13 @@ class SessionManager:
             logger.error(f"Error recovering checkpoint for {session_id}: {str(e)}")
             return None
 
+    def clear_session_checkpoints(self, session_id):
+        """Remove all checkpoints of a session"""
+        checkpoint_pattern = f"{session_id}_checkpoint_"
+        for filename in os.listdir(self.data_dir):
+            if filename.startswith(checkpoint_pattern):
+                os.remove(os.path.join(self.data_dir, filename))
+
     def cleanup_session(self, session_id):
         """Clean up session files and data"""
         try:
@@ -163,10 +182,7 @@ class SessionManager:
                     os.remove(session.data_path)
 
                 # Remove checkpoints
-                checkpoint_pattern = f"{session_id}_checkpoint_"
-                for filename in os.listdir(self.data_dir):
-                    if filename.startswith(checkpoint_pattern):
-                        os.remove(os.path.join(self.data_dir, filename))
+                self.clear_session_checkpoints(session_id)
 
                 # Remove uploaded file
                 upload_pattern = f"{session_id}_"
@@ -177,6 +193,7 @@ class SessionManager:
                             os.remove(os.path.join(uploads_dir, filename))
 
                 # Remove database records
+                self.domain_manager.remove_domain_stats(session_id)
                 EmailRecord.query.filter_by(session_id=session_id).delete()
                 db.session.delete(session)
                 db.session.commit()
@@ -3,10 +3,13 @@ Simple Email Guardian processor for troubleshooting
 This bypasses complex ML analysis and focuses on basic processing
 """
 
+import os
 import pandas as pd
 import logging
 from datetime import datetime
 from models import ProcessingSession, EmailRecord
+from domain_classifier import refresh_domain_classifier
+from bulk_updates import bulk_update_by_id
 from app import db
 
 logger = logging.getLogger(__name__)
@@ -28,23 +31,30 @@ class SimpleProcessor:
                 session.status = 'processing'
                 db.session.commit()
             
-            # Count total records
-            total_records = sum(1 for line in open(file_path)) - 1  # Subtract header
-            if session:
-                session.total_records = total_records
-                db.session.commit()
-            
             processed_count = 0
+            file_size = os.path.getsize(file_path)
             
-            # Process in large chunks for speed
-            for chunk_df in pd.read_csv(file_path, chunksize=self.chunk_size):
-                processed_count += self._process_simple_chunk(session_id, chunk_df, processed_count)
-                
-                # Update progress every 1000 records
-                if processed_count % 1000 == 0 and session:
-                    session.processed_records = processed_count
-                    db.session.commit()
-                    logger.info(f"Simple processing: {processed_count}/{total_records} records")
+            # Process in large chunks for speed, in a single pass over the file;
+            # progress comes from bytes consumed rather than an upfront line count
+            with open(file_path, 'rb') as csv_file:
+                for chunk_df in pd.read_csv(csv_file, chunksize=self.chunk_size):
+                    processed_count += self._process_simple_chunk(session_id, chunk_df, processed_count)
+                    bytes_read = csv_file.tell()
+                    
+                    # Update progress every 1000 records
+                    if processed_count % 1000 == 0 and session:
+                        if 0 < bytes_read < file_size:
+                            estimated_total = max(processed_count, int(round(processed_count * file_size / bytes_read)))
+                        else:
+                            estimated_total = processed_count
+                        session.processed_records = processed_count
+                        session.total_records = estimated_total
+                        db.session.commit()
+                        logger.info(f"Simple processing: {processed_count}/~{estimated_total} records")
+            
+            if session:
+                session.total_records = processed_count
+                db.session.commit()
             
             # Apply basic analysis only
             self._apply_basic_analysis(session_id)
@@ -125,6 +135,8 @@ class SimpleProcessor:
             high_risk_keywords = ['confidential', 'urgent', 'invoice', 'payment', 'personal']
             
             records = EmailRecord.query.filter_by(session_id=session_id).all()
+            domain_classifier = refresh_domain_classifier()
+            updates = []
             
             for record in records:
                 risk_score = 0.3  # Base medium risk
@@ -137,23 +149,22 @@ class SimpleProcessor:
                         risk_score += 0.2
                 
                 # Check if external domain
-                domain = record.recipients_email_domain.lower()
-                if domain and any(ext in domain for ext in ['gmail.com', 'yahoo.com', 'hotmail.com']):
+                if domain_classifier.is_public(record.recipients_email_domain, 'basic_analysis'):
                     risk_score += 0.3
                 
                 # Update risk level
                 if risk_score > 0.8:
-                    record.risk_level = 'Critical'
+                    risk_level = 'Critical'
                 elif risk_score > 0.6:
-                    record.risk_level = 'High'
+                    risk_level = 'High'
                 elif risk_score > 0.4:
-                    record.risk_level = 'Medium'
+                    risk_level = 'Medium'
                 else:
-                    record.risk_level = 'Low'
+                    risk_level = 'Low'
                 
-                record.ml_risk_score = min(risk_score, 1.0)
+                updates.append({'id': record.id, 'risk_level': risk_level, 'ml_risk_score': min(risk_score, 1.0)})
             
-            db.session.commit()
+            bulk_update_by_id(EmailRecord, updates)
             logger.info(f"Basic analysis completed for session {session_id}")
             
         except Exception as e:
@@ -0,0 +1,75 @@
+"""
+Tests of bulk record updates by primary key
+
+    python -m pytest test_bulk_updates.py
+"""
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+# Tests never touch the real database
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from app import app, db  # noqa: E402
+from models import ProcessingSession, EmailRecord  # noqa: E402
+from bulk_updates import bulk_update_by_id  # noqa: E402
+
+COMPARED_FIELDS = ['risk_level', 'ml_risk_score', 'notes', 'case_status']
+
+
+@pytest.fixture
+def record_ids():
+    with app.app_context():
+        db.session.merge(ProcessingSession(id='bulk', filename='fixture.csv'))
+        EmailRecord.query.filter_by(session_id='bulk').delete()
+        records = [EmailRecord(session_id='bulk', record_id=f'bulk_{index}', risk_level='Low', ml_risk_score=0.1,
+                               notes='original', case_status='Active') for index in range(7)]
+        db.session.add_all(records)
+        db.session.commit()
+        yield [record.id for record in records]
+        db.session.rollback()
+
+
+def stored(record_ids):
+    db.session.expire_all()
+    records = {record.id: record for record in EmailRecord.query.filter(EmailRecord.id.in_(record_ids))}
+    return [{field: getattr(records[record_id], field) for field in COMPARED_FIELDS} for record_id in record_ids]
+
+
+def test_rows_set_exactly_their_own_columns(record_ids):
+    rows = [
+        {'id': record_ids[0], 'risk_level': 'High', 'ml_risk_score': 0.9},
+        {'id': record_ids[1], 'notes': None},
+        {'id': record_ids[2], 'risk_level': 'Medium', 'ml_risk_score': 0.5},
+        {'id': record_ids[3], 'case_status': 'Escalated', 'notes': 'flagged'},
+        {'id': record_ids[4]},
+        {'id': record_ids[5], 'ml_risk_score': 0.7, 'risk_level': 'High'},
+    ]
+    assert bulk_update_by_id(EmailRecord, rows, batch_size=1) == len(rows)
+
+    original = {'risk_level': 'Low', 'ml_risk_score': 0.1, 'notes': 'original', 'case_status': 'Active'}
+    expected = [{**original, **{key: value for key, value in row.items() if key != 'id'}} for row in rows]
+    assert stored(record_ids) == expected + [original]
+
+
+def test_row_without_id_is_rejected(record_ids):
+    with pytest.raises(ValueError):
+        bulk_update_by_id(EmailRecord, [{'id': record_ids[0], 'notes': 'set'}, {'notes': 'no id'}])
+    assert stored(record_ids[:1])[0]['notes'] == 'original'
+
+
+def test_without_commit_the_transaction_stays_open(record_ids):
+    bulk_update_by_id(EmailRecord, [{'id': record_ids[0], 'risk_level': 'Critical'}], commit=False)
+    assert db.session().in_transaction()
+    assert db.session.query(EmailRecord.risk_level).filter_by(id=record_ids[0]).scalar() == 'Critical'
+
+    db.session.rollback()
+    assert stored(record_ids[:1])[0]['risk_level'] == 'Low'
+
+
+def test_no_rows():
+    assert bulk_update_by_id(EmailRecord, []) == 0
@@ -0,0 +1,132 @@
+"""
+Tests of the shared domain classifier
+
+    python -m pytest test_domain_classifier.py
+"""
+import os
+import re
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+# Tests never touch the real database
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from app import app, db  # noqa: E402
+from models import WhitelistDomain  # noqa: E402
+from domain_classifier import DomainClassifier, refresh_domain_classifier  # noqa: E402
+from domain_manager import DomainManager  # noqa: E402
+
+# Domain manager classification of earlier versions, pattern groups checked in order
+LEGACY_DOMAIN_PATTERNS = [
+    ('Corporate', [r'\.com$', r'\.corp$', r'\.org$', r'\.gov$', r'\.edu$']),
+    ('Personal', [r'gmail\.com$', r'yahoo\.com$', r'hotmail\.com$', r'outlook\.com$', r'aol\.com$',
+                  r'icloud\.com$', r'protonmail\.com$']),
+    ('Public', [r'gmail\.com$', r'yahoo\.com$', r'hotmail\.com$', r'outlook\.com$', r'live\.com$',
+                r'msn\.com$', r'ymail\.com$']),
+    ('Suspicious', [r'\.tk$', r'\.ml$', r'\.ga$', r'\.cf$', r'temp.*\.com$', r'10minutemail\.',
+                    r'guerrillamail\.', r'mailinator\.']),
+]
+
+DOMAINS = [
+    'gmail.com', 'GMail.com ', 'mail.gmail.com', 'gmail.com.evil.net', 'notgmail.com', 'aol.com', 'gmx.com',
+    'mailinator.com', 'mailinator.net', 'x.guerrillamail.org', 'tempmail.io', 'throwaway.net', 'evil.tk', 'tk',
+    'company.com', 'sales.corp.com', 'internal.example.io', 'acme-corp.io', 'acme.io', 'acme.net', 'acme.co.uk',
+    'university.edu', 'a.b.c.de', 'com', '',
+]
+
+
+@pytest.fixture
+def classifier():
+    with app.app_context():
+        WhitelistDomain.query.delete()
+        db.session.commit()
+        yield refresh_domain_classifier()
+        db.session.rollback()
+
+
+def legacy_classify_domain(domain):
+    if not domain:
+        return 'Unknown'
+    domain_lower = domain.lower()
+    for category, patterns in LEGACY_DOMAIN_PATTERNS:
+        if any(re.search(pattern, domain_lower) for pattern in patterns):
+            return category
+    if any(corp in domain_lower for corp in ['company', 'corp', 'enterprise', 'business']):
+        return 'Corporate'
+    if len(domain_lower.split('.')) == 2 and not domain_lower.endswith(('.com', '.org', '.net')):
+        return 'Suspicious'
+    return 'Corporate'
+
+
+@pytest.mark.parametrize('domain, category', [
+    ('gmail.com', 'public'),
+    ('GMail.com ', 'public'),
+    ('mail.gmail.com', 'public'),
+    # Public domains match themselves and their subdomains, never as a substring
+    ('gmail.com.evil.net', 'corporate'),
+    ('notgmail.com', 'corporate'),
+    ('aol.com', 'public'),
+    # Free email providers only the whitelist recommendations flag
+    ('gmx.com', 'corporate'),
+    ('mailinator.com', 'disposable'),
+    ('x.tempmail.io', 'disposable'),
+    ('evil.tk', 'suspicious'),
+    ('acme.io', 'suspicious'),
+    ('company.com', 'internal'),
+    ('sales.corp.com', 'internal'),
+    ('internal.example.io', 'internal'),
+    ('acme-corp.io', 'corporate'),
+    ('acme.co.uk', 'corporate'),
+    ('', 'unknown'),
+])
+def test_categories(classifier, domain, category):
+    assert classifier.category(domain) == category
+
+
+def test_whitelisted_domain_types(classifier):
+    db.session.add(WhitelistDomain(domain='acme.io', domain_type='Corporate'))
+    db.session.add(WhitelistDomain(domain='friend.net', domain_type='Personal'))
+    db.session.commit()
+    classifier = refresh_domain_classifier()
+
+    assert classifier.category('acme.io') == 'corporate'
+    assert classifier.category('mail.friend.net') == 'public'
+    # Config lists come first
+    db.session.add(WhitelistDomain(domain='gmail.com', domain_type='Corporate'))
+    db.session.commit()
+    assert refresh_domain_classifier().category('gmail.com') == 'public'
+
+
+@pytest.mark.parametrize('list_name, public', [
+    ('ml_scoring', {'gmail.com', 'mail.gmail.com', 'aol.com', 'icloud.com'}),
+    ('ml_explanations', {'gmail.com', 'mail.gmail.com'}),
+    ('advanced_analysis', {'gmail.com', 'mail.gmail.com'}),
+    ('basic_analysis', {'gmail.com', 'mail.gmail.com'}),
+    ('free_email', {'gmail.com', 'mail.gmail.com', 'aol.com', 'icloud.com', 'gmx.com', 'protonmail.com'}),
+])
+def test_public_domain_lists(classifier, list_name, public):
+    domains = ['gmail.com', 'mail.gmail.com', 'gmail.com.evil.net', 'outlook.co.uk', 'aol.com', 'icloud.com',
+               'gmx.com', 'protonmail.com', 'company.com', '']
+    assert {domain for domain in domains if classifier.is_public(domain, list_name)} == public
+    assert classifier.public_values(domains, list_name).tolist() == [domain in public for domain in domains]
+
+
+def test_outlook_only_in_lists_that_had_it(classifier):
+    assert classifier.is_public('outlook.com', 'advanced_analysis')
+    assert not classifier.is_public('outlook.com', 'basic_analysis')
+
+
+@pytest.mark.parametrize('domain', DOMAINS)
+def test_classify_domain_matches_earlier_versions(classifier, domain):
+    assert DomainManager().classify_domain(domain) == legacy_classify_domain(domain.strip())
+
+
+def test_classify_values_reuses_cached_categories():
+    classifier = DomainClassifier(DomainClassifier.config_lists())
+    categories = classifier.classify_values(['gmail.com', None, 'evil.tk', 'gmail.com'])
+    assert categories == ['public', 'unknown', 'suspicious', 'public']
+    assert classifier.category.cache_info().currsize == 3
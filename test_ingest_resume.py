@@ -0,0 +1,144 @@
+"""
+Tests of resuming an interrupted CSV ingest from the session checkpoints
+
+    python -m pytest test_ingest_resume.py
+"""
+import csv
+import json
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+# Tests never touch the real database
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from app import app, db  # noqa: E402
+from models import ProcessingSession, EmailRecord, ProcessingError, Rule, WhitelistDomain  # noqa: E402
+from data_processor import DataProcessor  # noqa: E402
+from performance_config import config  # noqa: E402
+
+ROW_COUNT = 47
+CHUNK_SIZE = 10
+DOMAINS = ['gmail.com', 'partner.com', 'company.com', 'yahoo.com', 'example.org']
+
+# Record state compared between an uninterrupted and a resumed run
+COMPARED_FIELDS = ['record_id', 'sender', 'subject', 'recipients_email_domain', 'leaver',
+                   'excluded_by_rule', 'whitelisted', 'rule_matches']
+
+
+class Crash(BaseException):
+    """Stops processing like a killed worker, past every `except Exception` handler"""
+
+
+def write_csv(path):
+    with open(path, 'w', newline='', encoding='utf-8') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(['_time', 'sender', 'subject', 'attachments', 'recipients', 'recipients_email_domain',
+                         'leaver', 'termination_date', 'wordlist_attachment', 'wordlist_subject', 'bunit',
+                         'department', 'status', 'user_response', 'final_outcome', 'justification',
+                         'policy_name'])
+        for index in range(ROW_COUNT):
+            domain = DOMAINS[index % len(DOMAINS)]
+            writer.writerow([f'2026-01-01T00:{index:02d}:00', f'user{index}@company.com',
+                             # Quoted newlines make rows and lines differ
+                             f'Report {index}\nsecond line' if index % 7 == 0 else f'Report {index}',
+                             'data.zip' if index % 3 == 0 else '', f'someone@{domain}', domain,
+                             '1' if index % 4 == 0 else '0', '', '', '', 'Sales', 'Finance',
+                             'High' if index % 2 else 'Low', '', '', '', 'Policy'])
+
+
+@pytest.fixture
+def processor(tmp_path, monkeypatch):
+    with app.app_context():
+        for model in (EmailRecord, ProcessingError, ProcessingSession, Rule, WhitelistDomain):
+            model.query.delete()
+        db.session.add(WhitelistDomain(domain='partner.com'))
+        db.session.add(Rule(name='Internal mail', rule_type='exclusion', priority=1, conditions={
+            'field': 'recipients_email_domain', 'operator': 'equals', 'value': 'company.com'}))
+        db.session.add(Rule(name='Leaver with attachments', rule_type='security', priority=1, conditions={
+            'logic': 'AND', 'conditions': [
+                {'field': 'leaver', 'operator': 'equals', 'value': '1'},
+                {'field': 'attachments', 'operator': 'is_not_empty', 'value': ''}]}))
+        db.session.commit()
+
+        processor = DataProcessor()
+        processor.chunk_size = CHUNK_SIZE
+        processor.session_manager.data_dir = str(tmp_path)
+        # Only the ingest and rule stages are compared, the ML stage is covered elsewhere
+        monkeypatch.setattr(processor, '_apply_ml_analysis', lambda *args, **kwargs: 0)
+
+        csv_path = tmp_path / 'upload.csv'
+        write_csv(csv_path)
+        processor.csv_path = str(csv_path)
+        yield processor
+        db.session.rollback()
+
+
+def session_records(session_id):
+    db.session.expire_all()
+    rows = db.session.query(*[getattr(EmailRecord, field) for field in COMPARED_FIELDS]).filter_by(
+        session_id=session_id).order_by(EmailRecord.id).all()
+    records = []
+    for row in rows:
+        record = dict(zip(COMPARED_FIELDS, row))
+        record['record_id'] = record['record_id'].split('_', 1)[1]
+        record['rule_matches'] = [match['rule_name'] for match in json.loads(record['rule_matches'] or '[]')]
+        records.append(record)
+    return records
+
+
+def add_session(session_id):
+    db.session.add(ProcessingSession(id=session_id, filename='upload.csv', status='queued'))
+    db.session.commit()
+    return session_id
+
+
+@pytest.mark.parametrize('fused_workflow', [False, True])
+@pytest.mark.parametrize('bulk_insert', [True, False])
+def test_resumed_ingest_matches_uninterrupted_run(processor, monkeypatch, fused_workflow, bulk_insert):
+    monkeypatch.setattr(config, 'fused_workflow', fused_workflow)
+    monkeypatch.setattr(config, 'bulk_insert', bulk_insert)
+
+    processor.process_csv(add_session('reference'), processor.csv_path)
+    expected = session_records('reference')
+    assert [record['record_id'] for record in expected] == [str(index) for index in range(ROW_COUNT)]
+    assert any(record['excluded_by_rule'] for record in expected)
+    assert any(record['whitelisted'] for record in expected)
+    assert any(record['rule_matches'] for record in expected)
+
+    # Crash after the third chunk is committed but before its checkpoint is saved
+    save_checkpoint = processor._save_ingest_checkpoint
+    saved = []
+
+    def crash_before_third_checkpoint(session_id, state, workflow_context=None):
+        if len(saved) == 2:
+            raise Crash()
+        saved.append(state)
+        save_checkpoint(session_id, state, workflow_context)
+    monkeypatch.setattr(processor, '_save_ingest_checkpoint', crash_before_third_checkpoint)
+
+    session_id = add_session('resumed')
+    with pytest.raises(Crash):
+        processor.process_csv(session_id, processor.csv_path)
+    db.session.rollback()
+    assert len(session_records(session_id)) == 3 * CHUNK_SIZE
+
+    # Another session writing meanwhile must not move this session's checkpoint
+    db.session.add(EmailRecord(session_id='reference', record_id='reference_late'))
+    db.session.commit()
+
+    monkeypatch.setattr(processor, '_save_ingest_checkpoint', save_checkpoint)
+    processor.process_csv(session_id, processor.csv_path, resume=True)
+
+    actual = session_records(session_id)
+    record_ids = [record['record_id'] for record in actual]
+    assert len(record_ids) == len(set(record_ids))
+    assert actual == expected
+    session = db.session.get(ProcessingSession, session_id)
+    assert session.status == 'completed'
+    assert session.processed_records == ROW_COUNT
+    assert EmailRecord.query.filter_by(session_id='reference').count() == ROW_COUNT + 1
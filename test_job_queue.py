@@ -0,0 +1,206 @@
+"""
+Tests of the persistent job queue: claims, cancellation, re-queueing and lost ownership
+Jobs are claimed and run directly, without starting the worker threads.
+
+    python -m pytest test_job_queue.py
+"""
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+# Tests never touch the real database
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from app import app, db  # noqa: E402
+from models import ProcessingJob, ProcessingSession, ProcessingError  # noqa: E402
+from job_queue import JobQueue  # noqa: E402
+
+
+@pytest.fixture
+def queue():
+    with app.app_context():
+        ProcessingJob.query.delete()
+        ProcessingError.query.delete()
+        ProcessingSession.query.delete()
+        db.session.commit()
+
+        queue = JobQueue(app, max_workers=2)
+        queue.max_concurrent_jobs = 2
+        queue.max_attempts = 2
+        queue.stale_seconds = 60
+        queue.heartbeat_interval = 0.01
+        yield queue
+        db.session.rollback()
+
+
+def add_session(session_id, status='queued'):
+    db.session.merge(ProcessingSession(id=session_id, filename=f'{session_id}.csv', status=status))
+    db.session.commit()
+    return session_id
+
+
+def job_state(job_id):
+    db.session.expire_all()
+    return ProcessingJob.query.get(job_id)
+
+
+def finish(queue, job_id, worker_id='w1'):
+    queue._finish_job(job_id, worker_id, 'completed')
+
+
+def wait_for_callback_error(progress_callback, seconds=5):
+    """Call the progress callback until the heartbeat makes it raise"""
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        progress_callback('test')
+        time.sleep(0.01)
+    raise AssertionError("progress callback never raised")
+
+
+def test_claims_respect_max_concurrent_jobs(queue):
+    jobs = [queue.enqueue('process_csv', add_session(f's{index}'), {}).id for index in range(3)]
+
+    assert queue._claim_next_job('w1') == jobs[0]
+    assert queue._claim_next_job('w1') == jobs[1]
+    assert queue._claim_next_job('w1') is None
+    assert job_state(jobs[2]).status == 'queued'
+
+    finish(queue, jobs[0])
+    assert queue._claim_next_job('w1') == jobs[2]
+
+
+def test_one_running_job_per_session(queue):
+    first = queue.enqueue('process_csv', add_session('a'), {}).id
+    second = queue.enqueue('reapply_whitelist', 'a', {'domains': ['x.com']}).id
+    other = queue.enqueue('process_csv', add_session('b'), {}).id
+
+    assert queue._claim_next_job('w1') == first
+    # The second job of session a waits, the other session's job is claimed instead
+    assert queue._claim_next_job('w1') == other
+    finish(queue, other)
+    assert queue._claim_next_job('w1') is None
+
+    finish(queue, first)
+    assert queue._claim_next_job('w1') == second
+
+
+def test_whitelist_changes_merge_into_queued_reapply_job(queue):
+    add_session('a', status='completed')
+    first = queue.enqueue_whitelist_reapplication('a', ['y.com'])
+    second = queue.enqueue_whitelist_reapplication('a', ['x.com', 'y.com'])
+
+    assert second.id == first.id
+    assert job_state(first.id).payload == {'domains': ['x.com', 'y.com']}
+    assert ProcessingJob.query.count() == 1
+
+
+def test_cancel_queued_jobs(queue):
+    process = queue.enqueue('process_csv', add_session('a'), {})
+    reapply = queue.enqueue('reapply_whitelist', add_session('b', status='completed'), {'domains': ['x.com']})
+
+    assert queue.cancel(process.id).status == 'cancelled'
+    assert queue.cancel(reapply.id).status == 'cancelled'
+    assert ProcessingSession.query.get('a').status == 'cancelled'
+    # A reapply job doesn't own the session's status
+    assert ProcessingSession.query.get('b').status == 'completed'
+    assert queue._claim_next_job('w1') is None
+
+
+def test_cancel_running_job(queue):
+    handled = []
+
+    def handler(session_id, payload, processor, progress_callback, resume=False):
+        handled.append(session_id)
+        wait_for_callback_error(progress_callback)
+    queue.job_handlers['process_csv'] = handler
+
+    job_id = queue.enqueue('process_csv', add_session('a'), {}).id
+    assert queue._claim_next_job('w1') == job_id
+
+    job = queue.cancel(job_id)
+    assert job.status == 'running'
+    assert job.cancel_requested
+
+    queue._run_job(job_id, 'w1', processor=None)
+    assert handled == ['a']
+    assert job_state(job_id).status == 'cancelled'
+
+
+def test_stale_job_requeued_until_max_attempts(queue):
+    job_id = queue.enqueue('process_csv', add_session('a'), {}).id
+    stale = datetime.utcnow() - timedelta(seconds=queue.stale_seconds * 2)
+
+    for attempt in range(1, queue.max_attempts + 1):
+        assert queue._claim_next_job(f'w{attempt}') == job_id
+        job = job_state(job_id)
+        assert job.attempts == attempt
+        job.heartbeat_at = stale
+        db.session.commit()
+
+        assert queue.requeue_interrupted_jobs() == 1
+        job = job_state(job_id)
+        if attempt < queue.max_attempts:
+            assert job.status == 'queued'
+            assert job.worker_id is None
+            assert ProcessingSession.query.get('a').status == 'queued'
+
+    assert job.status == 'failed'
+    assert ProcessingSession.query.get('a').status == 'error'
+    assert queue._claim_next_job('w1') is None
+
+
+def test_fresh_heartbeat_is_not_requeued(queue):
+    job_id = queue.enqueue('process_csv', add_session('a'), {}).id
+    assert queue._claim_next_job('w1') == job_id
+
+    assert queue.requeue_interrupted_jobs() == 0
+    assert job_state(job_id).status == 'running'
+
+
+def test_lost_ownership_leaves_new_owner_state(queue):
+    def handler(session_id, payload, processor, progress_callback, resume=False):
+        # Meanwhile the job was re-queued and claimed by another worker, which updated the session
+        job = ProcessingJob.query.get(job_id)
+        job.worker_id = 'w2'
+        job.attempts = 2
+        ProcessingSession.query.get(session_id).processed_records = 10
+        db.session.commit()
+
+        # This worker's uncommitted work must not reach the database
+        ProcessingSession.query.get(session_id).processed_records = 999
+        wait_for_callback_error(progress_callback)
+    queue.job_handlers['process_csv'] = handler
+
+    job_id = queue.enqueue('process_csv', add_session('a', status='processing'), {}).id
+    assert queue._claim_next_job('w1') == job_id
+    queue._run_job(job_id, 'w1', processor=None)
+
+    job = job_state(job_id)
+    assert job.status == 'running'
+    assert job.worker_id == 'w2'
+    assert job.error_message is None
+    session = ProcessingSession.query.get('a')
+    assert session.status == 'processing'
+    assert session.processed_records == 10
+
+
+def test_failed_reapply_job_keeps_session_status(queue):
+    def handler(session_id, payload, processor, progress_callback, resume=False):
+        raise RuntimeError('boom')
+    queue.job_handlers['reapply_whitelist'] = handler
+
+    job_id = queue.enqueue('reapply_whitelist', add_session('a', status='completed'), {'domains': ['x.com']}).id
+    assert queue._claim_next_job('w1') == job_id
+    queue._run_job(job_id, 'w1', processor=None)
+
+    job = job_state(job_id)
+    assert job.status == 'failed'
+    assert job.error_message == 'boom'
+    assert ProcessingSession.query.get('a').status == 'completed'
+    assert ProcessingError.query.filter_by(session_id='a', error_type='reapply_whitelist_failed').count() == 1
@@ -0,0 +1,210 @@
+"""
+Tests of ML feature engineering, risk scoring and scoring sample selection
+The column operations are checked against the row loop of earlier versions, which
+must give bit-identical features and risk scores.
+
+    python -m pytest test_ml_scoring.py
+"""
+import os
+import random
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+# Tests never touch the real database
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from app import app, db  # noqa: E402
+from models import AttachmentKeyword, EmailRecord, ProcessingSession  # noqa: E402
+from ml_engine import MLEngine, LEAVER_VALUES  # noqa: E402
+from domain_classifier import refresh_domain_classifier  # noqa: E402
+from performance_config import config  # noqa: E402
+
+FIXTURE_VALUES = {
+    'subject': ['', 'Quarterly report', 'Re: invoice', 'x' * 73, 'Salary details'],
+    'attachments': ['', '', 'report.pdf', 'setup.exe', 'archive.zip; notes.docx', 'hidden invoice.xlsx',
+                    'run.js.pdf', 'Payroll_2026.XLSX', 'holiday photo.jpg'],
+    'wordlist_attachment': ['', '', 'secret'],
+    'wordlist_subject': ['', '', '', 'salary'],
+    'recipients_email_domain': ['partner.com', 'gmail.com', 'mail.yahoo.com', 'aol.com', 'gmx.com',
+                                'mailinator.com', 'evil.tk', 'gmail.com.evil.net', ''],
+    'time': ['', '09:30', '23:10', 'weekend 11:00', 'Weekend 02:15', '2026-01-03T05:59'],
+    'leaver': ['', 'No', 'YES', 'true', '1', 'yes '],
+    'justification': ['', 'business need', 'Urgent', 'sent by MISTAKE', 'wrong recipient', 'Personal copy'],
+}
+
+# Free email providers named in explanations
+EXPLAINED_PUBLIC_DOMAINS = ['gmail.com', 'yahoo.com', 'hotmail.com', 'outlook.com']
+AFTER_HOURS = ['22:', '23:', '00:', '01:', '02:', '03:', '04:', '05:']
+SUSPICIOUS_JUSTIFICATION = ['urgent', 'confidential', 'personal', 'mistake', 'wrong']
+
+
+def fixture_frame(count=500, seed=7):
+    rng = random.Random(seed)
+    df = pd.DataFrame({field: [rng.choice(values) for _ in range(count)]
+                       for field, values in FIXTURE_VALUES.items()})
+    df['domain_category'] = refresh_domain_classifier().classify_values(df['recipients_email_domain'])
+    return df
+
+
+@pytest.fixture
+def engine():
+    with app.app_context():
+        AttachmentKeyword.query.delete()
+        db.session.add_all([
+            AttachmentKeyword(keyword='payroll', category='Suspicious', risk_score=8),
+            AttachmentKeyword(keyword='photo', category='Personal', risk_score=3),
+            AttachmentKeyword(keyword='report', category='Business', risk_score=5),
+        ])
+        db.session.commit()
+        yield MLEngine()
+        db.session.rollback()
+
+
+def row_loop_scoring(engine, df, anomaly_scores):
+    """Features, risk scores, levels and explanations as computed per record by earlier versions"""
+    thresholds = engine.risk_thresholds
+    features, risk_scores, risk_levels, explanations = [], [], [], []
+    for i, row in enumerate(df.itertuples(index=False)):
+        attachment_risk = engine._calculate_attachment_risk(row.attachments)
+        is_leaver = row.leaver.lower() in LEAVER_VALUES
+        has_wordlist_match = bool(row.wordlist_attachment or row.wordlist_subject)
+        is_weekend = 'weekend' in row.time.lower()
+        features.append([
+            len(row.subject), 1 if row.attachments else 0, 1 if has_wordlist_match else 0,
+            1 if row.domain_category == 'disposable' else 0, 1 if row.domain_category == 'public' else 0,
+            1 if is_weekend else 0, 1 if any(hour in row.time for hour in AFTER_HOURS) else 0,
+            1 if is_leaver else 0, attachment_risk, len(row.justification), 1 if row.justification else 0
+        ])
+
+        rule_risk = 0.0
+        if is_leaver:
+            rule_risk += 0.3
+        if row.domain_category == 'disposable':
+            rule_risk += 0.5
+        elif row.domain_category == 'public':
+            rule_risk += 0.1
+        rule_risk += attachment_risk * 0.3
+        if has_wordlist_match:
+            rule_risk += 0.2
+        if is_weekend:
+            rule_risk += 0.1
+        if any(term in row.justification.lower() for term in SUSPICIOUS_JUSTIFICATION):
+            rule_risk += 0.1
+        risk_score = min(anomaly_scores[i] * 0.4 + rule_risk * 0.6, 1.0)
+        risk_scores.append(risk_score)
+
+        if risk_score >= thresholds['critical']:
+            risk_levels.append('Critical')
+        elif risk_score >= thresholds['high']:
+            risk_levels.append('High')
+        elif risk_score >= thresholds['medium']:
+            risk_levels.append('Medium')
+        else:
+            risk_levels.append('Low')
+
+        explanation = []
+        if anomaly_scores[i] > 0.7:
+            explanation.append("Unusual communication pattern detected")
+        if is_leaver:
+            explanation.append("Sender is a leaver - high risk for data exfiltration")
+        if row.domain_category == 'disposable':
+            explanation.append("Email sent to suspicious/temporary domain")
+        elif any(row.recipients_email_domain == domain or row.recipients_email_domain.endswith('.' + domain)
+                 for domain in EXPLAINED_PUBLIC_DOMAINS):
+            explanation.append("Email sent to public domain (common for external communication)")
+        if row.attachments and attachment_risk > 0.5:
+            explanation.append("High-risk attachments detected")
+        if has_wordlist_match:
+            explanation.append("Sensitive keywords detected")
+        explanations.append("; ".join(explanation or ["Low risk communication"]))
+
+    return np.array(features, dtype=float), np.array(risk_scores), risk_levels, explanations
+
+
+def test_column_scoring_matches_row_loop(engine):
+    df = fixture_frame()
+    anomaly_scores = np.random.default_rng(7).random(len(df))
+    # Anomaly scores at the bounds and on the explanation threshold
+    anomaly_scores[:3] = [0.0, 0.7, 1.0]
+    features, risk_scores, risk_levels, explanations = row_loop_scoring(engine, df, anomaly_scores)
+
+    df['attachment_risk'] = engine._calculate_attachment_risks(df['attachments'])
+    vectorized_features = engine._engineer_features(df)
+    vectorized_scores = engine._calculate_risk_scores(df, anomaly_scores)
+
+    assert vectorized_features.shape == features.shape
+    assert np.array_equal(vectorized_features, features)
+    assert np.array_equal(vectorized_scores.view(np.int64), risk_scores.view(np.int64))
+    assert engine._assign_risk_levels(vectorized_scores).tolist() == risk_levels
+    assert engine._generate_explanations(df, anomaly_scores) == explanations
+    # The fixture reaches every risk level
+    assert set(risk_levels) == {'Critical', 'High', 'Medium', 'Low'}
+
+
+
+@pytest.mark.parametrize('stratum_counts, size', [
+    ([9000, 700, 250, 40, 9, 1], 100),
+    ([500, 500, 1], 3),
+    ([3, 3, 3, 3], 7),
+    # Fewer records in the sample than strata
+    ([50, 20, 5, 1, 1], 3),
+])
+def test_stratified_sample_allocation(stratum_counts, size):
+    strata = np.repeat(np.arange(len(stratum_counts)), stratum_counts)
+    np.random.default_rng(7).shuffle(strata)
+    record_ids = np.arange(1, len(strata) + 1) * 3
+
+    sample = MLEngine._stratified_sample(None, record_ids, strata, size)
+    assert len(sample) == size
+    assert len(set(sample.tolist())) == size
+    assert set(sample.tolist()) <= set(record_ids.tolist())
+    assert np.array_equal(sample, np.sort(sample))
+
+    sampled_counts = np.bincount(strata[np.searchsorted(record_ids, sample)], minlength=len(stratum_counts))
+    if size >= len(stratum_counts):
+        assert sampled_counts.min() >= 1
+    assert (sampled_counts <= stratum_counts).all()
+    # Larger strata never get fewer records than smaller ones
+    assert (np.diff(sampled_counts) <= 0).all()
+    assert np.array_equal(MLEngine._stratified_sample(None, record_ids, strata, size), sample)
+
+
+@pytest.mark.parametrize('max_ml_records, trained', [(100, 30), (30, 30), (12, 12)])
+def test_session_model_trains_on_sample_and_scores_every_record(engine, monkeypatch, max_ml_records, trained):
+    db.session.merge(ProcessingSession(id='scoring', filename='fixture.csv'))
+    EmailRecord.query.filter_by(session_id='scoring').delete()
+    df = fixture_frame(count=34, seed=11)
+    for index, row in enumerate(df.itertuples(index=False)):
+        db.session.add(EmailRecord(
+            session_id='scoring', record_id=f'scoring_{index}', subject=row.subject, attachments=row.attachments,
+            recipients_email_domain=row.recipients_email_domain, leaver=row.leaver, time=row.time,
+            justification=row.justification,
+            # Excluded and whitelisted records are neither sampled nor scored
+            excluded_by_rule='Internal' if index == 30 else None, whitelisted=index > 30))
+    db.session.commit()
+
+    monkeypatch.setattr(config, 'max_ml_records', max_ml_records)
+    monkeypatch.setattr(config, 'ml_batch_size', 8)
+    monkeypatch.setattr(engine, '_get_anomaly_model', lambda: None)
+    fit_session_model = engine._fit_session_model
+    training_sizes = []
+
+    def record_training_size(features):
+        training_sizes.append(len(features))
+        return fit_session_model(features)
+    monkeypatch.setattr(engine, '_fit_session_model', record_training_size)
+
+    results = engine.analyze_session('scoring')
+    assert training_sizes == [trained]
+    assert results['processing_stats']['ml_records_analyzed'] == 30
+
+    db.session.expire_all()
+    records = EmailRecord.query.filter_by(session_id='scoring').order_by(EmailRecord.id).all()
+    assert all(record.ml_risk_score is not None and record.risk_level for record in records[:30])
+    assert all(record.ml_risk_score is None for record in records[30:])
@@ -0,0 +1,75 @@
+"""
+Tests of sharded anomaly scoring across worker processes
+
+    python -m pytest test_parallel_scoring.py
+"""
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from model_registry import fit_anomaly_model, save_model_artifact, load_model_artifact  # noqa: E402
+from parallel_scoring import ScoringExecutor  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def model():
+    rng = np.random.default_rng(7)
+    return fit_anomaly_model(rng.normal(size=(500, 11)))
+
+
+@pytest.fixture
+def executor():
+    executor = ScoringExecutor(workers=2, shard_size=100)
+    yield executor
+    executor.shutdown()
+
+
+def features(rows, seed=11):
+    rng = np.random.default_rng(seed)
+    # Outliers spread the scores across the whole range
+    return np.vstack([rng.normal(size=(rows - 20, 11)), rng.normal(scale=6, size=(20, 11))])
+
+
+def test_sharded_scores_equal_in_process_scores(model, executor):
+    matrix = features(1001)
+    assert executor.shard_count(len(matrix)) == 2
+
+    scores = executor.score(model, matrix)
+    # The pool was used rather than the in-process fallback
+    assert executor._executor is not None
+    expected = model.score(matrix)
+    assert scores.dtype == expected.dtype
+    assert np.array_equal(scores.view(np.int64), expected.view(np.int64))
+
+    path = model.path
+    assert os.path.exists(path)
+    executor.release(model)
+    assert model.path is None
+    assert not os.path.exists(path)
+
+
+def test_registry_artifact_is_shared_in_place(model, executor, tmp_path):
+    path = str(tmp_path / 'v1.joblib')
+    save_model_artifact(model, path)
+    registry_model = load_model_artifact(path, 'v1')
+
+    matrix = features(400, seed=3)
+    scores = executor.score(registry_model, matrix)
+    assert np.array_equal(scores.view(np.int64), model.score(matrix).view(np.int64))
+    # Registry artifacts are not temporary, releasing the model keeps them
+    executor.release(registry_model)
+    assert registry_model.path == path
+    assert os.path.exists(path)
+
+
+def test_small_matrices_are_scored_in_process(model, executor):
+    matrix = features(150)
+    assert executor.shard_count(len(matrix)) == 1
+    assert np.array_equal(executor.score(model, matrix), model.score(matrix))
+    assert executor._executor is None
+    assert model.path is None
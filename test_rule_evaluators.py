@@ -0,0 +1,225 @@
+"""
+Differential tests of the rule evaluators
+Runs the row-at-a-time RuleEngine evaluation and the vectorized (and SQL pushdown)
+evaluation on the same fixture session and checks they leave identical records behind.
+
+    python -m pytest test_rule_evaluators.py
+"""
+import json
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+# Tests never touch the real database
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from app import app, db  # noqa: E402
+from models import ProcessingSession, EmailRecord, Rule  # noqa: E402
+from rule_engine import RuleEngine  # noqa: E402
+from performance_config import config  # noqa: E402
+
+# Record state compared between evaluators; escalated_at only by whether it is set
+COMPARED_FIELDS = ['record_id', 'excluded_by_rule', 'rule_matches', 'risk_level', 'ml_risk_score',
+                   'case_status', 'notes', 'assigned_to', 'escalated_at']
+
+FIXTURE_VALUES = {
+    'sender': ['alice@company.com', ' BOB@Gmail.com ', None, '', 'N/A'],
+    'subject': ['Salary review', 'urgent: payroll', None, 'Holiday 50%_off', ' NULL ', 'Report.PDF'],
+    'attachments': ['report.pdf', 'archive.ZIP', '', None, 'a.pdf, b.exe'],
+    'recipients_email_domain': ['gmail.com', 'company.com', 'YAHOO.COM ', None, 'none'],
+    'leaver': ['Yes', 'no', '', None, ' YES '],
+    'status': ['High', 'low', 'Medium', None],
+    'justification': ['personal backup', '', None, 'Business'],
+    'wordlist_subject': ['secret', 'payroll', '', None],
+    'ml_anomaly_score': [None, 0.1, 0.7, 12.0],
+    'ml_risk_score': [None, 0.2, 0.95],
+    'notes': [None, 'Reviewed'],
+    'whitelisted': [False, False, True, None],
+}
+
+# (rule_type, name, conditions, actions)
+FIXTURE_RULES = [
+    ('exclusion', 'Internal mail', {'field': 'recipients_email_domain', 'operator': 'equals', 'value': 'company.com'},
+     None),
+    ('exclusion', 'Low status no attachments', [{'field': 'status', 'operator': 'equals', 'value': 'LOW'},
+                                                {'field': 'attachments', 'operator': 'is_empty', 'value': ''}], None),
+    ('exclusion', 'Marker subject', {'logic': 'OR', 'conditions': [
+        {'field': 'subject', 'operator': 'contains', 'value': '50%_'},
+        {'field': 'sender', 'operator': 'in_list', 'value': 'n/a, nobody@company.com'}]}, None),
+    ('security', 'Leaver with attachments', {'logic': 'AND', 'conditions': [
+        {'field': 'leaver', 'operator': 'equals', 'value': 'yes'},
+        {'field': 'attachments', 'operator': 'is_not_empty', 'value': ''}]},
+     {'escalate': True, 'flag': True}),
+    ('security', 'Personal webmail', {'logic': 'or', 'conditions': [
+        {'field': 'recipients_email_domain', 'operator': 'in_list', 'value': ['gmail.com', 'yahoo.com']},
+        {'field': 'justification', 'operator': 'contains', 'value': 'personal'}]},
+     {'score_modifier': 0.2, 'tag': 'exfil'}),
+    ('security', 'Archive attachments', {'field': 'attachments', 'operator': 'regex', 'value': r'\.(zip|exe)$'},
+     {'assign_to': 'analyst', 'score_modifier': -0.5}),
+    ('security', 'Anomalous', {'logic': 'AND', 'conditions': [
+        {'field': 'ml_anomaly_score', 'operator': 'greater_than', 'value': '0.5'},
+        {'field': 'subject', 'operator': 'starts_with', 'value': 'URGENT'}]}, {'flag': True, 'flag_message': 'Check'}),
+    # An empty JSON list has no failing condition, so it matches every record
+    ('security', 'Empty condition list', '[]', {'tag': 'all'}),
+    # A rule without conditions never matches
+    ('security', 'No conditions', [], {'tag': 'none'}),
+    # A non-string logic operator makes the rule false rather than failing the run
+    ('security', 'Numeric logic', {'logic': 5, 'conditions': [
+        {'field': 'status', 'operator': 'is_not_empty', 'value': ''}]}, {'escalate': True}),
+    ('security', 'Nested numeric logic', {'logic': 'OR', 'conditions': [
+        {'logic': None, 'conditions': [{'field': 'leaver', 'operator': 'equals', 'value': 'no'}]},
+        {'field': 'wordlist_subject', 'operator': 'in_list', 'value': ['secret']}]}, {'tag': 'wordlist'}),
+]
+
+
+def fixture_records(count=240):
+    """Deterministic records cycling through FIXTURE_VALUES with different periods"""
+    records = []
+    for index in range(count):
+        record = {field: values[(index * (position + 1) + index // (position + 2)) % len(values)]
+                  for position, (field, values) in enumerate(FIXTURE_VALUES.items())}
+        record['record_id'] = f"record_{index}"
+        records.append(record)
+    return records
+
+
+@pytest.fixture
+def engine():
+    with app.app_context():
+        Rule.query.delete()
+        for index, (rule_type, name, conditions, actions) in enumerate(FIXTURE_RULES):
+            db.session.add(Rule(name=name, rule_type=rule_type, conditions=conditions, actions=actions,
+                                priority=len(FIXTURE_RULES) - index))
+        db.session.commit()
+        engine = RuleEngine()
+        engine.profiling = False
+        yield engine
+        db.session.rollback()
+
+
+def run_session(engine, session_id, evaluator, sql_pushdown=False):
+    """Apply exclusion and security rules to a fresh copy of the fixture session"""
+    db.session.merge(ProcessingSession(id=session_id, filename='fixture.csv'))
+    EmailRecord.query.filter_by(session_id=session_id).delete()
+    db.session.add_all(EmailRecord(session_id=session_id, **record) for record in fixture_records())
+    db.session.commit()
+
+    engine.rule_evaluator = evaluator
+    engine.sql_pushdown = sql_pushdown
+    excluded = engine.apply_exclusion_rules(session_id)
+    matches = engine.apply_security_rules(session_id)
+    db.session.expunge_all()
+
+    rows = db.session.query(*[getattr(EmailRecord, field) for field in COMPARED_FIELDS]).filter_by(
+        session_id=session_id).order_by(EmailRecord.id).all()
+    records = [dict(zip(COMPARED_FIELDS, row), escalated_at=row[-1] is not None) for row in rows]
+    return excluded, matches, records
+
+
+def matched_rule_names(record):
+    return [match['rule_name'] for match in json.loads(record['rule_matches'] or '[]')]
+
+
+def test_vectorized_matches_row_evaluator(engine, monkeypatch):
+    expected = run_session(engine, 'row', 'row')
+
+    # The vectorized run must not fall back to per-record evaluation
+    def per_record(*args, **kwargs):
+        raise AssertionError("vectorized evaluator fell back to per-record evaluation")
+    monkeypatch.setattr(engine, 'apply_exclusion_rules_to_record', per_record)
+    monkeypatch.setattr(engine, 'apply_security_rules_to_record', per_record)
+    actual = run_session(engine, 'vectorized', 'vectorized')
+
+    assert actual[0] == expected[0]
+    assert [match['rule_name'] for match in actual[1]] == [match['rule_name'] for match in expected[1]]
+    assert actual[2] == expected[2]
+
+
+def test_sql_pushdown_matches_row_evaluator(engine):
+    expected = run_session(engine, 'row', 'row')
+    actual = run_session(engine, 'sql', 'row', sql_pushdown=True)
+
+    assert actual[0] == expected[0]
+    assert actual[2] == expected[2]
+
+
+@pytest.mark.parametrize('evaluator', ['row', 'vectorized'])
+def test_condition_edge_cases(engine, evaluator):
+    _, _, records = run_session(engine, evaluator, evaluator)
+
+    evaluated = 0
+    for fixture, record in zip(fixture_records(), records):
+        if record['excluded_by_rule'] or fixture['whitelisted']:
+            assert record['rule_matches'] is None
+            continue
+        evaluated += 1
+        names = matched_rule_names(record)
+        assert 'Empty condition list' in names
+        assert 'No conditions' not in names
+        assert 'Numeric logic' not in names
+        assert 'Nested numeric logic' not in names
+    assert evaluated
+
+
+def preview_fixture_rules():
+    return [{'name': name, 'conditions': conditions, 'actions': actions}
+            for _, name, conditions, actions in FIXTURE_RULES]
+
+
+def test_preview_matches_row_evaluator(engine):
+    db.session.merge(ProcessingSession(id='preview', filename='fixture.csv'))
+    EmailRecord.query.filter_by(session_id='preview').delete()
+    db.session.add_all(EmailRecord(session_id='preview', **record) for record in fixture_records())
+    db.session.commit()
+
+    preview = engine.preview_rules(preview_fixture_rules(), session_id='preview', sample_limit=5)
+    assert 'error' not in preview
+    assert [result['name'] for result in preview['rules'] if 'error' in result] == []
+
+    records = EmailRecord.query.filter_by(session_id='preview').order_by(EmailRecord.id).all()
+    matches = [[engine._evaluate_rule_conditions(record, Rule(name=name, conditions=conditions))
+                for record in records] for _, name, conditions, _ in FIXTURE_RULES]
+    coverage = [sum(record_matches) for record_matches in zip(*matches)]
+
+    assert preview['total_tested'] == len(records)
+    assert preview['any_match_count'] == sum(1 for count in coverage if count)
+    for result, rule_matches in zip(preview['rules'], matches):
+        matched = [record for record, match in zip(records, rule_matches) if match]
+        assert result['match_count'] == len(matched), result['name']
+        assert result['unique_matches'] == sum(1 for match, count in zip(rule_matches, coverage)
+                                               if match and count == 1), result['name']
+        assert [sample['record_id'] for sample in result['sample_matches']] == \
+            [record.record_id for record in matched[:5]]
+
+    overlap = []
+    for index, rule_matches in enumerate(matches):
+        for other in range(index + 1, len(matches)):
+            count = sum(1 for match, other_match in zip(rule_matches, matches[other]) if match and other_match)
+            if count:
+                overlap.append({'rules': [index, other], 'count': count})
+    assert preview['overlap'] == overlap
+
+
+@pytest.mark.parametrize('sample_size', [0, -5])
+def test_preview_rejects_empty_samples(engine, sample_size):
+    preview = engine.preview_rules(preview_fixture_rules(), sample_size=sample_size)
+    assert 'sample_size' in preview['error']
+
+    response = app.test_client().post('/api/rules/preview', json={'rules': preview_fixture_rules(),
+                                                                  'sample_size': sample_size})
+    assert response.status_code == 400
+
+
+def test_preview_sample_is_capped(engine, monkeypatch):
+    db.session.merge(ProcessingSession(id='preview', filename='fixture.csv'))
+    db.session.add_all(EmailRecord(session_id='preview', **record) for record in fixture_records(60))
+    db.session.commit()
+    monkeypatch.setattr(config, 'rule_preview_max_sample_size', 25)
+
+    preview = engine.preview_rules(preview_fixture_rules(), sample_size=10 ** 9)
+    assert preview['total_tested'] == 25
+    assert engine.preview_rules(preview_fixture_rules(), sample_size=10)['total_tested'] == 10
@@ -0,0 +1,126 @@
+"""
+Tests of whitelist matching and re-application
+
+    python -m pytest test_whitelist.py
+"""
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+# Tests never touch the real database
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from app import app, db  # noqa: E402
+from models import ProcessingSession, EmailRecord, WhitelistDomain  # noqa: E402
+from domain_manager import DomainManager  # noqa: E402
+from whitelist_index import WhitelistIndex  # noqa: E402
+
+WHITELIST = ['partner.com', 'Vendor.co.uk ', '*.cloud.io', 'mail.example.org', 'a.b']
+
+RECORD_DOMAINS = [
+    'partner.com', 'PARTNER.COM ', 'mail.partner.com', 'a.b.partner.com', 'vendor.co.uk', 'eu.vendor.co.uk',
+    'cloud.io', 'x.cloud.io', 'example.org', 'mail.example.org', 'smtp.mail.example.org', 'partner.com.evil.net',
+    'notpartner.com', 'partner.co', 'artner.com', 'co.uk', 'uk', 'other.net', 'b', 'a.b', 'x.a.b', '', None,
+]
+
+
+@pytest.fixture
+def session_id():
+    with app.app_context():
+        WhitelistDomain.query.delete()
+        db.session.merge(ProcessingSession(id='whitelist', filename='fixture.csv', status='completed',
+                                           whitelist_applied=True))
+        EmailRecord.query.filter_by(session_id='whitelist').delete()
+        db.session.commit()
+        yield 'whitelist'
+        db.session.rollback()
+
+
+def test_bulk_whitelist_add_keeps_case_fields(session_id):
+    db.session.add_all([
+        EmailRecord(session_id=session_id, record_id='reviewed', recipients_email_domain='partner.com',
+                    rule_matches='[{"rule_name": "Leaver"}]', ml_risk_score=0.9, risk_level='High',
+                    case_status='Escalated', notes='Called the sender, legitimate', assigned_to='analyst'),
+        EmailRecord(session_id=session_id, record_id='other', recipients_email_domain='gmail.com',
+                    rule_matches='[{"rule_name": "Leaver"}]', ml_risk_score=0.8, risk_level='High',
+                    notes='Open question'),
+    ])
+    db.session.commit()
+
+    manager = DomainManager()
+    results = manager.bulk_add_domains_to_whitelist(['Partner.com '])
+    assert results['added'] == ['partner.com']
+    changes = manager.reapply_whitelist_domains(session_id, results['added'])
+    assert changes['whitelisted'] == 1
+    db.session.expunge_all()
+
+    reviewed = EmailRecord.query.filter_by(record_id='reviewed').one()
+    assert reviewed.whitelisted
+    assert reviewed.rule_matches is None
+    assert reviewed.ml_risk_score is None
+    assert reviewed.risk_level is None
+    assert reviewed.case_status == 'Escalated'
+    assert reviewed.notes == 'Called the sender, legitimate'
+    assert reviewed.assigned_to == 'analyst'
+
+    other = EmailRecord.query.filter_by(record_id='other').one()
+    assert not other.whitelisted
+    assert other.risk_level == 'High'
+    assert other.notes == 'Open question'
+
+
+def legacy_whitelisted(whitelist, domain):
+    """Whitelist check of earlier versions: direct match, then two-way substring matching"""
+    whitelist_set = set(entry.lower().strip() for entry in whitelist)
+    if not domain:
+        return False
+    domain = domain.lower().strip()
+    if domain in whitelist_set:
+        return True
+    return any(domain == whitelisted or domain.endswith('.' + whitelisted) or whitelisted.endswith('.' + domain) or
+               domain in whitelisted or whitelisted in domain for whitelisted in whitelist_set)
+
+
+@pytest.mark.parametrize('domain, expected', [
+    ('partner.com', ('partner.com', 'exact')),
+    (' Partner.COM ', ('partner.com', 'exact')),
+    ('vendor.co.uk', ('vendor.co.uk', 'exact')),
+    ('cloud.io', ('cloud.io', 'exact')),
+    ('mail.partner.com', ('partner.com', 'subdomain')),
+    ('a.b.partner.com', ('partner.com', 'subdomain')),
+    ('eu.vendor.co.uk', ('vendor.co.uk', 'subdomain')),
+    ('smtp.mail.example.org', ('mail.example.org', 'subdomain')),
+    # Parent domains of a whitelisted domain are not whitelisted
+    ('example.org', None),
+    ('co.uk', None),
+    ('b', None),
+    # Neither are domains that only contain a whitelisted domain or part of one
+    ('partner.com.evil.net', None),
+    ('notpartner.com', None),
+    ('artner.com', None),
+    ('partner.co', None),
+    ('', None),
+    (None, None),
+])
+def test_suffix_matching(domain, expected):
+    assert WhitelistIndex(WHITELIST).match(domain) == expected
+
+
+def test_legacy_mode_matches_earlier_versions():
+    index = WhitelistIndex([domain.lower().strip() for domain in WHITELIST], 'legacy')
+    legacy_whitelist = [domain.lower().strip() for domain in WHITELIST]
+    for domain in RECORD_DOMAINS:
+        assert (index.match(domain) is not None) == legacy_whitelisted(legacy_whitelist, domain), domain
+    # Substrings and parent domains still match in legacy mode
+    assert index.match('example.org') is not None
+    assert index.match('artner.com') is not None
+
+
+def test_unknown_mode_falls_back_to_suffix():
+    index = WhitelistIndex(WHITELIST, 'prefix')
+    assert index.mode == 'suffix'
+    assert index.match('partner.com.evil.net') is None
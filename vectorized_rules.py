@@ -0,0 +1,294 @@
+"""
+Vectorized rule evaluation for Email Guardian
+Loads the rule-relevant columns of a session once and evaluates compiled condition
+trees as boolean masks, as an alternative to evaluating rules record by record.
+Results are identical to RuleEngine's row-at-a-time evaluation.
+"""
+import logging
+import time
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+from models import EmailRecord
+from bulk_updates import bulk_update_by_id
+from rule_compiler import EMPTY_VALUES, condition_fields
+from regex_guard import RegexBudgetExceeded
+from app import db
+
+logger = logging.getLogger(__name__)
+
+# Fields rule actions change while later rules of the same record are still evaluated
+ACTION_FIELDS = frozenset(['case_status', 'escalated_at', 'notes', 'ml_risk_score', 'assigned_to'])
+
+# Record state read and written by the security stage
+SECURITY_STATE_FIELDS = ['record_id', 'rule_matches', 'risk_level', 'ml_risk_score', 'case_status',
+                         'escalated_at', 'notes', 'assigned_to']
+
+EMAIL_RECORD_COLUMNS = frozenset(column.name for column in EmailRecord.__table__.columns)
+
+
+class FrameContext:
+    """Column values of a set of records, converted once and shared by every rule"""
+
+    def __init__(self, columns, size, matchers=None):
+        self.columns = columns
+        self.size = size
+        self.matchers = matchers
+        self._strings = {}
+        self._text = {}
+        self._lower = {}
+        self._numbers = {}
+        self._found = {}
+
+    def use_matchers(self, matchers):
+        """Evaluate contains conditions with another set of pattern matchers"""
+        self.matchers = matchers
+        self._found.clear()
+
+    def raw(self, field):
+        """Field values as stored, '' for None and missing fields"""
+        values = self.columns.get(field)
+        if values is None:
+            return [''] * self.size
+        return ['' if value is None else value for value in values]
+
+    def strings(self, field):
+        """str() of the raw field values"""
+        if field not in self._strings:
+            self._strings[field] = [str(value) for value in self.raw(field)]
+        return self._strings[field]
+
+    def text(self, field):
+        """Stripped field values with empty markers mapped to ''"""
+        if field not in self._text:
+            text = pd.Series(self.strings(field), dtype=object).str.strip()
+            lowered = text.str.lower()
+            empty = lowered.isin(EMPTY_VALUES)
+            self._text[field] = text.where(~empty, '')
+            self._lower[field] = lowered.where(~empty, '')
+        return self._text[field]
+
+    def lower(self, field):
+        """Lower-cased normalized field values"""
+        if field not in self._lower:
+            self.text(field)
+        return self._lower[field]
+
+    def contains(self, field, literal):
+        """Mask of records whose lower-cased field value contains literal"""
+        matcher = self.matchers.get(field) if self.matchers else None
+        if matcher is None or literal not in matcher.literals:
+            return np.asarray(self.lower(field).str.contains(literal, regex=False), dtype=bool)
+        if field not in self._found:
+            # Scan each distinct value once and index the value codes by found literal
+            codes, uniques = pd.factorize(self.lower(field))
+            found_codes = {}
+            for code, value in enumerate(uniques):
+                for found in matcher.find(value):
+                    found_codes.setdefault(found, []).append(code)
+            self._found[field] = (codes, found_codes)
+        codes, found_codes = self._found[field]
+        return np.isin(codes, found_codes.get(literal, []))
+
+    def numbers(self, field):
+        """float() of the raw field values, NaN where conversion fails"""
+        if field not in self._numbers:
+            converted = {}
+            numbers = np.empty(self.size, dtype=float)
+            for index, value in enumerate(self.raw(field)):
+                try:
+                    number = converted[value]
+                except (KeyError, TypeError):
+                    try:
+                        number = float(value)
+                    except Exception:
+                        number = np.nan
+                    try:
+                        converted[value] = number
+                    except TypeError:
+                        pass
+                numbers[index] = number
+            self._numbers[field] = numbers
+        return self._numbers[field]
+
+
+def evaluate_mask(node, frame, observe=None):
+    """Evaluate a condition tree as a boolean mask over a FrameContext
+
+    observe(node, mask, elapsed) is called for every condition when given.
+    """
+    kind = node[0]
+    if kind == 'never':
+        return np.zeros(frame.size, dtype=bool)
+    if kind == 'always':
+        return np.ones(frame.size, dtype=bool)
+    if kind == 'all':
+        return np.logical_and.reduce([evaluate_mask(child, frame, observe) for child in node[1]])
+    if kind == 'any':
+        return np.logical_or.reduce([evaluate_mask(child, frame, observe) for child in node[1]])
+
+    if observe is None:
+        return _condition_mask(node, frame)
+    started = time.perf_counter()
+    mask = _condition_mask(node, frame)
+    observe(node, mask, time.perf_counter() - started)
+    return mask
+
+
+def _condition_mask(node, frame):
+    """Boolean mask of a single condition"""
+    _, field, operator, operand = node
+    if operator == 'equals':
+        mask = frame.lower(field) == operand
+    elif operator == 'contains':
+        return frame.contains(field, operand)
+    elif operator == 'not_equals':
+        mask = frame.lower(field) != operand
+    elif operator == 'not_contains':
+        return ~frame.contains(field, operand)
+    elif operator == 'starts_with':
+        mask = frame.lower(field).str.startswith(operand)
+    elif operator == 'ends_with':
+        mask = frame.lower(field).str.endswith(operand)
+    elif operator == 'in_list':
+        mask = frame.lower(field).isin(list(operand))
+    elif operator == 'regex':
+        search = operand.search
+        return np.fromiter((search(value) is not None for value in frame.strings(field)), dtype=bool, count=frame.size)
+    elif operator == 'is_empty':
+        mask = frame.text(field) == ''
+    elif operator == 'is_not_empty':
+        mask = frame.text(field) != ''
+    elif operator == 'greater_than':
+        return frame.numbers(field) > operand
+    else:
+        return frame.numbers(field) < operand
+    return np.asarray(mask, dtype=bool)
+
+
+class VectorizedRuleEvaluator:
+    """Applies compiled exclusion and security rules to a whole session with boolean masks"""
+
+    def __init__(self, rule_engine):
+        self.rule_engine = rule_engine
+
+    def _rule_fields(self, compiled_rules):
+        """Columns the rules read, or None if the rules can't be evaluated on loaded columns"""
+        fields = set()
+        for compiled_rule in compiled_rules:
+            if compiled_rule.tree is None:
+                return None
+            fields |= condition_fields(compiled_rule.tree)
+
+        for field in fields:
+            # Non-column attributes (relationships, methods) only exist on ORM objects
+            if field is not None and field not in EMAIL_RECORD_COLUMNS and hasattr(EmailRecord, field):
+                return None
+        return sorted(field for field in fields if field in EMAIL_RECORD_COLUMNS)
+
+    def _load_columns(self, session_id, fields, *filters):
+        """Load the given columns of a session's records, ordered by primary key"""
+        fields = list(dict.fromkeys(fields))
+        query = db.session.query(EmailRecord.id, *[getattr(EmailRecord, field) for field in fields]).filter(
+            EmailRecord.session_id == session_id, *filters
+        ).order_by(EmailRecord.id)
+        rows = query.all()
+
+        ids = [row[0] for row in rows]
+        columns = {field: [row[index + 1] for row in rows] for index, field in enumerate(fields)}
+        return ids, columns
+
+    def _evaluate_rules(self, session_id, compiled_rules, frame, profiler=None, eligible=None):
+        """Mask per rule; rules whose evaluation fails or that are disabled match nothing"""
+        masks = []
+        for compiled_rule in compiled_rules:
+            if self.rule_engine.is_rule_disabled(compiled_rule):
+                masks.append(np.zeros(frame.size, dtype=bool))
+                continue
+            try:
+                if profiler is None:
+                    masks.append(evaluate_mask(compiled_rule.tree, frame))
+                    continue
+
+                def observe(node, mask, elapsed, compiled_rule=compiled_rule):
+                    profiler.record_condition(compiled_rule, node, frame.size, int(mask.sum()), elapsed)
+                started = time.perf_counter()
+                mask = evaluate_mask(compiled_rule.tree, frame, observe)
+                elapsed = time.perf_counter() - started
+                if eligible is None:
+                    profiler.record(compiled_rule, frame.size, int(mask.sum()), elapsed)
+                else:
+                    profiler.record(compiled_rule, int(eligible.sum()), int((mask & eligible).sum()), elapsed)
+                masks.append(mask)
+            except RegexBudgetExceeded as e:
+                self.rule_engine.disable_rule(compiled_rule, e, session_id)
+                masks.append(np.zeros(frame.size, dtype=bool))
+            except Exception as e:
+                logger.error(f"Error evaluating rule '{compiled_rule.rule.name}': {str(e)}")
+                masks.append(np.zeros(frame.size, dtype=bool))
+        return masks
+
+    def apply_exclusion_rules(self, session_id, compiled_rules, profiler=None):
+        """Exclude records by the first matching rule in priority order; None if not vectorizable"""
+        fields = self._rule_fields(compiled_rules)
+        if fields is None:
+            return None
+
+        ids, columns = self._load_columns(session_id, fields + ['excluded_by_rule'])
+        frame = FrameContext(columns, len(ids), self.rule_engine.build_pattern_matchers(compiled_rules))
+        logger.info(f"Evaluating {len(compiled_rules)} exclusion rules on {len(ids)} records (vectorized)")
+
+        # Already excluded records keep their rule
+        remaining = np.array([not value for value in columns['excluded_by_rule']], dtype=bool)
+        updates = []
+        for compiled_rule in compiled_rules:
+            if not remaining.any():
+                break
+            mask = self._evaluate_rules(session_id, [compiled_rule], frame, profiler, remaining)[0] & remaining
+            rule_name = compiled_rule.rule.name
+            updates.extend({'id': ids[index], 'excluded_by_rule': rule_name} for index in np.flatnonzero(mask))
+            remaining &= ~mask
+
+        bulk_update_by_id(EmailRecord, updates, commit=False)
+        db.session.commit()
+        return len(updates)
+
+    def apply_security_rules(self, session_id, compiled_rules, profiler=None, record_filters=()):
+        """Apply security rules to non-excluded, non-whitelisted records; None if not vectorizable"""
+        fields = self._rule_fields(compiled_rules)
+        if fields is None or ACTION_FIELDS.intersection(fields):
+            # Rules reading fields that actions modify must see each record's updated state
+            return None
+
+        ids, columns = self._load_columns(
+            session_id, fields + SECURITY_STATE_FIELDS,
+            EmailRecord.excluded_by_rule.is_(None),
+            db.or_(EmailRecord.whitelisted.is_(None), EmailRecord.whitelisted == False),
+            *record_filters
+        )
+        frame = FrameContext(columns, len(ids), self.rule_engine.build_pattern_matchers(compiled_rules))
+        logger.info(f"Evaluating {len(compiled_rules)} security rules on {len(ids)} records (vectorized)")
+
+        masks = self._evaluate_rules(session_id, compiled_rules, frame, profiler)
+        if not masks:
+            return []
+        matched = np.logical_or.reduce(masks)
+
+        rule_matches = []
+        updates = []
+        for index in np.flatnonzero(matched):
+            record = SimpleNamespace(**{field: columns[field][index] for field in SECURITY_STATE_FIELDS})
+            matched_rules = []
+            for compiled_rule, mask in zip(compiled_rules, masks):
+                if mask[index]:
+                    self.rule_engine._record_security_match(record, compiled_rule.rule, matched_rules)
+            self.rule_engine._finish_security_matches(record, matched_rules)
+            rule_matches.extend(matched_rules)
+
+            update_row = {'id': ids[index]}
+            update_row.update((field, getattr(record, field)) for field in SECURITY_STATE_FIELDS if field != 'record_id')
+            updates.append(update_row)
+
+        bulk_update_by_id(EmailRecord, updates, commit=False)
+        db.session.commit()
+        return rule_matches
@@ -0,0 +1,84 @@
+"""
+Whitelist domain index for Email Guardian
+Resolves recipient domains against the active whitelist with an exact-match set and a
+trie over reversed domain labels, so a domain matches a whitelisted domain or any of its
+subdomains in time proportional to its number of labels. The legacy mode keeps the
+original two-way substring matching.
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+MATCH_MODES = ('suffix', 'legacy')
+
+# Marks a trie node that ends a whitelisted domain, mapped to that domain
+_TERMINAL = ''
+
+
+def normalize_domain(domain):
+    """Lower-cased domain without surrounding whitespace, dots or a leading wildcard"""
+    domain = (domain or '').lower().strip()
+    if domain.startswith('*.'):
+        domain = domain[2:]
+    return domain.strip('.')
+
+
+class WhitelistIndex:
+    """Compiled whitelist resolving each distinct domain once"""
+
+    def __init__(self, domains, mode='suffix'):
+        if mode not in MATCH_MODES:
+            logger.warning(f"Unknown whitelist match mode '{mode}', using 'suffix'")
+            mode = 'suffix'
+        self.mode = mode
+        # Legacy matching compares the stored entries as they are
+        self.domains = set(domains) if mode == 'legacy' else set(filter(None, map(normalize_domain, domains)))
+        self._trie = {}
+        for domain in self.domains:
+            node = self._trie
+            for label in reversed(domain.split('.')):
+                node = node.setdefault(label, {})
+            node[_TERMINAL] = domain
+        self._resolved = {}
+
+    def __len__(self):
+        return len(self.domains)
+
+    def match(self, domain):
+        """(whitelisted domain, match type) for a recipient domain, or None"""
+        key = (domain or '').lower().strip()
+        try:
+            return self._resolved[key]
+        except KeyError:
+            pass
+        result = self._match_legacy(key) if self.mode == 'legacy' else self._match_suffix(normalize_domain(key))
+        self._resolved[key] = result
+        return result
+
+    def _match_suffix(self, domain):
+        if not domain:
+            return None
+        if domain in self.domains:
+            return domain, 'exact'
+        node = self._trie
+        for label in reversed(domain.split('.')):
+            node = node.get(label)
+            if node is None:
+                return None
+            if _TERMINAL in node:
+                return node[_TERMINAL], 'subdomain'
+        return None
+
+    def _match_legacy(self, domain):
+        if not domain:
+            return None
+        if domain in self.domains:
+            return domain, 'exact'
+        # Any whitelisted domain that is a substring of the record domain, or the reverse
+        for whitelist_domain in self.domains:
+            if (domain.endswith('.' + whitelist_domain) or
+                    whitelist_domain.endswith('.' + domain) or
+                    domain in whitelist_domain or
+                    whitelist_domain in domain):
+                return whitelist_domain, 'partial'
+        return None
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Background worker for Email Guardian
+Runs queued processing jobs in separate OS processes so CSV ingest, rule evaluation
+and ML analysis don't share the GIL with the web server.
+
+    python worker.py --processes 4
+
+Run the web server with EMAIL_GUARDIAN_IN_PROCESS_WORKERS=false so it only enqueues
+jobs. The total number of running jobs is capped by EMAIL_GUARDIAN_MAX_CONCURRENT_JOBS.
+The web server and every worker must share the database (DATABASE_URL), the data
+directory (EMAIL_GUARDIAN_DATA_DIR, holding ingest checkpoints and anomaly models) and
+the uploads directory; workers on other hosts need them on shared storage.
+"""
+
+import argparse
+import logging
+import multiprocessing
+import signal
+import sys
+import threading
+from pathlib import Path
+
+# Add current directory to Python path
+sys.path.insert(0, str(Path(__file__).parent))
+
+logger = logging.getLogger('worker')
+
+
+def run_worker_process(index, threads):
+    """Entry point of one worker process: claim and run jobs until terminated"""
+    from app import app
+    from job_queue import JobQueue
+
+    shutdown = threading.Event()
+
+    def request_shutdown(signum, frame):
+        logger.info(f"Worker process {index} received signal {signum}, finishing current jobs")
+        shutdown.set()
+
+    signal.signal(signal.SIGTERM, request_shutdown)
+    signal.signal(signal.SIGINT, request_shutdown)
+
+    job_queue = JobQueue(app, max_workers=threads)
+    job_queue.start()
+    logger.info(f"Worker process {index} started with {threads} job threads")
+
+    while not shutdown.wait(1):
+        pass
+
+    job_queue.stop()
+    logger.info(f"Worker process {index} stopped")
+
+
+def start_worker_process(context, index, threads):
+    """Start a worker process"""
+    process = context.Process(target=run_worker_process, args=(index, threads), name=f"email-guardian-worker-{index}")
+    process.start()
+    return process
+
+
+def main():
+    from performance_config import config
+
+    parser = argparse.ArgumentParser(description='Email Guardian background job worker')
+    parser.add_argument('--processes', type=int, default=config.max_concurrent_jobs,
+                        help='Number of worker processes (default: EMAIL_GUARDIAN_MAX_CONCURRENT_JOBS)')
+    parser.add_argument('--threads', type=int, default=1,
+                        help='Job threads per worker process (default: 1)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(processName)s %(name)s %(levelname)s %(message)s')
+
+    # Spawn fresh interpreters so no database connections are inherited from this process
+    context = multiprocessing.get_context('spawn')
+    processes = {index: start_worker_process(context, index, args.threads) for index in range(args.processes)}
+    logger.info(f"Started {args.processes} worker processes with {args.threads} job threads each")
+
+    shutdown = threading.Event()
+
+    def request_shutdown(signum, frame):
+        shutdown.set()
+
+    signal.signal(signal.SIGTERM, request_shutdown)
+    signal.signal(signal.SIGINT, request_shutdown)
+
+    # Replace worker processes that die; their running jobs are re-queued by the heartbeat check
+    while not shutdown.wait(5):
+        for index, process in processes.items():
+            if not process.is_alive():
+                logger.warning(f"Worker process {index} exited with code {process.exitcode}, restarting")
+                processes[index] = start_worker_process(context, index, args.threads)
+
+    logger.info("Stopping worker processes...")
+    for process in processes.values():
+        if process.is_alive():
+            process.terminate()
+    for process in processes.values():
+        process.join()
+    logger.info("All worker processes stopped")
+
+
+if __name__ == "__main__":
+    main()